@@ -1,7 +1,17 @@
 import os
+import io
+import re
+import json
+import time
+import mmap
+import codecs
 import zipfile
 import xml.etree.ElementTree as ET
 import csv
+import itertools
+from array import array
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
 # Mapa de extensiones a lenguajes de programación
 language_map = {
@@ -90,6 +100,56 @@ COMMON_ENCODINGS = [
     'ascii'
 ]
 
+# Marcas de orden de bytes y el codec que las consume (UTF-32 antes que UTF-16: comparten prefijo)
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# Encodings en los que un byte de control no equivale a un carácter de control
+WIDE_ENCODINGS = {'utf-16', 'utf-32'}
+
+# Caracteres de control que delatan un archivo binario (todos los < 32 salvo \t, \n y \r)
+CONTROL_CHARS = [chr(code) for code in range(32) if chr(code) not in '\n\r\t']
+CONTROL_BYTES = ''.join(CONTROL_CHARS).encode('ascii')
+
+# Archivos desde este tamaño se leen con mmap en lugar de copiarlos a memoria
+MMAP_MIN_BYTES = 1024 * 1024
+
+# Caché de renderizado: índice de secciones del último archivo generado, guardado a su
+# lado como .<nombre>_cache.json (.context_cache.json para context.txt)
+CACHE_SUFFIX = '_cache.json'
+
+# Incrementar cuando cambie la salida de cualquier extractor para invalidar la caché
+EXTRACTOR_VERSION = 5
+
+# Archivos modificados tan cerca de la generación no se cachean (resolución de mtime)
+RACY_WINDOW_NS = 2_000_000_000
+
+# Extracción en paralelo: mínimo de archivos a renderizar y secciones en vuelo por proceso
+PARALLEL_MIN_FILES = 4
+RENDER_LOOKAHEAD = 4
+
+# Archivos desde este tamaño se extraen en streaming en el proceso escritor, no en el pool
+STREAM_MIN_BYTES = 8 * 1024 * 1024
+
+# Caracteres acumulados antes de codificar y entregar un bloque de sección al escritor
+SECTION_CHUNK_CHARS = 64 * 1024
+
+# Namespaces de Office Open XML en notación {uri} de ElementTree
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+S_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+A_NS = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+
+# Carpetas que nunca se recorren (además de las ocultas)
+EXCLUDED_DIRS = {'__pycache__', 'node_modules'}
+
+# Entrada del índice de archivos: ruta para abrir, ruta relativa mostrada, extensión original y stat
+FileEntry = namedtuple('FileEntry', ['path', 'relative_path', 'extension', 'stat'])
+
 def get_language(extension):
     return language_map.get(extension, 'Texto')
 
@@ -111,115 +171,180 @@ def read_csv_content(filepath):
     except Exception as e:
         return f"[Error leyendo archivo CSV: {str(e)}]"
 
-def read_docx_content(filepath):
-    """Extrae texto de un archivo DOCX"""
+def natural_key(name):
+    """Clave de ordenación numérica: sheet2.xml va antes que sheet10.xml"""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+def iter_xml_events(source):
+    """Recorre un XML con ET.iterparse liberando cada elemento en cuanto se cierra.
+
+    Genera (evento, elemento) para 'start' y 'end'. En 'end' el texto del elemento está
+    disponible hasta pedir el siguiente evento; después se vacía y se desengancha de su
+    padre, así que la memoria no crece con el tamaño del documento.
+    """
+    parents = []
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            yield event, elem
+        else:
+            parents.pop()
+            yield event, elem
+            elem.clear()
+            if parents:
+                parents[-1].remove(elem)
+
+def iter_joined_lines(lines, kind, empty_message=None):
+    """Equivalente en streaming de '\n'.join(lines) que convierte los errores en el mensaje habitual"""
+    produced = False
     try:
-        with zipfile.ZipFile(filepath) as docx:
-            # El contenido principal está en word/document.xml
-            if 'word/document.xml' in docx.namelist():
-                with docx.open('word/document.xml') as document_file:
-                    tree = ET.parse(document_file)
-                    root = tree.getroot()
-                    
-                    # Namespace para documentos Word
-                    ns = {'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'}
-                    
-                    # Extraer todos los párrafos
-                    paragraphs = []
-                    for paragraph in root.findall('.//w:p', ns):
-                        texts = []
-                        for text_elem in paragraph.findall('.//w:t', ns):
-                            if text_elem.text:
-                                texts.append(text_elem.text)
-                        if texts:
-                            paragraphs.append(''.join(texts))
-                    
-                    return '\n'.join(paragraphs)
-            else:
-                return "[Estructura DOCX no reconocida]"
+        for line in lines:
+            yield '\n' + line if produced else line
+            produced = True
     except Exception as e:
-        return f"[Error leyendo archivo DOCX: {str(e)}]"
+        yield ('\n' if produced else '') + f"[Error leyendo archivo {kind}: {str(e)}]"
+        return
+    if not produced and empty_message:
+        yield empty_message
+
+def iter_docx_paragraphs(filepath):
+    """Genera los párrafos de un DOCX en orden de documento"""
+    with zipfile.ZipFile(filepath) as docx:
+        # El contenido principal está en word/document.xml
+        if 'word/document.xml' not in docx.namelist():
+            yield "[Estructura DOCX no reconocida]"
+            return
+
+        with docx.open('word/document.xml') as document_file:
+            # Cada párrafo abierto acumula sus textos y los párrafos anidados (cuadros de texto),
+            # que se emiten después del párrafo que los contiene
+            open_paragraphs = []
+            for event, elem in iter_xml_events(document_file):
+                if elem.tag == W_NS + 'p':
+                    if event == 'start':
+                        open_paragraphs.append(([], []))
+                        continue
+                    texts, nested = open_paragraphs.pop()
+                    lines = ([''.join(texts)] if texts else []) + nested
+                    if open_paragraphs:
+                        open_paragraphs[-1][1].extend(lines)
+                    else:
+                        yield from lines
+                elif event == 'end' and elem.tag == W_NS + 't' and elem.text:
+                    for texts, _ in open_paragraphs:
+                        texts.append(elem.text)
+
+def iter_docx_content(filepath):
+    """Extrae en streaming el texto de un archivo DOCX"""
+    return iter_joined_lines(iter_docx_paragraphs(filepath), 'DOCX')
+
+def read_docx_content(filepath):
+    """Extrae texto de un archivo DOCX"""
+    return ''.join(iter_docx_content(filepath))
+
+class SharedStrings:
+    """Strings compartidos de un XLSX, cargados al primer uso en un único str con offsets"""
+
+    def __init__(self, xlsx):
+        self.xlsx = xlsx
+        self.text = None
+        self.offsets = None
+
+    def load(self):
+        buffer = io.StringIO()
+        offsets = array('Q', [0])
+        position = 0
+        if 'xl/sharedStrings.xml' in self.xlsx.namelist():
+            with self.xlsx.open('xl/sharedStrings.xml') as shared_strings_file:
+                # Cada <si> es un string (posiblemente en varios <r><t>); se ignora la fonética <rPh>
+                phonetic = 0
+                for event, elem in iter_xml_events(shared_strings_file):
+                    if elem.tag == S_NS + 'rPh':
+                        phonetic += 1 if event == 'start' else -1
+                    elif event != 'end':
+                        continue
+                    elif elem.tag == S_NS + 't' and elem.text and not phonetic:
+                        position += buffer.write(elem.text)
+                    elif elem.tag == S_NS + 'si':
+                        offsets.append(position)
+        self.text = buffer.getvalue()
+        self.offsets = offsets
+
+    def __len__(self):
+        if self.offsets is None:
+            self.load()
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if self.offsets is None:
+            self.load()
+        return self.text[self.offsets[idx]:self.offsets[idx + 1]]
+
+def iter_xlsx_lines(filepath):
+    """Genera, hoja por hoja, la cabecera de cada hoja y los valores de sus celdas"""
+    with zipfile.ZipFile(filepath) as xlsx:
+        shared_strings = SharedStrings(xlsx)
+
+        # Buscar en todas las hojas de cálculo, en orden numérico
+        sheet_files = sorted((name for name in xlsx.namelist()
+                              if name.startswith('xl/worksheets/sheet') and name.endswith('.xml')),
+                             key=natural_key)
+
+        for sheet_file in sheet_files:
+            with xlsx.open(sheet_file) as sheet_file_obj:
+                has_data = False
+                cell_type = value = None
+                for event, elem in iter_xml_events(sheet_file_obj):
+                    if elem.tag == S_NS + 'c':
+                        if event == 'start':
+                            cell_type, value = elem.get('t'), None
+                            continue
+                        # Si es un string compartido
+                        if value and cell_type == 's':
+                            idx = int(value)
+                            value = shared_strings[idx] if 0 <= idx < len(shared_strings) else None
+                        if value:
+                            if not has_data:
+                                has_data = True
+                                yield f"--- Hoja: {os.path.basename(sheet_file)} ---"
+                            yield value
+                        value = None
+                    elif event == 'end' and elem.tag == S_NS + 'v' and value is None:
+                        value = elem.text or ''
+
+def iter_xlsx_content(filepath):
+    """Extrae en streaming el texto de un archivo XLSX (solo valores de celdas)"""
+    return iter_joined_lines(iter_xlsx_lines(filepath), 'XLSX', "[Archivo XLSX vacío o sin datos legibles]")
 
 def read_xlsx_content(filepath):
     """Extrae texto de un archivo XLSX (solo valores de celdas)"""
-    try:
-        with zipfile.ZipFile(filepath) as xlsx:
-            # Primero, obtener los strings compartidos si existen
-            shared_strings = []
-            if 'xl/sharedStrings.xml' in xlsx.namelist():
-                with xlsx.open('xl/sharedStrings.xml') as shared_strings_file:
-                    tree = ET.parse(shared_strings_file)
-                    root = tree.getroot()
-                    ns = {'': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
-                    
-                    for string_elem in root.findall('.//t', ns):
-                        if string_elem.text:
-                            shared_strings.append(string_elem.text)
-            
-            # Buscar en todas las hojas de cálculo
-            sheets_content = []
-            sheet_files = [name for name in xlsx.namelist() 
-                          if name.startswith('xl/worksheets/sheet') and name.endswith('.xml')]
-            
-            for sheet_file in sheet_files:
-                with xlsx.open(sheet_file) as sheet_file_obj:
-                    tree = ET.parse(sheet_file_obj)
-                    root = tree.getroot()
-                    ns = {'': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
-                    
-                    # Extraer valores de celdas
-                    sheet_data = []
-                    for cell in root.findall('.//c', ns):
-                        value_elem = cell.find('.//v', ns)
-                        if value_elem is not None and value_elem.text:
-                            # Si es un string compartido
-                            if cell.get('t') == 's':
-                                idx = int(value_elem.text)
-                                if idx < len(shared_strings):
-                                    sheet_data.append(shared_strings[idx])
-                            else:
-                                sheet_data.append(value_elem.text)
-                    
-                    if sheet_data:
-                        sheet_name = os.path.basename(sheet_file)
-                        sheets_content.append(f"--- Hoja: {sheet_name} ---")
-                        sheets_content.extend(sheet_data)
-            
-            return '\n'.join(sheets_content) if sheets_content else "[Archivo XLSX vacío o sin datos legibles]"
-    except Exception as e:
-        return f"[Error leyendo archivo XLSX: {str(e)}]"
+    return ''.join(iter_xlsx_content(filepath))
+
+def iter_pptx_lines(filepath):
+    """Genera, diapositiva por diapositiva, su cabecera y sus textos"""
+    with zipfile.ZipFile(filepath) as pptx:
+        # Buscar en todas las diapositivas, en orden numérico
+        slide_files = sorted((name for name in pptx.namelist()
+                              if name.startswith('ppt/slides/slide') and name.endswith('.xml')),
+                             key=natural_key)
+
+        for slide_file in slide_files:
+            with pptx.open(slide_file) as slide_file_obj:
+                has_text = False
+                for event, elem in iter_xml_events(slide_file_obj):
+                    if event == 'end' and elem.tag == A_NS + 't' and elem.text:
+                        if not has_text:
+                            has_text = True
+                            yield f"--- Diapositiva: {os.path.basename(slide_file)} ---"
+                        yield elem.text
+
+def iter_pptx_content(filepath):
+    """Extrae en streaming el texto de un archivo PPTX"""
+    return iter_joined_lines(iter_pptx_lines(filepath), 'PPTX', "[Archivo PPTX vacío o sin texto legible]")
 
 def read_pptx_content(filepath):
     """Extrae texto de un archivo PPTX"""
-    try:
-        with zipfile.ZipFile(filepath) as pptx:
-            # Buscar en todas las diapositivas
-            slides_content = []
-            slide_files = [name for name in pptx.namelist() 
-                          if name.startswith('ppt/slides/slide') and name.endswith('.xml')]
-            
-            for slide_file in slide_files:
-                with pptx.open(slide_file) as slide_file_obj:
-                    tree = ET.parse(slide_file_obj)
-                    root = tree.getroot()
-                    
-                    # Namespace para presentaciones
-                    ns = {'a': 'http://schemas.openxmlformats.org/drawingml/2006/main'}
-                    
-                    # Extraer texto de la diapositiva
-                    slide_texts = []
-                    for text_elem in root.findall('.//a:t', ns):
-                        if text_elem.text:
-                            slide_texts.append(text_elem.text)
-                    
-                    if slide_texts:
-                        slide_name = os.path.basename(slide_file)
-                        slides_content.append(f"--- Diapositiva: {slide_name} ---")
-                        slides_content.extend(slide_texts)
-            
-            return '\n'.join(slides_content) if slides_content else "[Archivo PPTX vacío o sin texto legible]"
-    except Exception as e:
-        return f"[Error leyendo archivo PPTX: {str(e)}]"
+    return ''.join(iter_pptx_content(filepath))
 
 def read_file_content(filepath):
     """Lee el contenido de un archivo probando múltiples encodings o métodos específicos"""
@@ -236,60 +361,189 @@ def read_file_content(filepath):
     elif ext == '.pptx':
         return read_pptx_content(filepath)
     else:
-        # Para el resto de archivos, usar el método de probar encodings
+        # Para el resto de archivos, detectar el encoding en memoria
+        return read_text_content(filepath)[0]
+
+def normalize_newlines(text):
+    """Convierte \\r\\n y \\r en \\n, igual que la lectura en modo texto"""
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+def count_control_bytes(data):
+    """Cuenta los bytes de control de data (bytes o mmap) con bytes.translate, por bloques"""
+    if isinstance(data, bytes):
+        return len(data) - len(data.translate(None, CONTROL_BYTES))
+    total = 0
+    for start in range(0, len(data), MMAP_MIN_BYTES):
+        block = data[start:start + MMAP_MIN_BYTES]
+        total += len(block) - len(block.translate(None, CONTROL_BYTES))
+    return total
+
+def sniff_bom(data):
+    """Devuelve el codec correspondiente a la marca de orden de bytes de data, si la tiene"""
+    for bom, encoding in BOMS:
+        if data[:len(bom)] == bom:
+            return encoding
+    return None
+
+def decode_text(data, encodings):
+    """Decodifica data en memoria con el primer encoding que no parezca un archivo binario.
+
+    Devuelve (texto, encoding) o (None, None). Los bytes de control se cuentan una sola
+    vez, ya que en los encodings compatibles con ASCII coinciden con los caracteres.
+    """
+    control_bytes = None
+    for encoding in encodings:
+        # Sin BOM no se acepta UTF-16/32: la lectura en modo texto llegaba a probar
+        # 'utf-16', pero su decodificador falla si el archivo no empieza por BOM
+        if encoding in WIDE_ENCODINGS and sniff_bom(data) != encoding:
+            continue
         try:
-            with open(filepath, 'rb') as f:
-                raw_data = f.read(1024)
-                
-            # Detectar archivos binarios
-            if b'\x00' in raw_data:
-                return "[Archivo binario - omitido]"
-        except Exception:
-            return "[Error accediendo al archivo]"
-        
-        # Probar diferentes encodings
-        for encoding in COMMON_ENCODINGS:
+            text = normalize_newlines(str(data, encoding))
+        except (UnicodeError, LookupError):
+            continue
+
+        if encoding in WIDE_ENCODINGS:
+            control_chars = sum(map(text.count, CONTROL_CHARS))
+        else:
+            if control_bytes is None:
+                control_bytes = count_control_bytes(data)
+            control_chars = control_bytes
+
+        # Verificar si hay muchos caracteres de control (posible archivo binario)
+        if control_chars > len(text) * 0.1:
+            continue
+        return text, encoding
+    return None, None
+
+def read_text_content(filepath, known=None):
+    """Lee un archivo de texto una sola vez (con mmap si es grande) y detecta su encoding en memoria.
+
+    known es un (tamaño, mtime_ns, encoding) guardado en la caché de renderizado: si el
+    archivo no ha cambiado se prueba primero ese encoding. Devuelve (texto, encoding
+    detectado o None si no se pudo detectar).
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size >= MMAP_MIN_BYTES:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = f.read()
+    except Exception:
+        return "[Error accediendo al archivo]", None
+
+    try:
+        bom_encoding = sniff_bom(data)
+
+        # Detectar archivos binarios; solo un texto UTF-16/32 con BOM puede llevar bytes nulos
+        if data.find(b'\x00', 0, 1024) != -1:
+            text, encoding = None, None
+            if bom_encoding in WIDE_ENCODINGS:
+                text, encoding = decode_text(data, [bom_encoding])
+            if text is None:
+                return "[Archivo binario - omitido]", None
+            return text, encoding
+
+        # Primero el encoding ya detectado para este mismo archivo y el indicado por su BOM
+        candidates = []
+        if known and known[2] and list(known[:2]) == [stat.st_size, stat.st_mtime_ns]:
+            candidates.append(known[2])
+        if bom_encoding:
+            candidates.append(bom_encoding)
+        text, encoding = decode_text(data, candidates)
+
+        if text is None:
+            # Probar diferentes encodings
+            text, encoding = decode_text(data, COMMON_ENCODINGS)
+
+        if text is None:
+            # Último intento con manejo de errores
+            return normalize_newlines(str(data, 'utf-8', errors='replace')), None
+        return text, encoding
+    except Exception:
+        return "[No se pudo leer el archivo con ningún encoding compatible]", None
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+# Extractores que entregan el texto por partes en lugar de un único str
+STREAMING_EXTRACTORS = {
+    '.docx': iter_docx_content,
+    '.xlsx': iter_xlsx_content,
+    '.pptx': iter_pptx_content,
+}
+
+def open_file_content(filepath, known=None):
+    """Igual que read_file_content, pero entrega el texto de los documentos Office por partes.
+
+    Devuelve (partes del texto, encoding detectado o None); known es el encoding
+    guardado para el archivo, como en read_text_content.
+    """
+    _, ext = os.path.splitext(filepath)
+    ext = ext.lower()
+    extractor = STREAMING_EXTRACTORS.get(ext)
+    if extractor is not None:
+        return extractor(filepath), None
+    if ext == '.csv':
+        return [read_csv_content(filepath)], None
+    text, encoding = read_text_content(filepath, known)
+    return [text], encoding
+
+def scan_files(base='.'):
+    """Recorre el directorio una sola vez con os.scandir y devuelve el índice de archivos reconocidos.
+
+    Conserva el orden de os.walk (archivos de cada carpeta y luego sus subcarpetas)
+    y guarda el stat de cada archivo para no volver a consultarlo al escribir.
+    """
+    index = []
+    pending = [(base, '')]
+
+    while pending:
+        directory, prefix = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                entries = list(entries)
+        except OSError:
+            continue
+
+        subdirs = []
+        for entry in entries:
             try:
-                with open(filepath, 'r', encoding=encoding) as file:
-                    content = file.read()
-                    # Verificar si hay muchos caracteres de control (posible archivo binario)
-                    control_chars = sum(1 for char in content if ord(char) < 32 and char not in '\n\r\t')
-                    if control_chars > len(content) * 0.1:
-                        continue
-                    return content
-            except (UnicodeDecodeError, UnicodeError):
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            if is_dir:
+                # Filtrar carpetas ocultas y de sistema; los enlaces a carpetas no se siguen
+                if not entry.name.startswith('.') and entry.name not in EXCLUDED_DIRS and not entry.is_symlink():
+                    subdirs.append((entry.path, prefix + entry.name + os.sep))
                 continue
-            except Exception:
+
+            _, ext = os.path.splitext(entry.name)
+            # Solo indexar si tiene extensión Y está en el language_map
+            if not ext or ext.lower() not in language_map:
                 continue
-        
-        # Último intento con manejo de errores
-        try:
-            with open(filepath, 'r', encoding='utf-8', errors='replace') as file:
-                return file.read()
-        except Exception:
-            return "[No se pudo leer el archivo con ningún encoding compatible]"
-
-def get_available_extensions():
-    """Obtiene todas las extensiones disponibles en el directorio actual que están en language_map"""
-    extensions = set()
-    
-    for root, dirs, files in os.walk('.'):
-        # Filtrar carpetas ocultas y de sistema
-        dirs[:] = [d for d in dirs if not d.startswith('.') and d != '__pycache__' and d != 'node_modules']
-        
-        for filename in files:
-            filepath = os.path.join(root, filename)
-            if os.path.isfile(filepath):
-                _, ext = os.path.splitext(filename)
-                # Solo agregar si tiene extensión Y está en el language_map
-                if ext and ext.lower() in language_map:
-                    extensions.add(ext.lower())
-    
-    return sorted(extensions)
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            index.append(FileEntry(entry.path, prefix + entry.name, ext, stat))
 
-def select_extensions_interactively():
+        pending.extend(reversed(subdirs))
+
+    return index
+
+def get_available_extensions(index):
+    """Obtiene todas las extensiones del índice de archivos que están en language_map"""
+    return sorted({entry.extension.lower() for entry in index})
+
+def select_extensions_interactively(index):
     """Permite al usuario seleccionar extensiones de forma interactiva"""
-    available_extensions = get_available_extensions()
+    available_extensions = get_available_extensions(index)
     
     if not available_extensions:
         print("No se encontraron archivos con extensiones reconocidas en el directorio actual.")
@@ -344,6 +598,210 @@ def select_extensions_interactively():
         else:
             print("Por favor, ingresa una selección válida.")
 
+def render_cache_path(output_file):
+    """Ruta de la caché de renderizado de output_file, en su mismo directorio"""
+    directory, filename = os.path.split(output_file)
+    return os.path.join(directory, '.' + os.path.splitext(filename)[0] + CACHE_SUFFIX)
+
+def load_render_cache(output_file):
+    """Carga las entradas de la ejecución anterior: [tamaño, mtime_ns, offset, longitud, encoding].
+
+    Devuelve (entradas, offsets_validos). Los encodings sirven mientras no cambie
+    EXTRACTOR_VERSION; los offsets, solo si output_file es exactamente el que se generó.
+    """
+    try:
+        with open(render_cache_path(output_file), 'r', encoding='utf-8') as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return {}, False
+    if not isinstance(cache, dict) or cache.get('version') != EXTRACTOR_VERSION:
+        return {}, False
+
+    try:
+        stat = os.stat(output_file)
+        offsets_valid = (cache.get('linesep') == os.linesep
+                         and cache.get('output') == [stat.st_size, stat.st_mtime_ns])
+    except OSError:
+        offsets_valid = False
+    return cache.get('sections', {}), offsets_valid
+
+def save_render_cache(output_file, sections):
+    """Guarda las entradas (tamaño, mtime, offset, longitud, encoding) del context.txt recién generado"""
+    stat = os.stat(output_file)
+    cache = {
+        'version': EXTRACTOR_VERSION,
+        'linesep': os.linesep,
+        'output': [stat.st_size, stat.st_mtime_ns],
+        'sections': sections,
+    }
+    cache_path = render_cache_path(output_file)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as cache_file:
+        json.dump(cache, cache_file, separators=(',', ':'))
+    os.replace(tmp_path, cache_path)
+
+def encode_output(text):
+    """Codifica texto igual que un archivo abierto en modo texto con encoding utf-8"""
+    if os.linesep != '\n':
+        text = text.replace('\n', os.linesep)
+    return text.encode('utf-8')
+
+def iter_section(relative_path, language, content):
+    """Genera la sección de context.txt de un archivo en bloques de bytes ya codificados"""
+    yield encode_output(f'./{relative_path}\n`{language}\n')
+    pieces = []
+    pending = 0
+    for piece in content:
+        pieces.append(piece)
+        pending += len(piece)
+        if pending >= SECTION_CHUNK_CHARS:
+            yield encode_output(''.join(pieces))
+            pieces.clear()
+            pending = 0
+    pieces.append('`\n\n')
+    yield encode_output(''.join(pieces))
+
+def open_section(filepath, relative_path, language, known=None):
+    """Prepara la sección de un archivo: devuelve (bloques de bytes, encoding detectado o None)"""
+    content, encoding = open_file_content(filepath, known)
+    return iter_section(relative_path, language, content), encoding
+
+def render_section(filepath, relative_path, language, known=None):
+    """Genera la sección de context.txt de un archivo, ya codificada, y su encoding detectado"""
+    chunks, encoding = open_section(filepath, relative_path, language, known)
+    return b''.join(chunks), encoding
+
+def iter_rendered_sections(entries, workers, known_encodings):
+    """Renderiza las secciones en un pool de procesos y las devuelve en el orden de entries.
+
+    Cada sección se entrega como (iterable de bloques de bytes, encoding detectado) en
+    cuanto ella y todas las anteriores están listas; como mucho hay
+    workers * RENDER_LOOKAHEAD secciones pendientes en memoria. known_encodings lleva a
+    cada proceso el encoding guardado de cada archivo. Los archivos de STREAM_MIN_BYTES
+    o más no pasan por el pool: se extraen en streaming al escribirlos para no
+    materializarlos enteros.
+    """
+    def job(entry):
+        return (entry.path, entry.relative_path, get_language(entry.extension),
+                known_encodings.get(entry.relative_path))
+
+    if workers <= 1 or len(entries) < PARALLEL_MIN_FILES:
+        for entry in entries:
+            yield open_section(*job(entry))
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(entries))) as executor:
+        def submit(entry):
+            if entry.stat.st_size >= STREAM_MIN_BYTES:
+                return entry, None
+            return entry, executor.submit(render_section, *job(entry))
+
+        remaining = iter(entries)
+        pending = deque(submit(entry) for entry in itertools.islice(remaining, workers * RENDER_LOOKAHEAD))
+        try:
+            while pending:
+                entry, future = pending.popleft()
+                for next_entry in itertools.islice(remaining, 1):
+                    pending.append(submit(next_entry))
+                if future is None:
+                    yield open_section(*job(entry))
+                else:
+                    data, encoding = future.result()
+                    yield (data,), encoding
+        finally:
+            for _, future in pending:
+                if future is not None:
+                    future.cancel()
+
+def write_context(output_file, selected_extensions, index, workers=None):
+    """Escribe context.txt reutilizando las secciones sin cambios de la ejecución anterior.
+
+    Las secciones que hay que renderizar se extraen en paralelo con `workers` procesos
+    (por defecto uno por CPU; 1 para modo serie). Devuelve (archivos procesados,
+    secciones reutilizadas). El resultado es idéntico byte a byte al de una
+    regeneración completa en serie.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    cached_sections, offsets_valid = load_render_cache(output_file)
+    previous = None
+    if offsets_valid:
+        try:
+            previous = open(output_file, 'rb')
+        except OSError:
+            offsets_valid = False
+
+    # Decidir qué secciones se copian de la caché y cuáles se renderizan; a estas
+    # últimas se les pasa el encoding guardado si el archivo no cambió
+    plan = []
+    known_encodings = {}
+    for entry in index:
+        # Verificar si la extensión está entre las seleccionadas
+        if entry.extension.lower() not in selected_extensions:
+            continue
+        cached = cached_sections.get(entry.relative_path)
+        if not cached or cached[:2] != [entry.stat.st_size, entry.stat.st_mtime_ns]:
+            cached = None
+        elif not offsets_valid:
+            if cached[4]:
+                known_encodings[entry.relative_path] = (cached[0], cached[1], cached[4])
+            cached = None
+        plan.append((entry, cached))
+    rendered = iter_rendered_sections([entry for entry, cached in plan if cached is None], workers,
+                                      known_encodings)
+
+    started_ns = time.time_ns()
+    sections = {}
+    reused = 0
+    tmp_path = output_file + '.tmp'
+
+    try:
+        with open(tmp_path, 'wb') as outfile:
+            # Escribir cabecera con información de las extensiones seleccionadas
+            outfile.write(encode_output(
+                "CONTEXTO DEL PROYECTO\n"
+                + "=" * 50 + "\n"
+                + f"Extensiones incluidas: {', '.join(selected_extensions)}\n"
+                + "=" * 50 + "\n\n"
+            ))
+
+            for entry, cached in plan:
+                stat = entry.stat
+                offset = outfile.tell()
+
+                if cached is None:
+                    section, encoding = next(rendered)
+                else:
+                    # Copiar la sección anterior si el archivo no cambió
+                    previous.seek(cached[2])
+                    data = previous.read(cached[3])
+                    encoding = cached[4]
+                    if len(data) == cached[3]:
+                        reused += 1
+                        section = (data,)
+                    else:
+                        section, encoding = open_section(entry.path, entry.relative_path,
+                                                         get_language(entry.extension), cached[:2] + [encoding])
+                for chunk in section:
+                    outfile.write(chunk)
+
+                # Los archivos modificados durante la generación no son fiables
+                if stat.st_mtime_ns < started_ns - RACY_WINDOW_NS:
+                    sections[entry.relative_path] = [stat.st_size, stat.st_mtime_ns, offset,
+                                                     outfile.tell() - offset, encoding]
+    finally:
+        rendered.close()
+        if previous is not None:
+            previous.close()
+
+    os.replace(tmp_path, output_file)
+    try:
+        save_render_cache(output_file, sections)
+    except OSError as e:
+        print(f"Advertencia: no se pudo guardar la caché de renderizado: {e}")
+    return len(plan), reused
+
 def main():
     output_file = 'context.txt'
     
@@ -352,8 +810,11 @@ def main():
     print("Este script analizará el directorio actual y generará un archivo 'context.txt'")
     print("con el contenido de los archivos que selecciones.\n")
     
+    # Un único recorrido del directorio para el menú y la escritura
+    index = scan_files('.')
+    
     # Selección interactiva de extensiones
-    selected_extensions = select_extensions_interactively()
+    selected_extensions = select_extensions_interactively(index)
     
     if not selected_extensions:
         print("No se seleccionaron extensiones. Saliendo...")
@@ -362,46 +823,12 @@ def main():
     print(f"\nExtensiones seleccionadas: {', '.join(selected_extensions)}")
     print("Procesando archivos...")
     
-    file_count = 0
-    
-    with open(output_file, 'w', encoding='utf-8') as outfile:
-        # Escribir cabecera con información de las extensiones seleccionadas
-        outfile.write("CONTEXTO DEL PROYECTO\n")
-        outfile.write("=" * 50 + "\n")
-        outfile.write(f"Extensiones incluidas: {', '.join(selected_extensions)}\n")
-        outfile.write("=" * 50 + "\n\n")
-        
-        for root, dirs, files in os.walk('.'):
-            # Filtrar carpetas ocultas y de sistema
-            dirs[:] = [d for d in dirs if not d.startswith('.') and d != '__pycache__' and d != 'node_modules']
-            
-            for filename in files:
-                filepath = os.path.join(root, filename)
-                
-                if os.path.isfile(filepath):
-                    _, ext = os.path.splitext(filename)
-                    
-                    # Verificar si la extensión está en las seleccionadas Y en el language_map
-                    if ext.lower() in selected_extensions and ext.lower() in language_map:
-                        language = get_language(ext)
-                        
-                        # Ruta relativa para mostrar
-                        relative_path = os.path.relpath(filepath, start='.')
-                        
-                        # Escribir encabezado
-                        outfile.write(f'./{relative_path}\n')
-                        outfile.write(f'`{language}\n')
-                        
-                        # Leer y escribir contenido
-                        content = read_file_content(filepath)
-                        outfile.write(content)
-                        
-                        # Cerrar bloque
-                        outfile.write('`\n\n')
-                        file_count += 1
+    file_count, reused = write_context(output_file, selected_extensions, index)
     
     print(f"\n¡Proceso completado!")
     print(f"Se procesaron {file_count} archivos.")
+    if reused:
+        print(f"Se reutilizaron {reused} secciones sin cambios desde la caché.")
     print(f"Resultado guardado en: {output_file}")
 
 if __name__ == '__main__':
@@ -0,0 +1,334 @@
+"""Banco de pruebas reproducible para ContentDirectoryComparator.
+
+Genera pares de árboles sintéticos de varias formas (muchos archivos
+diminutos, pocos archivos enormes, anidamiento profundo, mucha duplicación y
+árboles casi idénticos con ediciones dispersas) y mide scan_directory_content,
+compare_by_content y un merge no interactivo. El informe se escribe en JSON
+para poder comparar ejecuciones entre sí con --baseline.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+from comparador_dirs import (ContentDirectoryComparator, DEFAULT_WORKERS, DEFAULT_PREFILTER_ALGORITHM,
+                             HASH_ALGORITHMS, PREFILTER_ALGORITHMS, LINK_MODES, get_peak_rss_bytes)
+
+SHAPES = ('tiny', 'large', 'deep', 'dup', 'sparse')
+
+# Bloque base para rellenar archivos grandes sin generar GB de aleatorios en Python
+BLOCK_BYTES = 1024 * 1024
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _write_large(path, size, rng):
+    """Escribe un archivo de `size` bytes a partir de un bloque aleatorio con cabecera por bloque."""
+    block = bytearray(rng.randbytes(BLOCK_BYTES))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        written = 0
+        while written < size:
+            # Cada bloque lleva su número para que el archivo no sea periódico
+            block[:8] = written.to_bytes(8, 'little')
+            chunk = min(BLOCK_BYTES, size - written)
+            f.write(block[:chunk])
+            written += chunk
+
+
+def _edit(path, rng):
+    """Modifica unos pocos bytes en mitad de un archivo, conservando su tamaño."""
+    size = os.path.getsize(path)
+    with open(path, 'r+b') as f:
+        f.seek(rng.randrange(size) if size else 0)
+        f.write(rng.randbytes(min(16, size) or 1))
+
+
+def generate_tree(shape, root, scale, rng, large_mb):
+    """Genera en `root` el primer árbol de la forma indicada."""
+    if shape == 'tiny':
+        for i in range(int(20000 * scale)):
+            _write(os.path.join(root, f'd{i // 100:04d}', f'f{i:06d}.txt'),
+                   rng.randbytes(rng.randrange(0, 4096)))
+    elif shape == 'large':
+        for i in range(3):
+            _write_large(os.path.join(root, f'big{i}.bin'), int(large_mb * 1024 * 1024 * scale), rng)
+    elif shape == 'deep':
+        for chain_id in range(int(20 * scale) or 1):
+            path = os.path.join(root, f'c{chain_id:03d}')
+            for level in range(40):
+                path = os.path.join(path, f'n{level:02d}')
+                for j in range(3):
+                    _write(os.path.join(path, f'f{j}.dat'), rng.randbytes(rng.randrange(256, 8192)))
+    elif shape == 'dup':
+        pool = [rng.randbytes(rng.randrange(1024, 256 * 1024)) for _ in range(50)]
+        for i in range(int(5000 * scale)):
+            _write(os.path.join(root, f'd{i // 200:03d}', f'f{i:05d}.bin'), rng.choice(pool))
+    elif shape == 'sparse':
+        for i in range(int(10000 * scale)):
+            _write(os.path.join(root, f'd{i // 100:03d}', f'f{i:05d}.dat'),
+                   rng.randbytes(rng.randrange(1024, 64 * 1024)))
+    else:
+        raise ValueError(f"Forma de árbol desconocida: {shape}")
+
+
+def derive_tree(shape, src, dst, rng):
+    """Copia el primer árbol en `dst` y aplica los cambios propios de cada forma."""
+    shutil.copytree(src, dst)
+    files = sorted(os.path.join(dirpath, name) for dirpath, _, names in os.walk(dst) for name in names)
+    # Ediciones dispersas (1%) en 'sparse'; en el resto un 10% para tener conflictos que resolver
+    ratio = 0.01 if shape == 'sparse' else 0.1
+    for path in rng.sample(files, max(1, int(len(files) * ratio))):
+        _edit(path, rng)
+    # Algunos archivos solo existen en un lado
+    for path in rng.sample(files, max(1, len(files) // 200)):
+        if os.path.exists(path):
+            os.remove(path)
+    _write(os.path.join(dst, 'solo_en_b', 'nuevo.txt'), rng.randbytes(1024))
+
+
+def tree_totals(root):
+    """Devuelve (archivos, bytes) de un árbol."""
+    files = total = 0
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            files += 1
+            total += os.path.getsize(os.path.join(dirpath, name))
+    return files, total
+
+
+def prepare_shape(shape, workdir, scale, seed, large_mb):
+    """Genera (o reutiliza) el par de árboles de una forma y devuelve sus rutas."""
+    base = os.path.join(workdir, f'{shape}-s{scale:g}-r{seed}' + (f'-{large_mb:g}mb' if shape == 'large' else ''))
+    dir1, dir2 = os.path.join(base, 'a'), os.path.join(base, 'b')
+    marker = os.path.join(base, '.completo')
+    if not os.path.exists(marker):
+        shutil.rmtree(base, ignore_errors=True)
+        rng = random.Random(f'{shape}:{seed}')
+        generate_tree(shape, dir1, scale, rng, large_mb)
+        derive_tree(shape, dir1, dir2, rng)
+        open(marker, 'w').close()
+    return dir1, dir2
+
+
+def _phase(name, func):
+    """Ejecuta una fase y devuelve (resultado, métricas sin caudal)."""
+    start = time.perf_counter()
+    value = func()
+    return value, {'phase': name, 'wall_s': round(time.perf_counter() - start, 6),
+                   'peak_rss_bytes': get_peak_rss_bytes()}
+
+
+def _throughput(metrics, files, total_bytes):
+    """Añade archivos y MB por segundo a las métricas de una fase."""
+    wall = metrics['wall_s']
+    metrics.update(files=files, bytes=total_bytes,
+                   files_per_s=round(files / wall, 1) if wall else None,
+                   mb_per_s=round(total_bytes / (1024 * 1024) / wall, 2) if wall else None)
+    return metrics
+
+
+def run_shape(shape, dir1, dir2, options):
+    """Mide las tres fases sobre un par de árboles. Se ejecuta en un proceso propio.
+
+    La memoria pico es la del proceso hasta el final de cada fase, así que es
+    acumulativa dentro de una forma pero no se contamina entre formas.
+    """
+    comparator = ContentDirectoryComparator(use_cache=options['cache'], cache_dir=options['cache_dir'],
+                                            workers=options['workers'], hash_algorithm=options['hash'],
+                                            prefilter_algorithm=options['prefilter'])
+    files1, bytes1 = tree_totals(dir1)
+    files2, bytes2 = tree_totals(dir2)
+    merge_dir = os.path.join(os.path.dirname(dir1), 'merged')
+    phases = []
+    output = sys.stdout if options['verbose'] else open(os.devnull, 'w')
+    try:
+        with contextlib.redirect_stdout(output):
+            def scan_both():
+                comparator.scan_directory_content(dir1)
+                comparator.scan_directory_content(dir2)
+
+            _, metrics = _phase('scan', scan_both)
+            phases.append(_throughput(metrics, files1 + files2, bytes1 + bytes2))
+            # compare_by_content equivale a compare_directories + to_legacy; se conserva
+            # el resultado compacto para el merge
+            def compare():
+                result = comparator.compare_directories(dir1, dir2)
+                result.to_legacy()
+                return result
+
+            result, metrics = _phase('compare', compare)
+            phases.append(_throughput(metrics, files1 + files2, bytes1 + bytes2))
+            summary, metrics = _phase('merge', lambda: comparator.batch_merge(
+                dir1, dir2, merge_dir, result, policy='prefer-newer', link_mode=options['link'], overwrite=True))
+            phases.append(_throughput(metrics, *tree_totals(merge_dir)))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        shutil.rmtree(merge_dir, ignore_errors=True)
+    return {
+        'shape': shape,
+        'tree1': {'files': files1, 'bytes': bytes1},
+        'tree2': {'files': files2, 'bytes': bytes2},
+        'merge': {'placed': summary['placed'], 'skipped': len(summary['skipped']),
+                  'errors': len(summary['errors'])} if summary else None,
+        'phases': phases,
+    }
+
+
+def check_warm_cache(workdir):
+    """Comprueba que una ejecución con caché caliente da el mismo resultado que sin caché.
+
+    Reproduce el caso de un subárbol idéntico (lib/) cuyo contenido también está
+    fuera de él (app/copy.txt) y cuya copia desaparece de un lado tras calentar la
+    caché. Devuelve None si todo coincide o un mensaje describiendo la diferencia.
+    """
+    base = os.path.join(workdir, 'check-warm-cache')
+    shutil.rmtree(base, ignore_errors=True)
+    dir1, dir2 = os.path.join(base, 'a'), os.path.join(base, 'b')
+    for root in (dir1, dir2):
+        _write(os.path.join(root, 'lib', 'shared.txt'), b'same content\n')
+        _write(os.path.join(root, 'lib', 'other.txt'), b'other\n')
+        _write(os.path.join(root, 'app', 'copy.txt'), b'same content\n')
+        _write(os.path.join(root, 'app', 'main.txt'), b'main\n')
+        # Fuera de la ventana de "racy mtime" para que la caché acepte las entradas
+        for dirpath, _, names in os.walk(root):
+            for name in names:
+                os.utime(os.path.join(dirpath, name), (time.time() - 60,) * 2)
+    cache_dir = os.path.join(base, '.cache')
+
+    def compare(use_cache):
+        comparator = ContentDirectoryComparator(use_cache=use_cache, cache_dir=cache_dir)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            return comparator.compare_by_content(dir1, dir2)[:3]
+
+    try:
+        compare(True)
+        os.remove(os.path.join(dir2, 'app', 'copy.txt'))
+        warm, cold = compare(True), compare(False)
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+    if warm != cold:
+        return f"caché caliente {warm!r} != sin caché {cold!r}"
+    return None
+
+
+CHECKS = {'warm-cache': check_warm_cache}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_reports(report, baseline):
+    """Muestra la variación de tiempo por forma y fase respecto a un informe anterior."""
+    previous = {(run['shape'], phase['phase']): phase['wall_s']
+                for run in baseline['runs'] for phase in run['phases']}
+    print(f"\n📊 Comparación con {baseline.get('revision') or 'informe anterior'}:")
+    for run in report['runs']:
+        for phase in run['phases']:
+            before = previous.get((run['shape'], phase['phase']))
+            if before:
+                change = (phase['wall_s'] - before) / before * 100
+                print(f"   • {run['shape']:<7} {phase['phase']:<8} {before:8.3f}s → {phase['wall_s']:8.3f}s "
+                      f"({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark reproducible del comparador de directorios.")
+    parser.add_argument('--shapes', nargs='+', choices=SHAPES, default=list(SHAPES),
+                        help="Formas de árbol a medir (por defecto: todas)")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="Factor de tamaño de los árboles generados (por defecto: 1)")
+    parser.add_argument('--large-mb', type=float, default=256,
+                        help="Tamaño de cada archivo de la forma 'large' en MB (por defecto: 256; "
+                             "usa 2048 o más para archivos de varios GB)")
+    parser.add_argument('--seed', type=int, default=0, help="Semilla de los generadores (por defecto: 0)")
+    parser.add_argument('--repeat', type=int, default=1, help="Repeticiones de cada forma (por defecto: 1)")
+    parser.add_argument('--workdir', default=None,
+                        help="Dónde generar los árboles; se reutilizan entre ejecuciones (por defecto: temporal)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"Hilos de hashing (por defecto: {DEFAULT_WORKERS})")
+    parser.add_argument('--hash', default='md5', choices=sorted(HASH_ALGORITHMS),
+                        help="Algoritmo del hash completo (por defecto: md5)")
+    parser.add_argument('--prefilter-hash', default=DEFAULT_PREFILTER_ALGORITHM, choices=sorted(PREFILTER_ALGORITHMS),
+                        help=f"Algoritmo del hash parcial (por defecto: {DEFAULT_PREFILTER_ALGORITHM})")
+    parser.add_argument('--link', choices=LINK_MODES, default='auto',
+                        help="Modo de colocación del merge (por defecto: auto)")
+    parser.add_argument('--cache', action='store_true',
+                        help="Usar la caché de hashes (mide ejecuciones en caliente)")
+    parser.add_argument('--output', '-o', default=None, help="Archivo JSON del informe (por defecto: stdout)")
+    parser.add_argument('--baseline', default=None, help="Informe JSON anterior con el que comparar")
+    parser.add_argument('--verbose', action='store_true', help="Mostrar la salida del comparador")
+    parser.add_argument('--check', action='store_true',
+                        help="Ejecutar solo las comprobaciones de regresión y salir (código 1 si alguna falla)")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_comparador_')
+    if args.check:
+        failed = False
+        try:
+            for name, check in CHECKS.items():
+                error = check(workdir)
+                failed = failed or error is not None
+                print(f"{'❌' if error else '✅'} {name}" + (f": {error}" if error else ""), file=sys.stderr)
+        finally:
+            if args.workdir is None:
+                shutil.rmtree(workdir, ignore_errors=True)
+        sys.exit(1 if failed else 0)
+    options = {'cache': args.cache, 'workers': args.workers, 'hash': args.hash,
+               'prefilter': args.prefilter_hash, 'link': args.link, 'verbose': args.verbose,
+               'cache_dir': os.path.join(workdir, '.cache')}
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'options': dict(options, scale=args.scale, seed=args.seed, large_mb=args.large_mb, repeat=args.repeat),
+        'runs': [],
+    }
+    try:
+        for shape in args.shapes:
+            print(f"🌱 Preparando árboles '{shape}'...", file=sys.stderr)
+            dir1, dir2 = prepare_shape(shape, workdir, args.scale, args.seed, args.large_mb)
+            for repetition in range(args.repeat):
+                print(f"⏱️  Midiendo '{shape}' ({repetition + 1}/{args.repeat})...", file=sys.stderr)
+                # Un proceso por medición: la memoria pico de una forma no afecta a las demás
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    run = pool.submit(run_shape, shape, dir1, dir2, options).result()
+                run['repetition'] = repetition
+                report['runs'].append(run)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"💾 Informe guardado en: {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            compare_reports(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,2000 @@
 import os
+import sys
+import stat
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import time
+import zlib
+import mmap
+import heapq
+import io
 import hashlib
-import fnmatch
+import cProfile
+import contextlib
+import threading
+import filecmp
 import shutil
-import difflib
-from collections import defaultdict
+import json
+import re
+import sqlite3
+import argparse
+from array import array
+from bisect import bisect_left
+from itertools import chain, groupby, islice
+from operator import itemgetter
+from collections import Counter, defaultdict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Hilos de hashing por defecto: la carga es de E/S, conviene más de uno por núcleo
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+
+# Archivos por tarea enviada al pool: reparte la carga sin crear un Future por archivo
+PARALLEL_BATCH_SIZE = 16
+
+# Tamaño de cada ventana (inicio y final) usada por el hash parcial
+PARTIAL_HASH_BYTES = 64 * 1024
+
+# Tamaño del búfer reutilizado por hilo para leer con readinto
+READ_BUFFER_BYTES = 1024 * 1024
+
+# A partir de este tamaño los archivos se hashean mediante mmap
+MMAP_THRESHOLD_BYTES = 64 * 1024 * 1024
+
+
+class Crc32Hasher:
+    """Adaptador de zlib.crc32 con la interfaz de hashlib (no criptográfico)."""
+
+    digest_size = 4
+
+    def __init__(self):
+        self._value = 0
+
+    def update(self, data):
+        self._value = zlib.crc32(data, self._value)
+
+    def digest(self):
+        return self._value.to_bytes(4, 'big')
+
+    def hexdigest(self):
+        return f'{self._value:08x}'
+
+
+# Algoritmos para el hash completo: deben ser resistentes a colisiones
+HASH_ALGORITHMS = {
+    'md5': hashlib.md5,
+    'sha256': hashlib.sha256,
+    'blake2b': lambda: hashlib.blake2b(digest_size=32),
+}
+if xxhash is not None:
+    HASH_ALGORITHMS['xxh128'] = xxhash.xxh3_128
+
+# Algoritmos para el hash parcial del prefiltro: una colisión solo provoca
+# un hash completo adicional, así que basta con uno rápido
+PREFILTER_ALGORITHMS = dict(HASH_ALGORITHMS, crc32=Crc32Hasher)
+if xxhash is not None:
+    PREFILTER_ALGORITHMS['xxh64'] = xxhash.xxh3_64
+
+DEFAULT_PREFILTER_ALGORITHM = 'xxh64' if xxhash is not None else 'crc32'
+
+_read_buffers = threading.local()
+
+
+def get_read_buffer():
+    """Devuelve el búfer de lectura preasignado del hilo actual."""
+    buffer = getattr(_read_buffers, 'buffer', None)
+    if buffer is None:
+        buffer = _read_buffers.buffer = memoryview(bytearray(READ_BUFFER_BYTES))
+    return buffer
+
+
+def hash_stream(hasher, f, limit=None):
+    """Alimenta el hasher leyendo con readinto sobre el búfer del hilo.
+    
+    Si se indica `limit`, lee como mucho esa cantidad de bytes.
+    """
+    buffer = get_read_buffer()
+    remaining = limit
+    while remaining is None or remaining > 0:
+        view = buffer if remaining is None or remaining >= len(buffer) else buffer[:remaining]
+        n = f.readinto(view)
+        if not n:
+            break
+        hasher.update(view[:n])
+        if remaining is not None:
+            remaining -= n
+
+
+# ioctl de Linux para clonar un archivo compartiendo bloques (Btrfs, XFS, ...)
+FICLONE = 0x40049409
+# Igual, pero solo un rango: struct file_clone_range {s64 fd; u64 offset, length, dest_offset}
+FICLONERANGE = 0x4020940d
+
+MERGE_POLICIES = ('prefer-dir1', 'prefer-dir2', 'prefer-newer', 'prefer-larger')
+LINK_MODES = ('auto', 'reflink', 'hardlink', 'copy')
+DEDUPE_MODES = ('report', 'hardlink', 'reflink')
+
+# Grupos de duplicados que se listan en el informe de --dedupe
+DEDUPE_REPORT_GROUPS = 50
+
+
+def _kernel_copy(fsrc, fdst, size):
+    """Copia con copy_file_range o sendfile, sin pasar los datos por Python.
+    
+    Devuelve el método usado, o None si el sistema no admite ninguno o si
+    ninguno llega a copiar el archivo entero (p. ej. copy_file_range devuelve
+    0 en algunos sistemas de archivos virtuales); en ese caso deja ambos
+    archivos en la posición 0 y dst vacío para que el llamador copie en Python.
+    """
+    for name in ('copy_file_range', 'sendfile'):
+        func = getattr(os, name, None)
+        if func is None:
+            continue
+        offset = 0
+        try:
+            while offset < size:
+                if name == 'copy_file_range':
+                    sent = func(fsrc.fileno(), fdst.fileno(), size - offset)
+                else:
+                    sent = func(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+                if not sent:
+                    break
+                offset += sent
+        except OSError:
+            if offset:
+                raise
+            continue
+        if offset >= size:
+            return name
+        # Copia incompleta: se descarta y se prueba el siguiente método
+        fsrc.seek(0)
+        fdst.seek(0)
+        fdst.truncate()
+    return None
+
+
+def place_file(src, dst, link_mode='auto'):
+    """Coloca src en dst con el método más barato permitido por link_mode.
+    
+    'hardlink' enlaza al mismo inodo (el archivo queda compartido con el
+    origen); 'reflink' y 'auto' clonan bloques copy-on-write cuando el sistema
+    de archivos lo admite. En cualquier caso se recurre después a
+    copy_file_range/sendfile y, como último recurso, a una copia en Python.
+    Conserva los metadatos como shutil.copy2 y devuelve el método usado.
+    """
+    if link_mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:
+            pass
+    if link_mode == 'copy':
+        shutil.copy2(src, dst)
+        return 'copy'
+    
+    method = None
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if fcntl is not None and link_mode in ('auto', 'reflink'):
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                method = 'reflink'
+            except OSError:
+                pass
+        if method is None:
+            method = _kernel_copy(fsrc, fdst, os.fstat(fsrc.fileno()).st_size)
+        if method is None:
+            shutil.copyfileobj(fsrc, fdst, READ_BUFFER_BYTES)
+            method = 'copy'
+    shutil.copystat(src, dst)
+    return method
+
+
+# Registro compacto de un archivo escaneado; `path` es relativo a la raíz
+FileRecord = namedtuple('FileRecord', ['path', 'size', 'mtime_ns', 'ino', 'dev'])
+
+
+def get_default_cache_dir():
+    """Devuelve el directorio donde se guardan las cachés de hashes."""
+    base = os.environ.get('LOCALAPPDATA') if os.name == 'nt' else None
+    if not base:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'comparador_dirs')
+
+
+# Valores especiales de ScanIndex.digest_ids
+DIGEST_UNIQUE = -1      # descartado por el prefiltro: no coincide con ningún otro archivo
+DIGEST_UNREADABLE = -2  # no se pudo leer; queda fuera de la comparación
+DIGEST_PAIRED = -3      # dentro de un subárbol idéntico en ambos lados; no se consulta
+
+_UINT64_MASK = (1 << 64) - 1
+
+
+def get_peak_rss_bytes():
+    """Memoria residente máxima del proceso en bytes, o None si no se puede medir."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class PathTable:
+    """Rutas relativas internadas como (id de directorio, id de nombre).
+
+    Cada prefijo de directorio y cada nombre de archivo se guarda una sola
+    vez aunque aparezca en miles de rutas. La tabla se comparte entre los
+    índices que se comparan, de modo que una misma ruta tiene la misma clave
+    entera en todos ellos.
+    """
+
+    __slots__ = ('dirs', 'names', '_dir_ids', '_name_ids', '_lock')
+
+    def __init__(self):
+        self.dirs = []
+        self.names = []
+        self._dir_ids = {}
+        self._name_ids = {}
+        self._lock = threading.Lock()
+
+    def intern(self, path):
+        """Devuelve (dir_id, name_id) para una ruta relativa."""
+        prefix, sep, name = path.rpartition(os.sep)
+        prefix += sep
+        with self._lock:
+            dir_id = self._dir_ids.get(prefix)
+            if dir_id is None:
+                dir_id = self._dir_ids[prefix] = len(self.dirs)
+                self.dirs.append(prefix)
+            name_id = self._name_ids.get(name)
+            if name_id is None:
+                name_id = self._name_ids[name] = len(self.names)
+                self.names.append(name)
+        return dir_id, name_id
+
+    def lookup(self, path):
+        """Como intern, pero devuelve None si la ruta no está en la tabla."""
+        prefix, sep, name = path.rpartition(os.sep)
+        dir_id = self._dir_ids.get(prefix + sep)
+        name_id = self._name_ids.get(name)
+        if dir_id is None or name_id is None:
+            return None
+        return dir_id, name_id
+
+    def path(self, dir_id, name_id):
+        return self.dirs[dir_id] + self.names[name_id]
+
+
+class DigestTable:
+    """Digests en bruto (16-32 bytes) con un ID entero por contenido distinto."""
+
+    __slots__ = ('digests', '_ids', '_lock')
+
+    def __init__(self):
+        self.digests = []
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def intern(self, hexdigest):
+        """Devuelve el ID del digest, registrándolo si es nuevo."""
+        return self.intern_raw(bytes.fromhex(hexdigest))
+
+    def intern_raw(self, raw):
+        """Como intern, pero a partir del digest en bruto."""
+        with self._lock:
+            digest_id = self._ids.get(raw)
+            if digest_id is None:
+                digest_id = self._ids[raw] = len(self.digests)
+                self.digests.append(raw)
+        return digest_id
+
+    def hex(self, digest_id):
+        return self.digests[digest_id].hex()
+
+    def __len__(self):
+        return len(self.digests)
+
+
+class ScanIndex:
+    """Resultado compacto del escaneo de un directorio.
+
+    Cada archivo es una posición en arrays paralelos: las rutas viven en una
+    PathTable compartida y los contenidos como IDs de una DigestTable, así que
+    no se guarda ningún str ni objeto por archivo.
+    """
+
+    __slots__ = ('root', 'paths', 'readable', 'dir_ids', 'name_ids', 'sizes', 'mtimes', 'inodes', 'devs',
+                 'digest_ids')
+
+    def __init__(self, root, paths, readable=True):
+        self.root = root
+        self.paths = paths
+        # False si procede de un manifiesto: hay digests, pero no archivos que leer
+        self.readable = readable
+        self.dir_ids = array('I')
+        self.name_ids = array('I')
+        self.sizes = array('Q')
+        self.mtimes = array('q')
+        self.inodes = array('Q')
+        self.devs = array('Q')
+        self.digest_ids = array('i')
+
+    def add(self, record, digest_id=DIGEST_UNREADABLE):
+        dir_id, name_id = self.paths.intern(record.path)
+        self.dir_ids.append(dir_id)
+        self.name_ids.append(name_id)
+        self.sizes.append(record.size)
+        self.mtimes.append(record.mtime_ns)
+        self.inodes.append(record.ino & _UINT64_MASK)
+        self.devs.append(record.dev & _UINT64_MASK)
+        self.digest_ids.append(digest_id)
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def path(self, i):
+        return self.paths.path(self.dir_ids[i], self.name_ids[i])
+
+    def full_path(self, i):
+        return os.path.join(self.root, self.path(i))
+
+    def path_key(self, i):
+        """Clave entera de la ruta, válida entre índices que comparten PathTable."""
+        return (self.dir_ids[i] << 32) | self.name_ids[i]
+
+    def record(self, i):
+        return FileRecord(self.path(i), self.sizes[i], self.mtimes[i], self.inodes[i], self.devs[i])
+
+
+class ComparisonResult:
+    """Resultado compacto de comparar dos ScanIndex.
+
+    Guarda posiciones de archivo en arrays; los mapas clásicos de contenido
+    y nombre -> hash solo se construyen si se piden con to_legacy().
+    """
+
+    __slots__ = ('index1', 'index2', 'digests', 'unique1', 'unique2', 'common1', 'common2', 'same')
+
+    def __init__(self, index1, index2, digests):
+        self.index1 = index1
+        self.index2 = index2
+        self.digests = digests
+        self.unique1 = array('I')
+        self.unique2 = array('I')
+        # Rutas presentes en ambos: posiciones emparejadas y si el contenido coincide
+        self.common1 = array('I')
+        self.common2 = array('I')
+        self.same = bytearray()
+
+    def digest_key(self, side, i):
+        """Clave de contenido al estilo clásico: hex del digest o clave sintética '~...'."""
+        index = self.index1 if side == 1 else self.index2
+        digest_id = index.digest_ids[i]
+        if digest_id >= 0:
+            return self.digests.hex(digest_id)
+        if digest_id == DIGEST_PAIRED:
+            # Mismo contenido en ambos lados: la clave debe coincidir entre ellos
+            return f"={index.path(i)}"
+        return f"~{index.sizes[i]}:{side}:{i}"
+
+    def unique_paths(self, side):
+        """Devuelve {clave de contenido: [rutas]} de los archivos únicos de un lado."""
+        index = self.index1 if side == 1 else self.index2
+        groups = defaultdict(list)
+        for i in (self.unique1 if side == 1 else self.unique2):
+            groups[self.digest_key(side, i)].append(index.path(i))
+        return dict(groups)
+
+    def conflict_paths(self):
+        """Rutas presentes en ambos directorios con contenido diferente."""
+        return [self.index1.path(i) for i, same in zip(self.common1, self.same) if not same]
+
+    def to_legacy(self):
+        """Construye la tupla clásica de compare_by_content a partir del índice."""
+        content_maps = []
+        name_to_hashes = []
+        for side, index in ((1, self.index1), (2, self.index2)):
+            content_map = defaultdict(list)
+            name_to_hash = {}
+            for i in range(len(index)):
+                if index.digest_ids[i] == DIGEST_UNREADABLE:
+                    continue
+                key = self.digest_key(side, i)
+                path = index.path(i)
+                content_map[key].append(path)
+                name_to_hash[path] = key
+            content_maps.append(content_map)
+            name_to_hashes.append(name_to_hash)
+        
+        return (self.unique_paths(1), self.unique_paths(2), self.conflict_paths(),
+                name_to_hashes[0], name_to_hashes[1], content_maps[0], content_maps[1])
+
+
+def _parent_prefix(prefix):
+    """'a/b/' -> 'a/'; 'a/' -> ''."""
+    head = prefix[:-1].rpartition(os.sep)[0]
+    return head + os.sep if head else ''
+
+
+class DirectoryTree:
+    """Jerarquía de directorios de un ScanIndex, con sellos y digests Merkle.
+
+    El sello de un directorio resume nombre, tamaño, mtime e inodo de todo su
+    subárbol y sale solo del stat; el digest Merkle resume nombres y
+    contenidos. Si el sello coincide con el guardado en la caché, el Merkle
+    guardado sigue siendo válido sin consultar archivo por archivo.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        # El recorrido emite juntos los archivos de cada directorio, así que
+        # cada uno ocupa uno (o pocos) tramos contiguos (inicio, fin) del índice
+        self.files = defaultdict(list)
+        start = 0
+        for dir_id, group in groupby(index.dir_ids):
+            end = start + len(list(group))
+            self.files[index.paths.dirs[dir_id]].append((start, end))
+            start = end
+        
+        prefixes = {''}
+        for prefix in self.files:
+            while prefix not in prefixes:
+                prefixes.add(prefix)
+                prefix = _parent_prefix(prefix)
+        self.children = defaultdict(list)
+        for prefix in prefixes:
+            if prefix:
+                self.children[_parent_prefix(prefix)].append(prefix)
+        # De las hojas a la raíz, para calcular cada directorio después de sus hijos
+        self.order = sorted(prefixes, key=lambda prefix: prefix.count(os.sep), reverse=True)
+        self.stamps = {}
+        self.newest = {}
+
+    def compute_stamps(self):
+        """Calcula el sello de cada directorio y el mtime más reciente de su subárbol."""
+        index = self.index
+        names = index.paths.names
+        for prefix in self.order:
+            # En el orden del recorrido: si el sistema de archivos lo cambia, el
+            # sello solo deja de coincidir y el directorio se vuelve a comparar
+            hasher = hashlib.blake2b(digest_size=16)
+            newest = 0
+            for start, end in self.files.get(prefix, ()):
+                hasher.update('\0'.join(map(names.__getitem__, index.name_ids[start:end]))
+                              .encode('utf-8', 'surrogatepass'))
+                for column in (index.sizes, index.mtimes, index.inodes):
+                    hasher.update(column[start:end].tobytes())
+                newest = max(newest, max(index.mtimes[start:end]))
+            for child in sorted(self.children.get(prefix, ())):
+                hasher.update(os.fsencode(child))
+                hasher.update(self.stamps[child])
+                newest = max(newest, self.newest[child])
+            self.stamps[prefix] = hasher.digest()
+            self.newest[prefix] = newest
+
+    def merkle_digests(self, digests, known=None):
+        """Calcula el digest Merkle de cada directorio a partir del de sus archivos.
+        
+        `known` aporta digests ya conocidos (subárboles omitidos), que no se
+        recalculan. Un directorio con algún archivo sin digest completo (único
+        o ilegible) queda en None: no puede ser idéntico a ningún otro.
+        """
+        index = self.index
+        names = index.paths.names
+        result = dict(known or {})
+        inside = set()
+        stack = [child for prefix in result for child in self.children.get(prefix, ())]
+        while stack:
+            prefix = stack.pop()
+            inside.add(prefix)
+            stack.extend(self.children.get(prefix, ()))
+        for prefix in self.order:
+            if prefix in result or prefix in inside:
+                continue
+            hasher = hashlib.blake2b(digest_size=16)
+            complete = True
+            for name, i in sorted((names[index.name_ids[i]], i) for start, end in self.files.get(prefix, ())
+                                  for i in range(start, end)):
+                digest_id = index.digest_ids[i]
+                if digest_id < 0:
+                    complete = False
+                    break
+                hasher.update(os.fsencode(name) + b'\0')
+                hasher.update(digests.digests[digest_id])
+            for child in sorted(self.children.get(prefix, ())) if complete else ():
+                child_digest = result.get(child)
+                if child_digest is None:
+                    complete = False
+                    break
+                hasher.update(os.fsencode(child) + b'\0')
+                hasher.update(child_digest)
+            result[prefix] = hasher.digest() if complete else None
+        return result
+
+    def subtree_positions(self, prefix):
+        """Genera las posiciones de todos los archivos bajo un directorio."""
+        stack = [prefix]
+        while stack:
+            current = stack.pop()
+            for start, end in self.files.get(current, ()):
+                yield from range(start, end)
+            stack.extend(self.children.get(current, ()))
+
+
+# MinHash para detectar renombrados con edición: firma de MINHASH_SIZE valores
+# dividida en LSH_BANDS bandas; dos archivos son candidatos si coinciden en
+# alguna banda completa (umbral aproximado (1/bandas)^(1/filas) = 0.5)
+MINHASH_SIZE = 64
+LSH_BANDS = 16
+SIMILARITY_MAX_BYTES = 8 * 1024 * 1024
+DEFAULT_RENAME_THRESHOLD = 0.5
+
+
+def minhash_signature(filepath):
+    """Calcula la firma MinHash del conjunto de líneas de un archivo.
+    
+    Usa "one permutation hashing": cada línea se hashea una sola vez y se
+    reparte en uno de MINHASH_SIZE compartimentos, conservando el mínimo de
+    cada uno; los compartimentos vacíos se rellenan con el siguiente no
+    vacío. Así el coste es lineal en el tamaño del archivo. Devuelve None
+    si el archivo está vacío o no se puede leer.
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            data = f.read(SIMILARITY_MAX_BYTES)
+    except OSError:
+        return None
+    
+    shingles = set(data.splitlines())
+    shingles.discard(b'')
+    if not shingles:
+        return None
+    
+    signature = [None] * MINHASH_SIZE
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), 'little')
+        slot, value = value % MINHASH_SIZE, value // MINHASH_SIZE
+        if signature[slot] is None or value < signature[slot]:
+            signature[slot] = value
+    
+    filled = list(signature)
+    for slot in range(MINHASH_SIZE):
+        if signature[slot] is None:
+            step = 1
+            while signature[(slot + step) % MINHASH_SIZE] is None:
+                step += 1
+            # Desplazar el valor prestado distingue el relleno de un mínimo real
+            filled[slot] = signature[(slot + step) % MINHASH_SIZE] + step * (1 << 58)
+    return tuple(filled)
+
+
+def estimate_similarity(signature1, signature2):
+    """Estimación de la similitud de Jaccard a partir de dos firmas MinHash."""
+    return sum(a == b for a, b in zip(signature1, signature2)) / MINHASH_SIZE
+
+
+# Troceado por contenido (CDC) al estilo FastCDC: ningún corte antes de
+# CDC_MIN_BYTES, patrón estricto hasta CDC_AVG_BYTES, patrón laxo después y
+# corte forzoso en CDC_MAX_BYTES (troceado normalizado)
+CDC_MIN_BYTES = 16 * 1024
+CDC_AVG_BYTES = 64 * 1024
+CDC_MAX_BYTES = 256 * 1024
+# Bytes traducidos de una vez al buscar cortes; debe ser mayor que CDC_MAX_BYTES
+CDC_SCAN_BYTES = 4 * 1024 * 1024
+# Por debajo de este tamaño el merge con --update copia el archivo entero
+DELTA_MIN_BYTES = 1024 * 1024
+
+# El hash rodante es la ventana de los últimos bytes reducidos a un bit cada
+# uno; un corte es una aparición del patrón, así que su probabilidad por
+# posición es 2^-17 (estricto) o 2^-13 (laxo). translate y find recorren la
+# ventana en C, en lugar de un bucle de Python por byte.
+_CDC_TABLE = bytes(b & 1 for b in hashlib.shake_128(b'comparador_dirs-cdc').digest(256))
+_CDC_STRICT = bytes(b & 1 for b in hashlib.shake_128(b'comparador_dirs-cdc-strict').digest(17))
+_CDC_LOOSE = bytes(b & 1 for b in hashlib.shake_128(b'comparador_dirs-cdc-loose').digest(13))
+
+
+def iter_chunks(data):
+    """Genera los límites (inicio, fin) de los bloques definidos por contenido de `data`.
+    
+    Los cortes dependen solo de los bytes cercanos, así que una inserción o
+    un borrado solo cambia los bloques de alrededor y el resto se vuelve a
+    alinear. `data` puede ser bytes o un mmap.
+    """
+    n = len(data)
+    window = len(_CDC_STRICT)
+    scan_start, scan = 0, b''
+    start = 0
+    while start < n:
+        end = min(start + CDC_MAX_BYTES, n)
+        if end - start <= CDC_MIN_BYTES:
+            yield start, end
+            start = end
+            continue
+        lo = start + CDC_MIN_BYTES - window
+        if lo < scan_start or end > scan_start + len(scan):
+            scan_start = lo
+            scan = data[lo:min(n, lo + CDC_SCAN_BYTES)].translate(_CDC_TABLE)
+        # Un patrón que empieza en p corta en p + len(patrón)
+        normal = min(start + CDC_AVG_BYTES, end)
+        pos = scan.find(_CDC_STRICT, start + CDC_MIN_BYTES - window - scan_start, normal - scan_start)
+        if pos >= 0:
+            cut = scan_start + pos + window
+        else:
+            loose = len(_CDC_LOOSE)
+            pos = scan.find(_CDC_LOOSE, normal + 1 - loose - scan_start, end - scan_start)
+            cut = scan_start + pos + loose if pos >= 0 else end
+        yield start, cut
+        start = cut
+
+
+def chunk_signature(filepath):
+    """Devuelve [(offset, longitud, digest)] de los bloques de un archivo, o None si no se puede leer."""
+    try:
+        with open(filepath, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return [(start, end - start, hashlib.blake2b(data[start:end], digest_size=16).digest())
+                        for start, end in iter_chunks(data)]
+    except (OSError, ValueError):
+        return None
+
+
+def chunk_similarity(signature1, signature2):
+    """Fracción de bloques compartidos entre dos firmas de chunk_signature."""
+    total = len(signature1) + len(signature2)
+    if not total:
+        return 1.0
+    shared = Counter(digest for _, _, digest in signature1) & Counter(digest for _, _, digest in signature2)
+    return 2 * sum(shared.values()) / total
+
+
+def _copy_range(fsrc, fdst, src_offset, length, dst_offset):
+    """Copia un rango de fsrc a otra posición de fdst sin pasar por Python si se puede.
+    
+    Prueba a compartir los bloques con FICLONERANGE (solo funciona con rangos
+    alineados a bloque), después copy_file_range y, como último recurso, lee
+    y escribe con el búfer del hilo.
+    """
+    if fcntl is not None:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONERANGE,
+                        struct.pack('qQQQ', fsrc.fileno(), src_offset, length, dst_offset))
+            return
+        except OSError:
+            pass
+    done = 0
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    if copy_file_range is not None:
+        try:
+            while done < length:
+                sent = copy_file_range(fsrc.fileno(), fdst.fileno(), length - done,
+                                       src_offset + done, dst_offset + done)
+                if not sent:
+                    break
+                done += sent
+        except OSError:
+            pass
+    buffer = get_read_buffer()
+    while done < length:
+        fsrc.seek(src_offset + done)
+        n = fsrc.readinto(buffer[:min(length - done, len(buffer))])
+        if not n:
+            raise OSError(f"{fsrc.name} se acortó durante la actualización")
+        fdst.seek(dst_offset + done)
+        fdst.write(buffer[:n])
+        done += n
+
+
+def delta_write(src, dst):
+    """Reconstruye dst con el contenido de src reutilizando los bloques que dst ya tiene.
+    
+    Los bloques de dst se buscan por digest, no por posición, así que una
+    inserción o un borrado solo obliga a escribir los bloques que tocan. El
+    archivo nuevo se arma en un temporal junto a dst: los bloques reutilizados
+    se clonan o copian desde el dst anterior con _copy_range y solo los nuevos
+    se escriben desde src. Después se sincroniza y sustituye a dst con
+    os.replace, de modo que un fallo a medias deja dst intacto. Devuelve los
+    bytes escritos desde src.
+    """
+    existing = chunk_signature(dst)
+    if existing is None:
+        raise OSError(f"no se pudo leer {dst}")
+    old_offsets = {}
+    for offset, _, digest in existing:
+        old_offsets.setdefault(digest, offset)
+    
+    tmp_path = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.delta-{os.getpid()}")
+    written = 0
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'rb') as fold, open(tmp_path, 'wb', buffering=0) as fnew:
+            if os.fstat(fsrc.fileno()).st_size:
+                with mmap.mmap(fsrc.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    position = 0
+                    
+                    def flush(run):
+                        # run = (reutilizado, offset en dst o en src, longitud)
+                        nonlocal position, written
+                        reused, offset, length = run
+                        if reused:
+                            _copy_range(fold, fnew, offset, length, position)
+                        else:
+                            fnew.seek(position)
+                            for start in range(offset, offset + length, READ_BUFFER_BYTES):
+                                fnew.write(data[start:min(start + READ_BUFFER_BYTES, offset + length)])
+                            written += length
+                        position += length
+                    
+                    # Los bloques contiguos del mismo origen se copian o escriben de una vez
+                    run = None
+                    for start, end in iter_chunks(data):
+                        old_offset = old_offsets.get(hashlib.blake2b(data[start:end], digest_size=16).digest())
+                        chunk = (True, old_offset, end - start) if old_offset is not None else (False, start, end - start)
+                        if run and run[0] == chunk[0] and run[1] + run[2] == chunk[1]:
+                            run = (run[0], run[1], run[2] + chunk[2])
+                        else:
+                            if run:
+                                flush(run)
+                            run = chunk
+                    flush(run)
+            os.fsync(fnew.fileno())
+        shutil.copystat(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+    return written
+
+
+def update_file(src, dst, link_mode='auto'):
+    """Como place_file, pero reutilizando dst si ya existe.
+    
+    Si dst ya es src no se toca; si es un archivo regular grande, se
+    reconstruye con delta_write reutilizando sus bloques. En otro caso se
+    sustituye.
+    Devuelve (método, bytes escritos por delta_write o None).
+    """
+    try:
+        st = os.lstat(dst)
+    except FileNotFoundError:
+        return place_file(src, dst, link_mode), None
+    if stat.S_ISDIR(st.st_mode):
+        shutil.rmtree(dst)
+        return place_file(src, dst, link_mode), None
+    if os.path.samestat(st, os.stat(src)):
+        return 'sin cambios', 0
+    # delta_write sustituye dst, así que otros enlaces a él conservan el contenido anterior
+    if (link_mode in ('auto', 'copy') and stat.S_ISREG(st.st_mode)
+            and os.path.getsize(src) >= DELTA_MIN_BYTES):
+        return 'delta', delta_write(src, dst)
+    os.unlink(dst)
+    return place_file(src, dst, link_mode), None
+
+
+# Presupuestos del diff detallado; al agotarse se muestra solo un resumen
+DIFF_TIME_BUDGET = 5.0
+DIFF_MAX_BYTES = 256 * 1024 * 1024
+DIFF_CONTEXT = 3
+# Máximo de ediciones que Myers explora en una región sin anclas de patience
+MYERS_MAX_EDITS = 2000
+
+
+class DiffBudgetExceeded(Exception):
+    """Se agotó el tiempo o el número de ediciones asignado al diff detallado."""
+
+
+class LineFile:
+    """Archivo mapeado en memoria cuyas líneas se representan como IDs enteros.
+    
+    Solo se guardan el desplazamiento de cada línea y su ID; el texto se lee
+    del mapa bajo demanda, así que el diff no carga el archivo en memoria.
+    Las líneas idénticas de ambos archivos comparten ID a través de `interner`;
+    la identidad usa los bytes completos, salto de línea incluido, así que un
+    cambio de \\r\\n a \\n o la falta del salto final cuentan como diferencia.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self.offsets = array('Q')
+        self.ids = array('I')
+        self._map = None
+        if self.size == 0:
+            return
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def is_binary(self):
+        return self._map is not None and self._map.find(b'\x00', 0, 8192) != -1
+
+    def index_lines(self, interner):
+        """Divide el archivo en líneas y asigna a cada una su ID."""
+        mapped, pos = self._map, 0
+        if mapped is None:
+            return
+        while pos < self.size:
+            end = mapped.find(b'\n', pos)
+            end = self.size if end == -1 else end + 1
+            self.offsets.append(pos)
+            line = mapped[pos:end]
+            line_id = interner.get(line)
+            if line_id is None:
+                line_id = interner[line] = len(interner)
+            self.ids.append(line_id)
+            pos = end
+
+    def text(self, i):
+        """Texto de la línea i, sin el salto de línea final (\\n o \\r\\n)."""
+        raw = self.raw(i)
+        if raw.endswith(b'\r\n'):
+            raw = raw[:-2]
+        elif raw.endswith(b'\n'):
+            raw = raw[:-1]
+        try:
+            return raw.decode('utf-8')
+        except UnicodeDecodeError:
+            return raw.decode('latin-1')
+
+    def raw(self, i):
+        """Bytes de la línea i, incluido su salto de línea si lo tiene."""
+        end = self.offsets[i + 1] if i + 1 < len(self.offsets) else self.size
+        return self._map[self.offsets[i]:end]
+
+    def missing_newline(self, i):
+        """True si la línea i es la última y el archivo no termina en salto de línea."""
+        return i == len(self.offsets) - 1 and self._map[self.size - 1] != ord('\n')
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+
+def _myers_matches(a, b, a_lo, a_hi, b_lo, b_hi, deadline):
+    """Emparejamientos de una región mediante el algoritmo O(ND) de Myers.
+    
+    Si la región necesita más de MYERS_MAX_EDITS ediciones se considera
+    agotado el presupuesto, igual que al superar el tiempo.
+    """
+    n, m = a_hi - a_lo, b_hi - b_lo
+    v = {1: 0}
+    trace = []
+    for d in range(min(n + m, MYERS_MAX_EDITS) + 1):
+        if time.monotonic() > deadline:
+            raise DiffBudgetExceeded()
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                matches = []
+                for step, snapshot in reversed(list(enumerate(trace))):
+                    k = x - y
+                    if k == -step or (k != step and snapshot[k - 1] < snapshot[k + 1]):
+                        prev_k = k + 1
+                    else:
+                        prev_k = k - 1
+                    prev_x = snapshot[prev_k]
+                    prev_y = prev_x - prev_k
+                    while x > prev_x and y > prev_y:
+                        x -= 1
+                        y -= 1
+                        matches.append((a_lo + x, b_lo + y))
+                    x, y = prev_x, prev_y
+                return reversed(matches)
+    raise DiffBudgetExceeded()
+
+
+def _patience_matches(a, b, a_lo, a_hi, b_lo, b_hi, deadline):
+    """Genera, en orden, los pares (i, j) de líneas emparejadas por patience diff.
+    
+    Las líneas que aparecen una sola vez en cada lado sirven de anclas; las
+    regiones entre anclas se resuelven recursivamente y, si no tienen
+    anclas, con Myers.
+    """
+    if time.monotonic() > deadline:
+        raise DiffBudgetExceeded()
+    
+    while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+        yield a_lo, b_lo
+        a_lo += 1
+        b_lo += 1
+    suffix = 0
+    while a_lo < a_hi - suffix and b_lo < b_hi - suffix and a[a_hi - suffix - 1] == b[b_hi - suffix - 1]:
+        suffix += 1
+    a_hi -= suffix
+    b_hi -= suffix
+    
+    if a_lo < a_hi and b_lo < b_hi:
+        counts = {}
+        for i in range(a_lo, a_hi):
+            entry = counts.get(a[i])
+            counts[a[i]] = [1, i, None, 0] if entry is None else [entry[0] + 1, i, None, 0]
+        for j in range(b_lo, b_hi):
+            entry = counts.get(b[j])
+            if entry is not None:
+                entry[2] = j
+                entry[3] += 1
+        anchors = sorted((entry[1], entry[2]) for entry in counts.values()
+                         if entry[0] == 1 and entry[3] == 1)
+        del counts
+        
+        # Subsecuencia creciente más larga de las anclas (patience sorting)
+        tails, tail_js, links = [], [], {}
+        for i, j in anchors:
+            pos = bisect_left(tail_js, j)
+            links[(i, j)] = tails[pos - 1] if pos else None
+            if pos == len(tails):
+                tails.append((i, j))
+                tail_js.append(j)
+            else:
+                tails[pos] = (i, j)
+                tail_js[pos] = j
+        sequence = []
+        node = tails[-1] if tails else None
+        while node is not None:
+            sequence.append(node)
+            node = links[node]
+        sequence.reverse()
+        
+        if sequence:
+            prev_i, prev_j = a_lo, b_lo
+            for i, j in sequence:
+                yield from _patience_matches(a, b, prev_i, i, prev_j, j, deadline)
+                yield i, j
+                prev_i, prev_j = i + 1, j + 1
+            yield from _patience_matches(a, b, prev_i, a_hi, prev_j, b_hi, deadline)
+        else:
+            yield from _myers_matches(a, b, a_lo, a_hi, b_lo, b_hi, deadline)
+    
+    for offset in range(suffix):
+        yield a_hi + offset, b_hi + offset
+
+
+def iter_diff_hunks(file1, file2, deadline, context=DIFF_CONTEXT):
+    """Agrupa los emparejamientos en hunks y los genera en cuanto se completan.
+    
+    Cada hunk es (inicio_a, largo_a, inicio_b, largo_b, líneas) con líneas
+    como (marca, texto) y marca ' ', '-' o '+'. Tras una línea sin salto final
+    va ('\\', 'No newline at end of file'), que no cuenta en los largos.
+    """
+    n, m = len(file1.ids), len(file2.ids)
+    matches = _patience_matches(file1.ids, file2.ids, 0, n, 0, m, deadline)
+    
+    hunk = None
+    # Igualdades desde el último cambio: solo se guardan las primeras y últimas `context`
+    head, tail, equal_count = [], deque(maxlen=context), 0
+    pa = pb = 0
+    
+    def new_hunk(start_a, start_b):
+        return {'a': start_a, 'b': start_b, 'len_a': 0, 'len_b': 0, 'lines': []}
+    
+    def add(h, tag, i=None, j=None):
+        if tag == '+':
+            h['lines'].append(('+', file2.text(j)))
+            h['len_b'] += 1
+            missing = file2.missing_newline(j)
+        else:
+            h['lines'].append((tag, file1.text(i)))
+            h['len_a'] += 1
+            h['len_b'] += tag == ' '
+            missing = file1.missing_newline(i)
+        if missing:
+            h['lines'].append(('\\', 'No newline at end of file'))
+    
+    def finish(h):
+        # Como en diff -u, un lado vacío indica la línea tras la que se inserta (0 = inicio)
+        start_a = h['a'] + 1 if h['len_a'] else h['a']
+        start_b = h['b'] + 1 if h['len_b'] else h['b']
+        return start_a, h['len_a'], start_b, h['len_b'], h['lines']
+    
+    for i, j in chain(matches, [(n, m)]):
+        if i > pa or j > pb:
+            if hunk is None:
+                hunk = new_hunk(*(tail[0] if tail else (pa, pb)))
+                for li, _ in tail:
+                    add(hunk, ' ', li)
+            elif equal_count > 2 * context:
+                for li, _ in head[:context]:
+                    add(hunk, ' ', li)
+                yield finish(hunk)
+                hunk = new_hunk(*tail[0])
+                for li, _ in tail:
+                    add(hunk, ' ', li)
+            else:
+                # Separación corta: head contiene todas las igualdades intermedias
+                for li, _ in head:
+                    add(hunk, ' ', li)
+            for di in range(pa, i):
+                add(hunk, '-', di)
+            for dj in range(pb, j):
+                add(hunk, '+', j=dj)
+            head, tail, equal_count = [], deque(maxlen=context), 0
+        if i < n or j < m:
+            if len(head) < 2 * context:
+                head.append((i, j))
+            tail.append((i, j))
+            equal_count += 1
+            pa, pb = i + 1, j + 1
+    
+    if hunk is not None:
+        for li, _ in head[:context]:
+            add(hunk, ' ', li)
+        yield finish(hunk)
+
+def _match_array(base, other, deadline):
+    """Para cada línea de base, la línea emparejada en other o -1."""
+    matches = array('i', [-1]) * len(base.ids)
+    for i, j in _patience_matches(base.ids, other.ids, 0, len(base.ids), 0, len(other.ids), deadline):
+        matches[i] = j
+    return matches
+
+
+def merge_three_way(base_path, file1_path, file2_path, favor=None,
+                    time_budget=DIFF_TIME_BUDGET, max_bytes=DIFF_MAX_BYTES):
+    """Fusiona línea a línea dos versiones de un archivo a partir de su ancestro común.
+    
+    Los bloques que solo cambian en un lado, o que cambian igual en ambos,
+    se resuelven solos. Los conflictos reales se resuelven a favor de
+    `favor` ('dir1' o 'dir2') o, si es None, se escriben con marcadores de
+    conflicto al estilo diff3. Devuelve (contenido en bytes, número de
+    conflictos), o None si algún archivo es binario, supera los límites o no
+    se puede leer.
+    """
+    files = []
+    try:
+        for path in (base_path, file1_path, file2_path):
+            files.append(LineFile(path))
+    except (IOError, OSError, ValueError):
+        for line_file in files:
+            line_file.close()
+        return None
+    base, first, second = files
+    
+    try:
+        if any(f.is_binary for f in files) or sum(f.size for f in files) > max_bytes:
+            return None
+        interner = {}
+        for line_file in files:
+            line_file.index_lines(interner)
+        del interner
+        
+        deadline = time.monotonic() + time_budget
+        try:
+            match1 = _match_array(base, first, deadline)
+            match2 = _match_array(base, second, deadline)
+        except DiffBudgetExceeded:
+            return None
+        
+        out = []
+        conflicts = 0
+        n = len(base.ids)
+        lo = l1 = l2 = 0
+        while True:
+            # Bloque estable: líneas de base emparejadas consecutivamente en ambos lados
+            run = 0
+            while lo + run < n and match1[lo + run] == l1 + run and match2[lo + run] == l2 + run:
+                run += 1
+            if run:
+                out.extend(base.raw(i) for i in range(lo, lo + run))
+                lo, l1, l2 = lo + run, l1 + run, l2 + run
+                continue
+            
+            # Bloque inestable hasta la próxima línea de base emparejada en ambos lados
+            end = lo
+            while end < n and (match1[end] < 0 or match2[end] < 0):
+                end += 1
+            end1 = match1[end] if end < n else len(first.ids)
+            end2 = match2[end] if end < n else len(second.ids)
+            
+            chunk_base = base.ids[lo:end]
+            chunk1 = first.ids[l1:end1]
+            chunk2 = second.ids[l2:end2]
+            lines1 = [first.raw(i) for i in range(l1, end1)]
+            lines2 = [second.raw(i) for i in range(l2, end2)]
+            if chunk1 == chunk_base or chunk1 == chunk2:
+                out.extend(lines2 if chunk1 == chunk_base else lines1)
+            elif chunk2 == chunk_base:
+                out.extend(lines1)
+            else:
+                conflicts += 1
+                if favor == 'dir1':
+                    out.extend(lines1)
+                elif favor == 'dir2':
+                    out.extend(lines2)
+                else:
+                    out.append(b'<<<<<<< dir1\n')
+                    out.extend(_terminated(lines1))
+                    out.append(b'||||||| base\n')
+                    out.extend(_terminated(base.raw(i) for i in range(lo, end)))
+                    out.append(b'=======\n')
+                    out.extend(_terminated(lines2))
+                    out.append(b'>>>>>>> dir2\n')
+            
+            if end >= n:
+                break
+            lo, l1, l2 = end, end1, end2
+        return b''.join(out), conflicts
+    finally:
+        for line_file in files:
+            line_file.close()
+
+
+def _terminated(lines):
+    """Asegura que cada línea termine en salto de línea (para los marcadores)."""
+    for line in lines:
+        yield line if line.endswith(b'\n') else line + b'\n'
+
+
+class HashCache:
+    """Caché persistente de hashes para una raíz escaneada.
+
+    Cada raíz tiene su propio archivo SQLite. Una entrada solo se considera
+    válida si coinciden dispositivo, inodo, tamaño y mtime_ns; cualquier
+    modificación del archivo la invalida de forma natural.
+    """
+
+    SCHEMA_VERSION = 3
+    # Archivos modificados hace menos de este margen no se guardan: podrían
+    # cambiar de nuevo sin que su mtime avance (problema del "racy mtime").
+    RACY_WINDOW_NS = 2 * 10**9
+    POINT_LOOKUPS = 4096
+
+    def __init__(self, root, cache_dir, algorithm='md5'):
+        self.root = os.path.abspath(root)
+        self.algorithm = algorithm
+        self.path = self.cache_path_for(self.root, cache_dir)
+        self.hits = 0
+        self.misses = 0
+        self._pending = []
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            self.conn.execute('DROP TABLE IF EXISTS hashes')
+            self.conn.execute('DROP TABLE IF EXISTS dirs')
+            self.conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS hashes ('
+            'dev INTEGER, ino INTEGER, algorithm TEXT, size INTEGER, mtime_ns INTEGER, digest TEXT, '
+            'PRIMARY KEY (dev, ino, algorithm)) WITHOUT ROWID'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS dirs ('
+            'path TEXT, algorithm TEXT, stamp BLOB, digest BLOB, '
+            'PRIMARY KEY (path, algorithm)) WITHOUT ROWID'
+        )
+        # Las entradas de archivo se cargan al superar POINT_LOOKUPS consultas:
+        # si los digests Merkle permiten omitir casi todo, basta con consultas puntuales
+        self._entries = None
+        self._fresh = {}
+        self._point_lookups = 0
+        self._dirs = {
+            path: (stamp, digest)
+            for path, stamp, digest in self.conn.execute(
+                'SELECT path, stamp, digest FROM dirs WHERE algorithm = ?', (algorithm,))
+        }
+        self._pending_dirs = []
+
+    @staticmethod
+    def cache_path_for(root, cache_dir):
+        """Ruta del archivo de caché asociado a una raíz."""
+        key = hashlib.sha1(os.path.normcase(os.path.abspath(root)).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(cache_dir, f'{key}.sqlite')
+
+    def _lookup(self, key):
+        if self._entries is None and self._point_lookups < self.POINT_LOOKUPS:
+            self._point_lookups += 1
+            entry = self._fresh.get(key)
+            if entry is None:
+                entry = self.conn.execute(
+                    'SELECT size, mtime_ns, digest FROM hashes WHERE dev = ? AND ino = ? AND algorithm = ?',
+                    (*key, self.algorithm)).fetchone()
+            return entry
+        if self._entries is None:
+            self._entries = {
+                (dev, ino): (size, mtime_ns, digest)
+                for dev, ino, size, mtime_ns, digest in self.conn.execute(
+                    'SELECT dev, ino, size, mtime_ns, digest FROM hashes WHERE algorithm = ?', (self.algorithm,))
+            }
+            self._entries.update(self._fresh)
+        return self._entries.get(key)
+
+    def get(self, record):
+        """Devuelve el hash guardado para un FileRecord, o None."""
+        entry = self._lookup((record.dev, record.ino))
+        if entry is not None and entry[0] == record.size and entry[1] == record.mtime_ns:
+            self.hits += 1
+            return entry[2]
+        self.misses += 1
+        return None
+
+    def put(self, record, digest):
+        """Registra el hash de un archivo recién calculado."""
+        if time.time_ns() - record.mtime_ns < self.RACY_WINDOW_NS:
+            return
+        entries = self._fresh if self._entries is None else self._entries
+        entries[(record.dev, record.ino)] = (record.size, record.mtime_ns, digest)
+        self._pending.append((record.dev, record.ino, self.algorithm, record.size, record.mtime_ns, digest))
+
+    def get_dir(self, prefix, stamp):
+        """Devuelve el digest Merkle guardado de un directorio si su sello no cambió."""
+        entry = self._dirs.get(prefix)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        return None
+
+    def put_dir(self, prefix, stamp, digest, newest_mtime_ns):
+        """Registra el digest Merkle de un directorio (salvo si su subárbol es reciente)."""
+        if time.time_ns() - newest_mtime_ns < self.RACY_WINDOW_NS or self._dirs.get(prefix) == (stamp, digest):
+            return
+        self._dirs[prefix] = (stamp, digest)
+        self._pending_dirs.append((prefix, self.algorithm, stamp, digest))
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return (self.hits / total * 100) if total else 0.0
+
+    def close(self):
+        """Guarda las entradas nuevas y cierra la base de datos."""
+        if self._pending:
+            with self.conn:
+                self.conn.executemany('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)', self._pending)
+            self._pending = []
+        if self._pending_dirs:
+            with self.conn:
+                self.conn.executemany('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)', self._pending_dirs)
+            self._pending_dirs = []
+        self.conn.close()
+
+
+MANIFEST_MAGIC = b'CDMANIF\x00'
+MANIFEST_VERSION = 1
+# Cabecera: magia, versión, algoritmo, tamaño del digest, nº de archivos, offset del bloque de rutas
+_MANIFEST_HEADER = struct.Struct('<8sH16sHQQ')
+# Registro fijo (seguido del digest en bruto): tamaño, mtime_ns, offset y longitud de la ruta
+_MANIFEST_RECORD = struct.Struct('<QqQI')
+
+
+class Manifest:
+    """Manifiesto binario de un escaneo, legible por mmap sin deserializarlo.
+
+    Formato (little-endian): cabecera, tabla de registros de tamaño fijo
+    ordenada por ruta y un bloque con las rutas en UTF-8 separadas por '/'.
+    Cada registro se decodifica solo cuando se recorre.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _MANIFEST_HEADER.size:
+            self._map.close()
+            raise ValueError(f"{path} no es un manifiesto válido")
+        magic, version, algorithm, self.digest_size, self.count, self._paths_offset = \
+            _MANIFEST_HEADER.unpack_from(self._map, 0)
+        if magic != MANIFEST_MAGIC or version != MANIFEST_VERSION:
+            self._map.close()
+            raise ValueError(f"{path} no es un manifiesto compatible")
+        self.algorithm = algorithm.rstrip(b'\0').decode('ascii')
+        self._record_size = _MANIFEST_RECORD.size + self.digest_size
+
+    @staticmethod
+    def is_manifest(path):
+        """Indica si `path` es un archivo de manifiesto (por su firma)."""
+        try:
+            with open(path, 'rb') as f:
+                return f.read(len(MANIFEST_MAGIC)) == MANIFEST_MAGIC
+        except OSError:
+            return False
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """Genera (ruta, tamaño, mtime_ns, digest en bruto) en orden de ruta."""
+        data = self._map
+        offset = _MANIFEST_HEADER.size
+        for _ in range(self.count):
+            size, mtime_ns, path_offset, path_length = _MANIFEST_RECORD.unpack_from(data, offset)
+            digest_start = offset + _MANIFEST_RECORD.size
+            start = self._paths_offset + path_offset
+            path = data[start:start + path_length].decode('utf-8', 'surrogateescape')
+            yield path.replace('/', os.sep), size, mtime_ns, data[digest_start:digest_start + self.digest_size]
+            offset += self._record_size
+
+    def close(self):
+        self._map.close()
+
+    @staticmethod
+    def write(path, algorithm, entries):
+        """Escribe un manifiesto a partir de (ruta relativa, tamaño, mtime_ns, digest hex)."""
+        entries = sorted((relpath.replace(os.sep, '/').encode('utf-8', 'surrogateescape'), size, mtime_ns,
+                          bytes.fromhex(digest)) for relpath, size, mtime_ns, digest in entries)
+        digest_size = len(entries[0][3]) if entries else 0
+        paths_offset = _MANIFEST_HEADER.size + len(entries) * (_MANIFEST_RECORD.size + digest_size)
+        with open(path, 'wb') as f:
+            f.write(_MANIFEST_HEADER.pack(MANIFEST_MAGIC, MANIFEST_VERSION, algorithm.encode('ascii'),
+                                          digest_size, len(entries), paths_offset))
+            path_offset = 0
+            for encoded, size, mtime_ns, digest in entries:
+                f.write(_MANIFEST_RECORD.pack(size, mtime_ns, path_offset, len(encoded)))
+                f.write(digest)
+                path_offset += len(encoded)
+            for encoded, _, _, _ in entries:
+                f.write(encoded)
+        return paths_offset + path_offset
+
+
+# Directorios que nunca se recorren salvo que un patrón del usuario los reincluya
+DEFAULT_EXCLUDED_DIRS = ('node_modules', 'dist', '.next', '.git', '__pycache__',
+                         '.vscode', '.idea', 'build', 'target', 'venv',
+                         'vendor', 'bower_components', '.npm', '.cache')
+
+# Archivos de patrones leídos en cada directorio; los posteriores tienen prioridad
+IGNORE_FILES = ('.gitignore', '.ignore')
+
+
+def _translate_ignore_pattern(line):
+    """Traduce una línea de .gitignore a (regex, solo_directorios, negada), o None si no es un patrón."""
+    if line.startswith('#'):
+        return None
+    # Los espacios finales se ignoran salvo que estén escapados
+    stripped = line.rstrip(' ')
+    if stripped.endswith('\\') and len(stripped) < len(line):
+        stripped += ' '
+    line = stripped
+    negate = line.startswith('!')
+    if negate:
+        line = line[1:]
+    dir_only = line.endswith('/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+    anchored = '/' in line
+    line = line.lstrip('/')
+    
+    parts = []
+    i, n = 0, len(line)
+    while i < n:
+        c = line[i]
+        at_start = i == 0 or line[i - 1] == '/'
+        if line.startswith('**', i) and at_start and (i + 2 == n or line[i + 2] == '/'):
+            if i + 2 == n:
+                parts.append('.*')           # 'dir/**': todo lo que hay dentro
+                i += 2
+            else:
+                parts.append('(?:.*/)?')     # '**/' y '/**/': cero o más directorios
+                i += 3
+            continue
+        if c == '*':
+            while i < n and line[i] == '*':
+                i += 1
+            parts.append('[^/]*')
+            continue
+        if c == '?':
+            parts.append('[^/]')
+        elif c == '[':
+            end = line.find(']', i + 2 if line.startswith('[!', i) or line.startswith('[^', i) else i + 1)
+            if end < 0:
+                parts.append(re.escape(c))
+            else:
+                body = line[i + 1:end]
+                if body[:1] in ('!', '^'):
+                    body = '^' + body[1:]
+                parts.append('[' + body.replace('\\', '\\\\') + ']')
+                i = end
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            parts.append(re.escape(line[i]))
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    regex = ''.join(parts)
+    return ('' if anchored else '(?:.*/)?') + regex, dir_only, negate
+
+
+class IgnoreRules:
+    """Motor de exclusión con la sintaxis de .gitignore, compilado por nivel de directorio.
+
+    Los patrones de cada archivo .gitignore/.ignore se unen en una sola
+    expresión regular (una para archivos y otra para directorios) con las
+    alternativas en orden inverso, de modo que la primera que encaja es la
+    última regla aplicable y su número de grupo dice si estaba negada. Decidir
+    sobre una ruta cuesta una búsqueda por cada archivo de patrones entre la
+    raíz y ella, es decir O(profundidad), sin depender del número de
+    patrones. Los directorios excluidos se podan antes de entrar en ellos.
+
+    Un ámbito (scope) es la tupla de niveles heredados por un directorio:
+    (longitud del prefijo relativo del nivel, reglas compiladas), del menos
+    al más profundo. Las reglas globales (DEFAULT_EXCLUDED_DIRS y las del
+    usuario) tienen prioridad sobre las de los archivos.
+    """
+
+    def __init__(self, patterns=(), read_ignore_files=True):
+        self.read_ignore_files = read_ignore_files
+        self._global = self.compile([name + '/' for name in DEFAULT_EXCLUDED_DIRS] + list(patterns))
+
+    @staticmethod
+    def compile(lines):
+        """Compila líneas de patrones a ((regex, negaciones) de archivos, ídem de directorios), o None."""
+        rules = [rule for rule in map(_translate_ignore_pattern, lines) if rule is not None]
+        if not rules:
+            return None
+        
+        def combine(selected):
+            if not selected:
+                return None, ()
+            selected = selected[::-1]
+            regex = re.compile('|'.join(f'({pattern})' for pattern, _, _ in selected), re.DOTALL)
+            return regex, (None,) + tuple(negate for _, _, negate in selected)
+        
+        return combine([rule for rule in rules if not rule[1]]), combine(rules)
+
+    def enter(self, scope, directory, prefix, names):
+        """Devuelve el ámbito de `directory` (prefijo relativo `prefix`) a partir del heredado.
+        
+        `names` son los nombres presentes en el directorio; solo se abren los
+        archivos de patrones que aparezcan entre ellos.
+        """
+        if not self.read_ignore_files:
+            return scope
+        lines = []
+        for name in IGNORE_FILES:
+            if name in names:
+                try:
+                    with open(os.path.join(directory, name), 'r', encoding='utf-8', errors='surrogateescape') as f:
+                        lines.extend(f.read().splitlines())
+                except OSError:
+                    pass
+        compiled = self.compile(lines) if lines else None
+        return scope + ((len(prefix), compiled),) if compiled is not None else scope
+
+    def scope_for(self, root, subdir):
+        """Ámbito heredado por `subdir` (relativo a root, sin separador final): el de sus ancestros."""
+        scope = ()
+        parts = subdir.split(os.sep) if subdir else []
+        for depth in range(len(parts)):
+            prefix = ''.join(part + os.sep for part in parts[:depth])
+            directory = os.path.join(root, prefix)
+            scope = self.enter(scope, directory, prefix,
+                               [name for name in IGNORE_FILES if os.path.isfile(os.path.join(directory, name))])
+        return scope
+
+    def ignored(self, scope, path, is_dir):
+        """Indica si la ruta relativa `path` está excluida dentro de `scope`."""
+        if os.sep != '/':
+            path = path.replace(os.sep, '/')
+        kind = 1 if is_dir else 0
+        levels = chain(((0, self._global),), reversed(scope))
+        for base_len, compiled in levels:
+            if compiled is None:
+                continue
+            regex, negations = compiled[kind]
+            if regex is None:
+                continue
+            match = regex.fullmatch(path, base_len)
+            if match is not None:
+                return not negations[match.lastindex]
+        return False
+
+
+# Vigilancia: eventos de inotify (linux/inotify.h) y parámetros del bucle
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_ONLYDIR)
+WATCH_POLL_INTERVAL = 1.0    # segundos entre sondeos cuando no hay inotify
+WATCH_DEBOUNCE = 0.05        # silencio que cierra un lote de eventos
+WATCH_MAX_BATCH = 1.0        # un lote nunca espera más que esto aunque sigan llegando eventos
+
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def _load_inotify():
+    """Carga las funciones de inotify de la libc, o devuelve None si no existen."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class InotifyWatcher:
+    """Vigila uno o más árboles con inotify (Linux) a través de ctypes.
+
+    Cada directorio no excluido lleva su propia watch y los subdirectorios
+    nuevos se añaden al aparecer. `read_changes` agrupa los eventos en lotes
+    y devuelve solo las rutas tocadas, para no volver a recorrer el árbol.
+    """
+
+    def __init__(self, roots, exclusions):
+        self._libc = _load_inotify()
+        if self._libc is None:
+            raise OSError("inotify no disponible en este sistema")
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.roots = list(roots)
+        self.exclusions = exclusions
+        self.overflowed = False
+        self._watches = {}  # wd -> (índice de raíz, prefijo relativo del directorio)
+        self._scopes = {}   # (raíz, prefijo) -> (ámbito heredado, ámbito propio) de IgnoreRules
+        for k in range(len(self.roots)):
+            self.add_tree(k, '', ())
+
+    def add_tree(self, k, prefix, inherited):
+        """Añade watches al directorio `prefix` de la raíz k y a sus subdirectorios no excluidos."""
+        stack = [(prefix, inherited)]
+        while stack:
+            rel, inherited = stack.pop()
+            path = os.path.join(self.roots[k], rel) if rel else self.roots[k]
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    print(f"⚠️  Límite de watches alcanzado en {path} "
+                          f"(revisa fs.inotify.max_user_watches)")
+                continue
+            self._watches[wd] = (k, rel)
+            try:
+                with os.scandir(path) as it:
+                    entries = list(it)
+            except OSError:
+                entries = []
+            scope = self.exclusions.enter(inherited, path, rel, [entry.name for entry in entries])
+            self._scopes[(k, rel)] = (inherited, scope)
+            for entry in entries:
+                if (entry.is_dir(follow_symlinks=False)
+                        and not self.exclusions.ignored(scope, rel + entry.name, True)):
+                    stack.append((rel + entry.name + os.sep, scope))
+
+    def remove_tree(self, k, prefix):
+        """Retira las watches de un directorio que desapareció o se movió."""
+        for wd, (root, rel) in list(self._watches.items()):
+            if root == k and rel.startswith(prefix):
+                del self._watches[wd]
+                self._libc.inotify_rm_watch(self.fd, wd)
+        for key in [key for key in self._scopes if key[0] == k and key[1].startswith(prefix)]:
+            del self._scopes[key]
+
+    def read_changes(self, timeout=None):
+        """Espera eventos y devuelve (archivos, directorios) tocados como conjuntos de (raíz, ruta)."""
+        files, trees = set(), set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        deadline = time.monotonic() + WATCH_MAX_BATCH
+        while ready:
+            self._drain(files, trees)
+            if time.monotonic() >= deadline:
+                break
+            ready, _, _ = select.select([self.fd], [], [], WATCH_DEBOUNCE)
+        return files, trees
+
+    def _drain(self, files, trees):
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            
+            if mask & IN_Q_OVERFLOW:
+                self.overflowed = True
+                continue
+            watch = self._watches.get(wd)
+            if watch is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._watches[wd]
+                continue
+            if not name:
+                continue
+            k, prefix = watch
+            rel = prefix + name
+            inherited, scope = self._scopes.get((k, prefix), ((), ()))
+            if name in IGNORE_FILES and not mask & IN_ISDIR:
+                # Cambiaron las reglas del directorio: se recalcula su subárbol entero
+                self.remove_tree(k, prefix)
+                self.add_tree(k, prefix, inherited)
+                trees.add((k, prefix.rstrip(os.sep)))
+            if not mask & IN_ISDIR:
+                if not self.exclusions.ignored(scope, rel, False):
+                    files.add((k, rel))
+            elif not self.exclusions.ignored(scope, rel, True):
+                if mask & (IN_DELETE | IN_MOVED_FROM):
+                    self.remove_tree(k, rel + os.sep)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_tree(k, rel + os.sep, scope)
+                trees.add((k, rel))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LiveComparison:
+    """Comparación de dos árboles en memoria que se actualiza archivo a archivo.
+
+    Guarda por lado ruta -> (tamaño, mtime_ns, hash) y hash -> rutas, y a
+    partir de ellos los conjuntos de contenido único, conflictos e
+    idénticos. Cada cambio solo toca la ruta afectada y su grupo de hash.
+    """
+
+    def __init__(self):
+        self.entries = ({}, {})
+        self.by_hash = (defaultdict(set), defaultdict(set))
+        self.unique = (set(), set())
+        self.conflicts = set()
+        self.identical = set()
+
+    def set(self, side, path, size, mtime_ns, digest):
+        """Registra (o actualiza) el contenido de una ruta en un lado."""
+        self.remove(side, path, reclassify=False)
+        other = 1 - side
+        self.entries[side][path] = (size, mtime_ns, digest)
+        group = self.by_hash[side][digest]
+        group.add(path)
+        if len(group) == 1:
+            # El contenido deja de ser exclusivo del otro lado
+            self.unique[other].difference_update(self.by_hash[other].get(digest, ()))
+        if digest not in self.by_hash[other]:
+            self.unique[side].add(path)
+        self._classify(path)
+
+    def remove(self, side, path, reclassify=True):
+        """Olvida una ruta de un lado; devuelve False si no estaba registrada."""
+        entry = self.entries[side].pop(path, None)
+        if entry is None:
+            return False
+        other = 1 - side
+        digest = entry[2]
+        group = self.by_hash[side][digest]
+        group.discard(path)
+        self.unique[side].discard(path)
+        if not group:
+            del self.by_hash[side][digest]
+            # El contenido vuelve a ser exclusivo del otro lado
+            self.unique[other].update(self.by_hash[other].get(digest, ()))
+        if reclassify:
+            self._classify(path)
+        return True
+
+    def _classify(self, path):
+        self.conflicts.discard(path)
+        self.identical.discard(path)
+        entry1 = self.entries[0].get(path)
+        entry2 = self.entries[1].get(path)
+        if entry1 is not None and entry2 is not None:
+            (self.identical if entry1[2] == entry2[2] else self.conflicts).add(path)
+
+    def status(self, side, path):
+        """Describe en una frase el estado actual de una ruta."""
+        if path in self.conflicts:
+            return "contenido diferente en ambos directorios"
+        if path in self.identical:
+            return "idéntico en ambos directorios"
+        if path not in self.entries[side]:
+            return "eliminado"
+        if path in self.unique[side]:
+            return "contenido único"
+        return "su contenido también existe en el otro directorio"
+
+
+# Segundos mínimos entre dos redibujados de la línea de progreso
+PROGRESS_INTERVAL = 0.2
+
+# Archivos recorridos entre dos avisos de progreso durante el escaneo
+WALK_PROGRESS_FILES = 1024
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m{seconds:02d}s" if minutes else f"{seconds}s"
+
+
+class Instrumentation:
+    """Contadores y temporizadores por fase y por hilo, con línea de progreso opcional.
+
+    Los contadores se actualizan por lote de trabajo, no por archivo. Cuando
+    la instrumentación está desactivada el comparador no crea ninguna y solo
+    comprueba que su atributo es None, así que el coste es despreciable.
+    Las fases con el mismo nombre que se solapan (p. ej. el recorrido de
+    varios árboles en paralelo) cuentan su tiempo de reloj una sola vez.
+    """
+
+    def __init__(self, progress=False, stream=None):
+        self.progress = progress
+        self.stream = stream or sys.stderr
+        self.started = time.perf_counter()
+        self.phases = {}
+        self._workers = defaultdict(lambda: {'items': 0, 'bytes': 0, 'busy_s': 0.0})
+        self._lock = threading.Lock()
+        self._last_draw = 0.0
+        self._drawn = False
+
+    @contextlib.contextmanager
+    def phase(self, name, total_files=0, total_bytes=0):
+        """Mide una fase; `total_*` permiten estimar el ETA de la línea de progreso.
+
+        Devuelve el dict de la fase, que es lo que hay que pasar a advance().
+        """
+        with self._lock:
+            stats = self.phases.setdefault(name, {'name': name, 'wall_s': 0.0, 'calls': 0, 'files': 0, 'bytes': 0,
+                                                  'total_files': 0, 'total_bytes': 0, 'active': 0})
+            stats['calls'] += 1
+            stats['total_files'] += total_files
+            stats['total_bytes'] += total_bytes
+            if not stats['active']:
+                stats['started'] = time.perf_counter()
+            stats['active'] += 1
+        try:
+            yield stats
+        finally:
+            with self._lock:
+                stats['active'] -= 1
+                if not stats['active']:
+                    stats['wall_s'] += time.perf_counter() - stats['started']
+                self._clear()
+
+    def advance(self, stats, files, nbytes=0, busy=None):
+        """Suma trabajo terminado a la fase `stats` (y al hilo actual si hay `busy`).
+
+        `stats` es el dict que devuelve phase(): con fases solapadas en varios
+        hilos, la fase que entró la última no tiene por qué ser la que trabaja.
+        """
+        with self._lock:
+            name = stats['name']
+            stats['files'] += files
+            stats['bytes'] += nbytes
+            if busy is not None:
+                worker = self._workers[(name, threading.current_thread().name)]
+                worker['items'] += files
+                worker['bytes'] += nbytes
+                worker['busy_s'] += busy
+            if self.progress:
+                now = time.perf_counter()
+                if now - self._last_draw >= PROGRESS_INTERVAL:
+                    self._last_draw = now
+                    self._draw(name, stats, now)
+
+    def _draw(self, name, stats, now):
+        elapsed = now - stats['started']
+        line = f"   ⏳ {name}: {stats['files']}"
+        if stats['total_files']:
+            line += f"/{stats['total_files']}"
+        line += " archivos"
+        if stats['total_bytes'] or stats['bytes']:
+            line += f", {stats['bytes'] / (1024 * 1024):.1f}"
+            if stats['total_bytes']:
+                line += f"/{stats['total_bytes'] / (1024 * 1024):.1f}"
+            line += " MB"
+            if elapsed > 0:
+                line += f" ({stats['bytes'] / (1024 * 1024) / elapsed:.1f} MB/s)"
+        # El ETA se estima por bytes si se conocen y, si no, por archivos
+        done, total = ((stats['bytes'], stats['total_bytes']) if stats['total_bytes']
+                       else (stats['files'], stats['total_files']))
+        if total and done and elapsed > 0:
+            line += f", ETA {_format_duration(elapsed * (total - done) / done)}"
+        self.stream.write('\r' + line.ljust(79))
+        self.stream.flush()
+        self._drawn = True
+
+    def _clear(self):
+        if self._drawn:
+            self.stream.write('\r' + ' ' * 79 + '\r')
+            self.stream.flush()
+            self._drawn = False
+
+    def as_dict(self):
+        """Devuelve todas las métricas en un dict serializable a JSON."""
+        with self._lock:
+            phases = {}
+            for name, stats in self.phases.items():
+                wall = stats['wall_s']
+                phases[name] = {
+                    'wall_s': round(wall, 6),
+                    'calls': stats['calls'],
+                    'files': stats['files'],
+                    'bytes': stats['bytes'],
+                    'files_per_s': round(stats['files'] / wall, 1) if wall else None,
+                    'mb_per_s': round(stats['bytes'] / (1024 * 1024) / wall, 2) if wall and stats['bytes'] else None,
+                    'workers': {},
+                }
+            for (name, thread), worker in sorted(self._workers.items()):
+                phases[name]['workers'][thread] = dict(worker, busy_s=round(worker['busy_s'], 6))
+        return {'wall_s': round(time.perf_counter() - self.started, 6),
+                'peak_rss_bytes': get_peak_rss_bytes(), 'phases': phases}
+
+    def report(self):
+        """Muestra una línea con el tiempo de cada fase."""
+        phases = self.as_dict()['phases']
+        if phases:
+            summary = ', '.join(f"{name} {stats['wall_s']:.2f}s" for name, stats in phases.items())
+            print(f"\n⏱️  Tiempo por fase: {summary}")
+
+    def dump(self, path):
+        """Guarda las métricas en un archivo JSON."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.as_dict(), f, ensure_ascii=False, indent=2)
+        print(f"💾 Métricas guardadas en: {path}")
+
+
+# Elementos del merge interactivo cuya vista previa o diff se prepara por adelantado
+MERGE_LOOKAHEAD = 4
+
+
+class MergePipeline:
+    """Copias en segundo plano y vistas previas anticipadas para el merge interactivo.
+
+    Las copias aceptadas se encolan en un pool de hilos y el bucle de
+    preguntas sigue sin esperar. Mientras el usuario decide, otro pool
+    prepara la vista previa o el diff de los siguientes elementos, de modo
+    que la pregunta no espera a la E/S. finish() es la barrera final: espera
+    las copias pendientes e informa de los errores.
+    """
+
+    def __init__(self, workers, lookahead=MERGE_LOOKAHEAD):
+        self.lookahead = max(1, lookahead)
+        self._copies = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='copy')
+        self._renders = ThreadPoolExecutor(max_workers=self.lookahead, thread_name_prefix='preview')
+        self._pending = []
+        self._last = {}
+
+    def copy(self, src, dst):
+        """Encola la copia de src a dst."""
+        self._enqueue(dst, place_file, src, dst)
+
+    def write(self, dst, content):
+        """Encola la escritura de `content` (bytes) en dst."""
+        self._enqueue(dst, self._write, dst, content)
+
+    def _enqueue(self, dst, func, *args):
+        # Dos operaciones sobre el mismo destino se aplican en el orden en que se
+        # eligieron; la cola es FIFO, así que la anterior ya está en marcha
+        previous = self._last.get(dst)
+
+        def run():
+            if previous is not None:
+                wait([previous])
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            return func(*args)
+
+        future = self._last[dst] = self._copies.submit(run)
+        self._pending.append((dst, future))
+
+    @staticmethod
+    def _write(dst, content):
+        with open(dst, 'wb') as f:
+            f.write(content)
+        return 'escritura'
+
+    def submit(self, func, *args):
+        """Ejecuta func en el pool de vistas previas y devuelve su Future."""
+        return self._renders.submit(func, *args)
+
+    def prepared(self, func, items):
+        """Genera (elemento, func(elemento)) en orden, con `lookahead` elementos en preparación."""
+        items = iter(items)
+        in_flight = deque()
+        while True:
+            while len(in_flight) < self.lookahead:
+                item = next(items, None)
+                if item is None:
+                    break
+                in_flight.append((item, self._renders.submit(func, item)))
+            if not in_flight:
+                return
+            item, future = in_flight.popleft()
+            yield item, future.result()
+
+    def finish(self):
+        """Espera todas las copias encoladas y devuelve (completadas, errores)."""
+        done, errors = 0, []
+        for dst, future in self._pending:
+            try:
+                future.result()
+                done += 1
+            except OSError as e:
+                errors.append(f"{dst}: {e}")
+        self._pending = []
+        self._last = {}
+        return done, errors
+
+    def close(self):
+        """Detiene los pools; las copias que ya están en curso terminan, las encoladas se cancelan."""
+        self._renders.shutdown(wait=False, cancel_futures=True)
+        self._copies.shutdown(wait=True, cancel_futures=True)
+
 
 class ContentDirectoryComparator:
-    def __init__(self):
-        self.excluded_dirs = {'node_modules', 'dist', '.next', '.git', '__pycache__', 
-                             '.vscode', '.idea', 'build', 'target', 'venv',
-                             'vendor', 'bower_components', '.npm', '.cache'}
+    def __init__(self, use_cache=True, cache_dir=None, workers=DEFAULT_WORKERS,
+                 hash_algorithm='md5', prefilter_algorithm=DEFAULT_PREFILTER_ALGORITHM,
+                 diff_time_budget=DIFF_TIME_BUDGET, diff_max_bytes=DIFF_MAX_BYTES, instrumentation=None,
+                 exclude=(), use_ignore_files=True):
+        # DEFAULT_EXCLUDED_DIRS, los patrones de `exclude` y, si se pide, .gitignore/.ignore
+        self.exclusions = IgnoreRules(exclude, use_ignore_files)
         self.current_dir = os.getcwd()
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir or get_default_cache_dir()
+        self.workers = max(1, workers)
+        if hash_algorithm not in HASH_ALGORITHMS:
+            raise ValueError(f"Algoritmo de hash no soportado: {hash_algorithm}")
+        if prefilter_algorithm not in PREFILTER_ALGORITHMS:
+            raise ValueError(f"Algoritmo de prefiltro no soportado: {prefilter_algorithm}")
+        self.hash_algorithm = hash_algorithm
+        self.prefilter_algorithm = prefilter_algorithm
+        self.diff_time_budget = diff_time_budget
+        self.diff_max_bytes = diff_max_bytes
+        self.instrumentation = instrumentation
+
+    def phase(self, name, items=None, weight=None):
+        """Contexto que mide una fase si hay instrumentación; si no, no hace nada.
+        
+        Con `items` (y `weight`, que da los bytes de cada uno) se fijan los
+        totales de la fase para el ETA; solo se calculan si se van a usar.
+        Devuelve la fase que espera Instrumentation.advance(), o None.
+        """
+        if self.instrumentation is None:
+            return contextlib.nullcontext()
+        total_files = len(items) if items is not None else 0
+        total_bytes = sum(map(weight, items)) if items is not None and weight is not None else 0
+        return self.instrumentation.phase(name, total_files, total_bytes)
 
     def get_available_directories(self):
         """Obtiene la lista de directorios disponibles, excluyendo los no deseados."""
         items = os.listdir(self.current_dir)
+        scope = self.exclusions.enter((), self.current_dir, '', items)
         directories = []
         
         for item in items:
             item_path = os.path.join(self.current_dir, item)
-            if os.path.isdir(item_path):
-                if not any(fnmatch.fnmatch(item, pattern) for pattern in self.excluded_dirs):
-                    if item not in self.excluded_dirs:
-                        directories.append(item)
+            if os.path.isdir(item_path) and not self.exclusions.ignored(scope, item, True):
+                directories.append(item)
         
         return sorted(directories)
 
@@ -70,182 +2042,1089 @@ class ContentDirectoryComparator:
                 print("❌ Error: Entrada no válida")
                 print("   Usa 'this', 'exit', un número de la lista, o el nombre de un directorio")
 
-    def is_excluded(self, path):
-        """Verifica si una ruta debe ser excluida de la comparación."""
-        parts = path.split(os.sep)
-        return any(part in self.excluded_dirs for part in parts)
-
     def get_file_hash(self, filepath):
-        """Calcula el hash MD5 de un archivo para comparar contenido."""
+        """Calcula el hash de un archivo (según hash_algorithm) para comparar contenido.
+        
+        Los archivos grandes se mapean en memoria; el resto se lee con
+        readinto sobre un búfer reutilizado, sin crear un bytes por bloque.
+        """
         try:
-            hasher = hashlib.md5()
-            with open(filepath, 'rb') as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hasher.update(chunk)
+            hasher = HASH_ALGORITHMS[self.hash_algorithm]()
+            with open(filepath, 'rb', buffering=0) as f:
+                size = os.fstat(f.fileno()).st_size
+                if size >= MMAP_THRESHOLD_BYTES:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        hasher.update(mapped)
+                else:
+                    hash_stream(hasher, f)
             return hasher.hexdigest()
         except (IOError, OSError) as e:
             print(f"⚠️  Error leyendo archivo {filepath}: {e}")
             return None
 
+    def open_cache(self, directory):
+        """Abre la caché de hashes de un directorio, o None si está desactivada."""
+        if not self.use_cache:
+            return None
+        try:
+            return HashCache(directory, self.cache_dir, self.hash_algorithm)
+        except (sqlite3.Error, OSError) as e:
+            print(f"⚠️  Caché no disponible para {directory}: {e}")
+            return None
+
+    def invalidate_cache(self, directory=None):
+        """Elimina la caché de un directorio, o todas las cachés si no se indica ninguno."""
+        if directory is not None:
+            paths = [HashCache.cache_path_for(directory, self.cache_dir)]
+        elif os.path.isdir(self.cache_dir):
+            paths = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                     if name.endswith('.sqlite')]
+        else:
+            paths = []
+        
+        removed = 0
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+                removed += 1
+        print(f"🗑️  Caché invalidada ({removed} archivo(s) eliminado(s))")
+        return removed
+
+    def report_cache(self, cache):
+        """Muestra la tasa de aciertos de la caché tras un escaneo."""
+        if cache is not None:
+            total = cache.hits + cache.misses
+            print(f"   💾 Caché ({cache.algorithm}): {cache.hits}/{total} aciertos ({cache.hit_rate:.1f}%)")
+
+    def iter_files(self, directory, subdir=''):
+        """Recorre un directorio con os.scandir y genera un FileRecord por archivo.
+        
+        Reutiliza el stat de cada DirEntry, construye las rutas relativas de
+        forma incremental y poda los directorios excluidos (IgnoreRules)
+        antes de entrar en ellos. Con `subdir` solo se recorre ese
+        subdirectorio, con rutas y reglas relativas a `directory`.
+        """
+        start = os.path.join(directory, subdir) if subdir else directory
+        try:
+            root_dev = os.stat(start).st_dev
+        except OSError as e:
+            print(f"⚠️  Advertencia: Sin acceso a {start}: {e}")
+            return
+        exclusions = self.exclusions
+        
+        # Pila de (ruta_completa, prefijo_relativo, ámbito heredado); mismo orden que os.walk
+        stack = [(start, subdir + os.sep if subdir else '', exclusions.scope_for(directory, subdir))]
+        while stack:
+            current, prefix, scope = stack.pop()
+            subdirs = []
+            try:
+                with os.scandir(current) as it:
+                    entries = list(it)
+            except PermissionError:
+                print(f"⚠️  Advertencia: Sin permisos para acceder a {current}")
+                continue
+            except OSError as e:
+                print(f"⚠️  Advertencia: No se pudo listar {current}: {e}")
+                continue
+            scope = exclusions.enter(scope, current, prefix, [entry.name for entry in entries])
+            for entry in entries:
+                path = prefix + entry.name
+                try:
+                    if entry.is_dir():
+                        if not entry.is_symlink() and not exclusions.ignored(scope, path, True):
+                            subdirs.append((entry.path, path + os.sep, scope))
+                        continue
+                    if exclusions.ignored(scope, path, False):
+                        continue
+                    st = entry.stat()
+                except OSError as e:
+                    print(f"⚠️  Error leyendo archivo {entry.path}: {e}")
+                    continue
+                # En Windows el stat de DirEntry no trae inodo ni dispositivo
+                yield FileRecord(path, st.st_size, st.st_mtime_ns,
+                                 st.st_ino or entry.inode(), st.st_dev or root_dev)
+            stack.extend(reversed(subdirs))
+
+    def collect_files(self, directory):
+        """Devuelve la lista de FileRecord de un directorio."""
+        with self.phase('walk') as phase:
+            records = list(self.iter_files(directory))
+            if phase is not None:
+                self.instrumentation.advance(phase, len(records))
+        return records
+
+    def hash_records(self, directory, records):
+        """Devuelve el hash completo de cada FileRecord, usando la caché si está activa."""
+        cache = self.open_cache(directory)
+        try:
+            with self.phase('cache'):
+                hashes = [cache.get(record) if cache is not None else None for record in records]
+            
+            pending = [i for i, file_hash in enumerate(hashes) if file_hash is None]
+            weight = lambda i: records[i].size
+            with self.phase('full', pending, weight) as phase:
+                computed = self.parallel_map(lambda i: self.get_file_hash(os.path.join(directory, records[i].path)),
+                                             pending, weight, phase)
+                for i, file_hash in zip(pending, computed):
+                    hashes[i] = file_hash
+                    if file_hash and cache is not None:
+                        cache.put(records[i], file_hash)
+            
+            self.report_cache(cache)
+            return hashes
+        finally:
+            if cache is not None:
+                cache.close()
+
     def scan_directory_content(self, directory):
         """Escanea un directorio y crea un mapa de contenido -> archivos."""
         content_map = defaultdict(list)
+        records = self.collect_files(directory)
+        
         file_count = 0
+        for record, file_hash in zip(records, self.hash_records(directory, records)):
+            if file_hash:
+                content_map[file_hash].append(record.path)
+                file_count += 1
         
+        return content_map, file_count
+
+    def parallel_map(self, func, items, weight=None, phase=None):
+        """Aplica func a cada elemento en el pool de hilos y genera los resultados en orden.
+        
+        hashlib libera el GIL al procesar bloques grandes, así que varios hilos
+        leyendo y hasheando a la vez aprovechan discos NVMe y unidades de red.
+        Los elementos se envían en lotes y solo hay unos pocos lotes en vuelo,
+        de modo que la memoria no crece con el número de archivos. Con
+        instrumentación, cada lote suma su tiempo y sus bytes (según
+        `weight`) a `phase` y al hilo que lo ejecutó.
+        """
+        instrumentation = self.instrumentation if phase is not None else None
+        if self.workers <= 1 and instrumentation is None:
+            yield from map(func, items)
+            return
+        
+        def run_batch(batch):
+            if instrumentation is None:
+                return [func(item) for item in batch]
+            start = time.perf_counter()
+            results = [func(item) for item in batch]
+            instrumentation.advance(phase, len(batch), sum(map(weight, batch)) if weight is not None else 0,
+                                    time.perf_counter() - start)
+            return results
+        
+        items = iter(items)
+        if self.workers <= 1:
+            for batch in iter(lambda: list(islice(items, PARALLEL_BATCH_SIZE)), []):
+                yield from run_batch(batch)
+            return
+        
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='worker') as pool:
+            in_flight = deque()
+            while True:
+                while len(in_flight) < self.workers * 2:
+                    batch = list(islice(items, PARALLEL_BATCH_SIZE))
+                    if not batch:
+                        break
+                    in_flight.append(pool.submit(run_batch, batch))
+                if not in_flight:
+                    break
+                yield from in_flight.popleft().result()
+
+    def get_partial_hash(self, filepath, size):
+        """Calcula un hash rápido del principio y el final de un archivo.
+        
+        Devuelve (hash, es_completo). Si el archivo cabe entero en las dos
+        ventanas se calcula directamente el hash completo.
+        """
+        if size <= 2 * PARTIAL_HASH_BYTES:
+            return self.get_file_hash(filepath), True
         try:
-            for root, dirnames, filenames in os.walk(directory):
-                # Excluir directorios no deseados
-                dirnames[:] = [d for d in dirnames if d not in self.excluded_dirs]
-                
-                for filename in filenames:
-                    full_path = os.path.join(root, filename)
-                    if not self.is_excluded(full_path):
-                        relative_path = os.path.relpath(full_path, directory)
-                        file_hash = self.get_file_hash(full_path)
-                        
-                        if file_hash:
-                            content_map[file_hash].append(relative_path)
-                            file_count += 1
+            hasher = PREFILTER_ALGORITHMS[self.prefilter_algorithm]()
+            with open(filepath, 'rb', buffering=0) as f:
+                hash_stream(hasher, f, PARTIAL_HASH_BYTES)
+                f.seek(-PARTIAL_HASH_BYTES, os.SEEK_END)
+                hash_stream(hasher, f, PARTIAL_HASH_BYTES)
+            return hasher.hexdigest(), False
+        except (IOError, OSError) as e:
+            print(f"⚠️  Error leyendo archivo {filepath}: {e}")
+            return None, False
+
+    def build_index(self, directory, paths):
+        """Escanea un directorio directamente a un ScanIndex, sin listas intermedias."""
+        index = ScanIndex(directory, paths)
+        instrumentation = self.instrumentation
+        with self.phase('walk') as phase:
+            for record in self.iter_files(directory):
+                index.add(record)
+                if phase is not None and len(index) % WALK_PROGRESS_FILES == 0:
+                    instrumentation.advance(phase, WALK_PROGRESS_FILES)
+            if phase is not None:
+                instrumentation.advance(phase, len(index) % WALK_PROGRESS_FILES)
+        return index
+
+    def load_manifest_index(self, manifest_path, paths, digests):
+        """Carga un manifiesto como ScanIndex no legible con los digests ya resueltos."""
+        manifest = Manifest(manifest_path)
+        try:
+            if manifest.algorithm != self.hash_algorithm:
+                raise ValueError(f"El manifiesto {manifest_path} usa {manifest.algorithm}, "
+                                 f"no {self.hash_algorithm}")
+            index = ScanIndex(manifest_path, paths, readable=False)
+            with self.phase('manifest') as phase:
+                for path, size, mtime_ns, digest in manifest:
+                    index.add(FileRecord(path, size, mtime_ns, 0, 0), digests.intern_raw(digest))
+                if phase is not None:
+                    self.instrumentation.advance(phase, len(index))
+            return index
+        finally:
+            manifest.close()
+
+    def export_manifest(self, directory, manifest_path):
+        """Escanea y hashea un directorio y guarda el resultado como manifiesto binario."""
+        print(f"\n🔍 Escaneando {directory}...")
+        records = self.collect_files(directory)
+        hashes = self.hash_records(directory, records)
+        entries = [(record.path, record.size, record.mtime_ns, file_hash)
+                   for record, file_hash in zip(records, hashes) if file_hash]
+        size = Manifest.write(manifest_path, self.hash_algorithm, entries)
+        print(f"💾 Manifiesto guardado en {manifest_path}: {len(entries)} archivos, "
+              f"{size / (1024 * 1024):.1f} MB ({self.hash_algorithm})")
+        return len(entries)
+
+    def resolve_digests(self, indexes, caches, digests):
+        """Rellena digest_ids de uno o varios ScanIndex.
+        
+        Etapas: (1) agrupar por tamaño, gratis a partir de stat; (2) hash
+        parcial solo de los archivos que comparten tamaño; (3) hash completo
+        solo cuando el hash parcial colisiona. Los archivos descartados antes
+        de la etapa 3 quedan como DIGEST_UNIQUE, ya que su contenido no puede
+        coincidir con ningún otro. Las etapas 2 y 3 se reparten entre los
+        hilos de trabajo. Solo se crean listas para los candidatos de cada
+        etapa, nunca para todos los archivos.
+        """
+        stats = {'size': 0, 'partial': 0, 'full': 0}
+        
+        # Consultar la caché; los aciertos ya quedan resueltos
+        with self.phase('cache'):
+            for index, cache in zip(indexes, caches):
+                if cache is None:
+                    continue
+                for i in range(len(index)):
+                    if index.digest_ids[i] == DIGEST_PAIRED:
+                        continue
+                    cached_hash = cache.get(index.record(i))
+                    if cached_hash is not None:
+                        index.digest_ids[i] = digests.intern(cached_hash)
+        
+        # Etapa 1: agrupar por tamaño
+        with self.phase('size'):
+            size_counts = defaultdict(int)
+            pending_sizes = set()
+            resolved_sizes = set()
+            for index in indexes:
+                for size, digest_id in zip(index.sizes, index.digest_ids):
+                    size_counts[size] += 1
+                    if digest_id == DIGEST_UNREADABLE:
+                        pending_sizes.add(size)
+                    elif digest_id >= 0:
+                        resolved_sizes.add(size)
+
+            # Los archivos de subárboles idénticos solo hacen falta si su tamaño
+            # coincide con el de algún archivo fuera de ellos, pendiente o ya resuelto
+            # (acierto de caché o manifiesto): entonces se resuelven también
+            paired_pending = set()
+            for index, cache in zip(indexes, caches):
+                for i, digest_id in enumerate(index.digest_ids):
+                    size = index.sizes[i]
+                    if digest_id == DIGEST_PAIRED and (size in pending_sizes or size in resolved_sizes):
+                        cached_hash = cache.get(index.record(i)) if cache is not None else None
+                        if cached_hash:
+                            index.digest_ids[i] = digests.intern(cached_hash)
+                        else:
+                            index.digest_ids[i] = DIGEST_UNREADABLE
+                            paired_pending.add(size)
+            pending_sizes |= paired_pending
             
-            return content_map, file_count
-        except PermissionError:
-            print(f"⚠️  Advertencia: Sin permisos para acceder a {directory}")
-            return {}, 0
+            # Los manifiestos no se pueden releer: un archivo pendiente con el tamaño
+            # de alguno de sus archivos necesita directamente el hash completo
+            fixed_sizes = set()
+            for index in indexes:
+                if not index.readable:
+                    fixed_sizes.update(index.sizes)
+            
+            # Los candidatos se guardan como un solo entero: posición * n + índice del árbol
+            n = len(indexes)
+            needs_partial = array('Q')
+            needs_full = array('Q')
+            for k, index in enumerate(indexes):
+                if not index.readable:
+                    continue
+                for i, size in enumerate(index.sizes):
+                    if index.digest_ids[i] == DIGEST_UNREADABLE and size in fixed_sizes:
+                        needs_full.append(i * n + k)
+                    elif size_counts[size] > 1 and size in pending_sizes:
+                        needs_partial.append(i * n + k)
+                    elif index.digest_ids[i] == DIGEST_UNREADABLE:
+                        index.digest_ids[i] = DIGEST_UNIQUE
+                        stats['size'] += 1
+            del size_counts, pending_sizes, resolved_sizes, paired_pending, fixed_sizes
+            
+        
+        # Etapa 2: hash parcial de los archivos que comparten tamaño
+        def partial_hash(pos):
+            i, k = divmod(pos, n)
+            return self.get_partial_hash(indexes[k].full_path(i), indexes[k].sizes[i])
+        
+        def partial_weight(pos):
+            i, k = divmod(pos, n)
+            return min(indexes[k].sizes[i], 2 * PARTIAL_HASH_BYTES)
+        
+        by_partial = defaultdict(list)
+        with self.phase('partial', needs_partial, partial_weight) as phase:
+            for pos, (partial, is_full) in zip(needs_partial,
+                                               self.parallel_map(partial_hash, needs_partial, partial_weight, phase)):
+                i, k = divmod(pos, n)
+                index = indexes[k]
+                if partial is None:
+                    index.digest_ids[i] = DIGEST_UNREADABLE
+                elif is_full:
+                    if index.digest_ids[i] < 0 and caches[k] is not None:
+                        caches[k].put(index.record(i), partial)
+                    index.digest_ids[i] = digests.intern(partial)
+                    stats['full'] += 1
+                else:
+                    by_partial[(index.sizes[i], partial)].append(pos)
+        del needs_partial
+        
+        for group in by_partial.values():
+            for pos in group:
+                i, k = divmod(pos, n)
+                if indexes[k].digest_ids[i] >= 0:
+                    continue
+                if len(group) == 1:
+                    indexes[k].digest_ids[i] = DIGEST_UNIQUE
+                    stats['partial'] += 1
+                else:
+                    needs_full.append(pos)
+        del by_partial
+        
+        # Etapa 3: hash completo solo ante colisiones del hash parcial
+        def full_hash(pos):
+            i, k = divmod(pos, n)
+            return self.get_file_hash(indexes[k].full_path(i))
+        
+        def full_weight(pos):
+            i, k = divmod(pos, n)
+            return indexes[k].sizes[i]
+        
+        with self.phase('full', needs_full, full_weight) as phase:
+            for pos, file_hash in zip(needs_full, self.parallel_map(full_hash, needs_full, full_weight, phase)):
+                i, k = divmod(pos, n)
+                index = indexes[k]
+                stats['full'] += 1
+                if not file_hash:
+                    index.digest_ids[i] = DIGEST_UNREADABLE
+                    continue
+                index.digest_ids[i] = digests.intern(file_hash)
+                if caches[k] is not None:
+                    caches[k].put(index.record(i), file_hash)
+        
+        print(f"   ⚡ Prefiltro: {stats['size']} descartados por tamaño, "
+              f"{stats['partial']} por hash parcial, {stats['full']} hashes completos")
+
+    def compare_indexes(self, index1, index2, digests):
+        """Compara dos ScanIndex ya resueltos trabajando solo con IDs enteros."""
+        with self.phase('compare'):
+            return self._compare_indexes(index1, index2, digests)
+
+    def _compare_indexes(self, index1, index2, digests):
+        result = ComparisonResult(index1, index2, digests)
+        
+        # Presencia de cada contenido: bit 1 = primer directorio, bit 2 = segundo
+        presence = bytearray(len(digests))
+        for digest_id in index1.digest_ids:
+            if digest_id >= 0:
+                presence[digest_id] |= 1
+        for digest_id in index2.digest_ids:
+            if digest_id >= 0:
+                presence[digest_id] |= 2
+        
+        for index, unique, bit in ((index1, result.unique1, 1), (index2, result.unique2, 2)):
+            for i, digest_id in enumerate(index.digest_ids):
+                if digest_id == DIGEST_UNIQUE or (digest_id >= 0 and presence[digest_id] == bit):
+                    unique.append(i)
+        del presence
+        
+        # Emparejar rutas comunes por su clave entera: claves de index1 ordenadas
+        # en un array y búsqueda binaria, en lugar de un dict con un objeto por ruta
+        order1 = array('I', sorted((i for i in range(len(index1))
+                                    if index1.digest_ids[i] != DIGEST_UNREADABLE), key=index1.path_key))
+        keys1 = array('Q', map(index1.path_key, order1))
+        for j in range(len(index2)):
+            digest_id = index2.digest_ids[j]
+            if digest_id == DIGEST_UNREADABLE:
+                continue
+            key = index2.path_key(j)
+            pos = bisect_left(keys1, key)
+            if pos < len(keys1) and keys1[pos] == key:
+                i = order1[pos]
+                result.common1.append(i)
+                result.common2.append(j)
+                result.same.append((digest_id >= 0 or digest_id == DIGEST_PAIRED)
+                                   and digest_id == index1.digest_ids[i])
+        return result
+
+    def scan_and_resolve(self, directories):
+        """Recorre y hashea uno o más directorios en un índice compartido.
+        
+        Todos los árboles comparten PathTable y DigestTable, y cada archivo se
+        lee como mucho una vez, así que el coste es lineal en el total de
+        archivos. Cualquier directorio puede ser un manifiesto exportado con
+        export_manifest. Devuelve (índices, digests).
+        """
+        paths = PathTable()
+        digests = DigestTable()
+        
+        def load(directory):
+            if Manifest.is_manifest(directory):
+                return self.load_manifest_index(directory, paths, digests)
+            return self.build_index(directory, paths)
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(len(directories), self.workers))) as pool:
+            indexes = list(pool.map(load, directories))
+        for directory, index in zip(directories, indexes):
+            action = "Escaneados" if index.readable else "Cargados del manifiesto"
+            print(f"   ✅ {action} {len(index)} archivos en {directory}")
+        
+        print(f"\n🔍 Comparando contenido ({self.hash_algorithm}, prefiltro {self.prefilter_algorithm}, "
+              f"{self.workers} hilo(s))...")
+        caches = [self.open_cache(index.root) if index.readable else None for index in indexes]
+        try:
+            # Los digests Merkle persistidos permiten omitir subárboles idénticos en una comparación 1:1
+            trees = ([DirectoryTree(index) for index in indexes]
+                     if len(indexes) == 2 and None not in caches else None)
+            with self.phase('merkle'):
+                skipped = self.skip_identical_subtrees(trees, caches) if trees else {}
+            self.resolve_digests(indexes, caches, digests)
+            if trees:
+                with self.phase('merkle'):
+                    self.store_merkle_digests(trees, caches, digests, skipped)
+        finally:
+            for cache in caches:
+                if cache is not None:
+                    self.report_cache(cache)
+                    cache.close()
+        return indexes, digests
+
+    def skip_identical_subtrees(self, trees, caches):
+        """Marca como DIGEST_PAIRED los subárboles cuyo Merkle guardado coincide en ambos lados.
+        
+        Desciende desde la raíz solo por los directorios presentes en ambos
+        lados cuyos digests difieren o no se conocen. Devuelve {prefijo:
+        digest} de los subárboles omitidos.
+        """
+        for tree in trees:
+            tree.compute_stamps()
+        tree1, tree2 = trees
+        skipped = {}
+        stack = ['']
+        while stack:
+            prefix = stack.pop()
+            digest = caches[0].get_dir(prefix, tree1.stamps[prefix])
+            if digest is not None and digest == caches[1].get_dir(prefix, tree2.stamps[prefix]):
+                skipped[prefix] = digest
+                continue
+            stack.extend(child for child in tree1.children.get(prefix, ()) if child in tree2.stamps)
+        
+        if skipped:
+            files = 0
+            for tree in trees:
+                for prefix in skipped:
+                    for i in tree.subtree_positions(prefix):
+                        tree.index.digest_ids[i] = DIGEST_PAIRED
+                        files += 1
+            print(f"   🌳 {len(skipped)} subárbol(es) idéntico(s) según la caché: "
+                  f"{files // 2} archivos por lado sin comparar")
+        return skipped
+
+    def store_merkle_digests(self, trees, caches, digests, skipped):
+        """Guarda en la caché el digest Merkle de cada directorio completo fuera de `skipped`."""
+        for tree, cache in zip(trees, caches):
+            for prefix, digest in tree.merkle_digests(digests, skipped).items():
+                if digest is not None and prefix not in skipped:
+                    cache.put_dir(prefix, tree.stamps[prefix], digest, tree.newest[prefix])
+
+    def compare_directories(self, dir1, dir2):
+        """Compara dos directorios y devuelve un ComparisonResult compacto."""
+        print(f"\n🔍 Escaneando contenido de ambos directorios...")
+        (index1, index2), digests = self.scan_and_resolve([dir1, dir2])
+        result = self.compare_indexes(index1, index2, digests)
+        self.report_memory()
+        return result
+
+    def iter_version_matrix(self, indexes):
+        """Genera (ruta, versiones) para cada ruta presente en algún índice.
+        
+        versiones[k] es 0 si la ruta falta en el árbol k y, si no, el número
+        de versión de su contenido (1, 2, ...), numeradas en orden de árbol.
+        Cada índice se ordena por clave de ruta y se combinan con una mezcla
+        ordenada, sin construir un dict por ruta.
+        """
+        def sorted_entries(k, index):
+            order = sorted((i for i in range(len(index)) if index.digest_ids[i] != DIGEST_UNREADABLE),
+                           key=index.path_key)
+            return ((index.path_key(i), k, i) for i in order)
+        
+        merged = heapq.merge(*(sorted_entries(k, index) for k, index in enumerate(indexes)))
+        for _, group in groupby(merged, key=itemgetter(0)):
+            versions = [0] * len(indexes)
+            numbers = {}
+            path = None
+            for _, k, i in group:
+                index = indexes[k]
+                digest_id = index.digest_ids[i]
+                # El contenido descartado por el prefiltro no coincide con ningún otro
+                identity = digest_id if digest_id >= 0 else ('~', k)
+                versions[k] = numbers.setdefault(identity, len(numbers) + 1)
+                path = path or index.path(i)
+            yield path, versions
+
+    def compare_many(self, directories):
+        """Compara N directorios en una sola pasada y muestra la matriz de versiones.
+        
+        Devuelve un dict {ruta: versiones} solo con las rutas que no son
+        idénticas en todos los árboles.
+        """
+        print(f"\n🔍 Escaneando contenido de {len(directories)} directorios...")
+        indexes, _ = self.scan_and_resolve(directories)
+        
+        labels = [chr(ord('A') + k) if k < 26 else f"T{k + 1}" for k in range(len(directories))]
+        print("\n" + "="*60)
+        print("           COMPARACIÓN DE VARIOS DIRECTORIOS")
+        print("="*60)
+        for label, directory in zip(labels, directories):
+            print(f"   {label}: {directory}")
+        
+        identical = 0
+        differing = {}
+        with self.phase('compare'):
+            for path, versions in self.iter_version_matrix(indexes):
+                if all(version == 1 for version in versions):
+                    identical += 1
+                else:
+                    differing[path] = versions
+        
+        print(f"\n📊 ESTADÍSTICAS:")
+        print(f"   • Archivos idénticos en todos los directorios: {identical}")
+        print(f"   • Archivos con variantes o ausentes en algún directorio: {len(differing)}")
+        
+        if differing:
+            print(f"\n🔄 ARCHIVOS CON DIFERENCIAS ({len(differing)}):")
+            for path in sorted(differing):
+                versions = differing[path]
+                parts = []
+                for number in range(1, max(versions) + 1):
+                    trees = ','.join(label for label, version in zip(labels, versions) if version == number)
+                    parts.append(f"presente en {trees}" if max(versions) == 1 else f"versión {number} en {trees}")
+                missing = ','.join(label for label, version in zip(labels, versions) if version == 0)
+                if missing:
+                    parts.append(f"falta en {missing}")
+                print(f"   • {path}: {'; '.join(parts)}")
+        
+        self.report_memory()
+        return differing
+
+    def find_duplicates(self, directory):
+        """Busca archivos duplicados dentro de un solo árbol.
+        
+        Reutiliza el prefiltro de resolve_digests, así que los archivos de
+        tamaño único nunca se leen. Los archivos vacíos no cuentan, y los que
+        ya son enlaces duros entre sí cuentan como una sola copia. Devuelve
+        (índice, grupos), con cada grupo como (bytes desperdiciados, tamaño,
+        posiciones ordenadas por ruta), del mayor al menor desperdicio.
+        """
+        index = self.build_index(directory, PathTable())
+        print(f"   ✅ Escaneados {len(index)} archivos en {directory}")
+        digests = DigestTable()
+        cache = self.open_cache(directory)
+        try:
+            self.resolve_digests([index], [cache], digests)
+        finally:
+            if cache is not None:
+                self.report_cache(cache)
+                cache.close()
+        
+        by_digest = defaultdict(list)
+        for i, digest_id in enumerate(index.digest_ids):
+            if digest_id >= 0 and index.sizes[i]:
+                by_digest[digest_id].append(i)
+        
+        groups = []
+        for positions in by_digest.values():
+            inodes = {(index.devs[i], index.inodes[i]) for i in positions}
+            if len(inodes) > 1:
+                size = index.sizes[positions[0]]
+                groups.append(((len(inodes) - 1) * size, size, sorted(positions, key=index.path)))
+        groups.sort(key=lambda group: (-group[0], index.path(group[2][0])))
+        return index, groups
+
+    def dedupe(self, directory, mode='report', dry_run=False):
+        """Informa de los duplicados de un árbol y, según `mode`, los sustituye por enlaces.
+        
+        `mode` es 'report', 'hardlink' o 'reflink'. En cada grupo se conserva
+        el primer archivo por ruta y el resto se sustituye de forma atómica
+        (enlace temporal + os.replace) tras comprobar que no ha cambiado y
+        que su contenido coincide byte a byte. Con `dry_run` solo se informa.
+        Devuelve los bytes recuperados (o recuperables con `dry_run`).
+        """
+        if mode not in DEDUPE_MODES:
+            raise ValueError(f"Modo de deduplicación no soportado: {mode}")
+        print(f"\n🔍 Buscando duplicados en {directory}...")
+        index, groups = self.find_duplicates(directory)
+        wasted = sum(group[0] for group in groups)
+        # Como en find_duplicates, las rutas enlazadas entre sí son una sola copia
+        surplus = sum(len({(index.devs[i], index.inodes[i]) for i in group[2]}) - 1 for group in groups)
+        
+        print("\n" + "="*60)
+        print("           ARCHIVOS DUPLICADOS")
+        print("="*60)
+        print(f"\n📊 ESTADÍSTICAS:")
+        print(f"   • Grupos de duplicados: {len(groups)}")
+        print(f"   • Copias sobrantes: {surplus}")
+        print(f"   • Espacio recuperable: {wasted / (1024 * 1024):.1f} MB")
+        for group_wasted, size, positions in groups[:DEDUPE_REPORT_GROUPS]:
+            copies = group_wasted // size + 1
+            paths = f" en {len(positions)} rutas" if len(positions) != copies else ""
+            print(f"\n   📦 {copies} copias{paths} de {size / (1024 * 1024):.2f} MB "
+                  f"({group_wasted / (1024 * 1024):.2f} MB desperdiciados):")
+            for i in positions:
+                print(f"     • {index.path(i)}")
+        if len(groups) > DEDUPE_REPORT_GROUPS:
+            print(f"\n   ... y {len(groups) - DEDUPE_REPORT_GROUPS} grupos más")
+        
+        if mode == 'report':
+            return wasted
+        
+        print(f"\n🔗 {'Simulando la sustitución de' if dry_run else 'Sustituyendo'} duplicados por {mode}...")
+        replaced, reclaimed, errors = 0, 0, []
+        for _, size, positions in groups:
+            keep = positions[0]
+            kept_inode = (index.devs[keep], index.inodes[keep])
+            # Una copia (inodo) solo se recupera cuando se sustituyen todas sus rutas
+            by_inode = defaultdict(list)
+            for i in positions[1:]:
+                inode = (index.devs[i], index.inodes[i])
+                if inode != kept_inode:
+                    by_inode[inode].append(i)
+            for paths in by_inode.values():
+                complete = True
+                for i in paths:
+                    if dry_run:
+                        print(f"   • {index.path(i)} → {index.path(keep)}")
+                        continue
+                    try:
+                        self.replace_with_link(index.full_path(keep), index.full_path(i), index.record(i), mode)
+                    except (OSError, ValueError) as e:
+                        errors.append(f"{index.path(i)}: {e}")
+                        complete = False
+                if complete:
+                    replaced += 1
+                    reclaimed += size
+        
+        verb = "se sustituirían" if dry_run else "sustituidas"
+        print(f"   ✅ {replaced} copia(s) {verb}, {reclaimed / (1024 * 1024):.1f} MB recuperados"
+              f"{' (simulación)' if dry_run else ''}")
+        for error in errors:
+            print(f"   ❌ {error}")
+        return reclaimed
+
+    def replace_with_link(self, keep_path, path, record, mode):
+        """Sustituye `path` por un enlace duro o un reflink de `keep_path` de forma atómica."""
+        st = os.lstat(path)
+        if not stat.S_ISREG(st.st_mode) or (st.st_size, st.st_mtime_ns) != (record.size, record.mtime_ns):
+            raise ValueError("el archivo cambió desde el escaneo")
+        if os.stat(keep_path).st_dev != st.st_dev:
+            raise ValueError("está en otro sistema de archivos")
+        if not filecmp.cmp(keep_path, path, shallow=False):
+            raise ValueError("el contenido no coincide byte a byte")
+        
+        tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.dedupe-{os.getpid()}")
+        try:
+            if mode == 'hardlink':
+                os.link(keep_path, tmp_path)
+            else:
+                if fcntl is None:
+                    raise ValueError("reflink no disponible en este sistema")
+                with open(keep_path, 'rb') as fsrc, open(tmp_path, 'wb') as fdst:
+                    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                # Un reflink es un archivo propio: conserva los metadatos del original
+                shutil.copystat(path, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.lexists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def detect_moves(self, result):
+        """Detecta archivos movidos: mismo contenido, pero en rutas que no existen en el otro lado.
+        
+        Devuelve una lista ordenada de (ruta_en_dir1, ruta_en_dir2).
+        """
+        with self.phase('moves'):
+            return self._detect_moves(result)
+
+    def _detect_moves(self, result):
+        index1, index2 = result.index1, result.index2
+        matched1, matched2 = set(result.common1), set(result.common2)
+        
+        moved_from = defaultdict(list)
+        for i, digest_id in enumerate(index1.digest_ids):
+            if digest_id >= 0 and i not in matched1:
+                moved_from[digest_id].append(i)
+        
+        moved_to = defaultdict(list)
+        for j, digest_id in enumerate(index2.digest_ids):
+            if digest_id in moved_from and j not in matched2:
+                moved_to[digest_id].append(j)
+        
+        moves = []
+        for digest_id, targets in moved_to.items():
+            sources = sorted(index1.path(i) for i in moved_from[digest_id])
+            for source, target in zip(sources, sorted(index2.path(j) for j in targets)):
+                moves.append((source, target))
+        return sorted(moves)
+
+    def detect_renames(self, result, threshold=DEFAULT_RENAME_THRESHOLD):
+        """Empareja archivos movidos y además editados mediante MinHash + LSH.
+        
+        Solo se consideran los archivos de contenido único cuya ruta no existe
+        en el otro directorio. Las firmas se calculan en paralelo y las bandas
+        LSH limitan las comparaciones a pares candidatos, evitando el coste
+        cuadrático. Devuelve una lista de (ruta_en_dir1, ruta_en_dir2, similitud).
+        """
+        index1, index2 = result.index1, result.index2
+        matched1, matched2 = set(result.common1), set(result.common2)
+        candidates = [(1, i) for i in result.unique1 if i not in matched1]
+        candidates += [(2, j) for j in result.unique2 if j not in matched2]
+        if not any(side == 1 for side, _ in candidates) or not any(side == 2 for side, _ in candidates):
+            return []
+        
+        def sketch(candidate):
+            side, position = candidate
+            return minhash_signature((index1 if side == 1 else index2).full_path(position))
+        
+        def sketch_weight(candidate):
+            side, position = candidate
+            return min((index1 if side == 1 else index2).sizes[position], SIMILARITY_MAX_BYTES)
+        
+        signatures = {}
+        buckets = defaultdict(lambda: ([], []))
+        rows = MINHASH_SIZE // LSH_BANDS
+        with self.phase('renames', candidates, sketch_weight) as phase:
+            for candidate, signature in zip(candidates, self.parallel_map(sketch, candidates, sketch_weight, phase)):
+                if signature is None:
+                    continue
+                signatures[candidate] = signature
+                for band in range(LSH_BANDS):
+                    key = (band, signature[band * rows:(band + 1) * rows])
+                    buckets[key][candidate[0] - 1].append(candidate[1])
+        
+        pairs = {}
+        for left, right in buckets.values():
+            for i in left:
+                for j in right:
+                    if (i, j) not in pairs:
+                        pairs[(i, j)] = estimate_similarity(signatures[(1, i)], signatures[(2, j)])
+        
+        renames = []
+        used1, used2 = set(), set()
+        for (i, j), similarity in sorted(pairs.items(), key=lambda item: -item[1]):
+            if similarity < threshold or i in used1 or j in used2:
+                continue
+            used1.add(i)
+            used2.add(j)
+            renames.append((index1.path(i), index2.path(j), similarity))
+        return sorted(renames)
+
+    def chunk_similarities(self, result):
+        """Fracción de bloques compartidos de cada ruta con contenido diferente en ambos lados.
+        
+        Los archivos se trocean por contenido (iter_chunks) en paralelo.
+        Devuelve {ruta: fracción}; vacío si algún lado es un manifiesto.
+        """
+        index1, index2 = result.index1, result.index2
+        if not (index1.readable and index2.readable):
+            return {}
+        pairs = [(i, j) for i, j, same in zip(result.common1, result.common2, result.same) if not same]
+        
+        def signatures(pair):
+            i, j = pair
+            return chunk_signature(index1.full_path(i)), chunk_signature(index2.full_path(j))
+        
+        def pair_weight(pair):
+            i, j = pair
+            return index1.sizes[i] + index2.sizes[j]
+        
+        similarities = {}
+        with self.phase('chunks', pairs, pair_weight) as phase:
+            for (i, j), (signature1, signature2) in zip(pairs, self.parallel_map(signatures, pairs, pair_weight, phase)):
+                if signature1 is not None and signature2 is not None:
+                    similarities[index1.path(i)] = chunk_similarity(signature1, signature2)
+        return similarities
+
+    def report_memory(self):
+        """Muestra la memoria residente máxima alcanzada por el proceso."""
+        peak = get_peak_rss_bytes()
+        if peak is not None:
+            print(f"   📈 Memoria pico: {peak / (1024 * 1024):.1f} MB")
 
     def compare_by_content(self, dir1, dir2):
         """Compara dos directorios basándose en el contenido de los archivos."""
-        print(f"\n🔍 Escaneando contenido del primer directorio...")
-        content_map1, count1 = self.scan_directory_content(dir1)
-        print(f"   ✅ Escaneados {count1} archivos en el primer directorio")
+        return self.compare_directories(dir1, dir2).to_legacy()
+
+    def refresh_path(self, live, roots, side, path, force=False):
+        """Vuelve a leer una ruta de un lado y actualiza `live`; devuelve True si cambió.
         
-        print(f"\n🔍 Escaneando contenido del segundo directorio...")
-        content_map2, count2 = self.scan_directory_content(dir2)
-        print(f"   ✅ Escaneados {count2} archivos en el segundo directorio")
+        Sin `force` se omite el hash cuando tamaño y mtime no han cambiado.
+        """
+        full_path = os.path.join(roots[side], path)
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
+            return live.remove(side, path)
         
-        # Encontrar archivos únicos en cada directorio
-        unique_in_dir1 = {}
-        unique_in_dir2 = {}
+        entry = live.entries[side].get(path)
+        if not force and entry is not None and entry[:2] == (st.st_size, st.st_mtime_ns):
+            return False
+        digest = self.get_file_hash(full_path)
+        if digest is None:
+            return live.remove(side, path)
+        if entry is not None and entry[2] == digest:
+            live.entries[side][path] = (st.st_size, st.st_mtime_ns, digest)
+            return False
+        live.set(side, path, st.st_size, st.st_mtime_ns, digest)
+        return True
+
+    def rescan_tree(self, live, roots, side, prefix=''):
+        """Sincroniza `live` con un subárbol de un lado; devuelve las rutas que cambiaron."""
+        base = prefix + os.sep if prefix else ''
+        directory = os.path.join(roots[side], prefix) if prefix else roots[side]
+        seen = set()
+        changed = []
+        if os.path.isdir(directory):
+            for record in self.iter_files(roots[side], prefix):
+                path = record.path
+                seen.add(path)
+                if self.refresh_path(live, roots, side, path):
+                    changed.append((side, path))
+        stale = [path for path in live.entries[side] if path.startswith(base) and path not in seen]
+        for path in stale:
+            live.remove(side, path)
+            changed.append((side, path))
+        return changed
+
+    def report_watch(self, live, changed=(), elapsed=None):
+        """Muestra las rutas que cambiaron y el resumen actualizado."""
+        stamp = time.strftime('%H:%M:%S')
+        for side, path in changed:
+            print(f"   [{stamp}] dir{side + 1}/{path}: {live.status(side, path)}")
+        line = (f"📊 Únicos: {len(live.unique[0])} | {len(live.unique[1])} · "
+                f"conflictos: {len(live.conflicts)} · idénticos: {len(live.identical)}")
+        if elapsed is not None:
+            line += f" (actualizado en {elapsed * 1000:.1f} ms)"
+        print(line)
+
+    def watch(self, dir1, dir2, poll_interval=WATCH_POLL_INTERVAL):
+        """Mantiene viva la comparación de dos directorios mientras cambian.
         
-        all_hashes = set(content_map1.keys()) | set(content_map2.keys())
+        Tras un escaneo inicial completo (que aprovecha la caché), solo se
+        vuelven a hashear las rutas que notifica inotify; donde no hay
+        inotify se sondea con stat y se hashean las que cambiaron de tamaño
+        o mtime. Se detiene con Ctrl+C.
+        """
+        roots = (dir1, dir2)
+        live = LiveComparison()
+        print(f"\n🔍 Escaneando contenido de ambos directorios...")
+        for side, root in enumerate(roots):
+            records = self.collect_files(root)
+            for record, digest in zip(records, self.hash_records(root, records)):
+                if digest:
+                    live.set(side, record.path, record.size, record.mtime_ns, digest)
+            print(f"   ✅ Escaneados {len(records)} archivos en {root}")
+        self.report_watch(live)
         
-        for file_hash in all_hashes:
-            files1 = content_map1.get(file_hash, [])
-            files2 = content_map2.get(file_hash, [])
-            
-            if files1 and not files2:
-                unique_in_dir1[file_hash] = files1
-            elif files2 and not files1:
-                unique_in_dir2[file_hash] = files2
-        
-        # Encontrar archivos con mismo nombre pero diferente contenido
-        same_name_diff_content = []
-        
-        # Crear mapa nombre -> hash para cada directorio
-        name_to_hash1 = {}
-        for file_hash, files in content_map1.items():
-            for file in files:
-                name_to_hash1[file] = file_hash
-        
-        name_to_hash2 = {}
-        for file_hash, files in content_map2.items():
-            for file in files:
-                name_to_hash2[file] = file_hash
-        
-        # Comparar archivos con mismo nombre
-        common_names = set(name_to_hash1.keys()) & set(name_to_hash2.keys())
-        for filename in common_names:
-            if name_to_hash1[filename] != name_to_hash2[filename]:
-                same_name_diff_content.append(filename)
-        
-        return unique_in_dir1, unique_in_dir2, same_name_diff_content, name_to_hash1, name_to_hash2, content_map1, content_map2
-
-    def show_diff(self, file1_path, file2_path):
-        """Muestra las diferencias entre dos archivos al estilo git diff."""
         try:
-            with open(file1_path, 'r', encoding='utf-8') as f1:
-                lines1 = f1.readlines()
-        except UnicodeDecodeError:
+            watcher = InotifyWatcher(roots, self.exclusions)
+            print("\n👀 Vigilando cambios con inotify (Ctrl+C para salir)...")
+        except OSError as e:
+            watcher = None
+            print(f"\n👀 Vigilando cambios cada {poll_interval:g} s por sondeo ({e}; Ctrl+C para salir)...")
+        
+        try:
+            while True:
+                if watcher is None:
+                    time.sleep(poll_interval)
+                    start = time.perf_counter()
+                    changed = self.rescan_tree(live, roots, 0) + self.rescan_tree(live, roots, 1)
+                else:
+                    files, trees = watcher.read_changes()
+                    start = time.perf_counter()
+                    if watcher.overflowed:
+                        # Se perdieron eventos: solo un recorrido completo es fiable
+                        watcher.overflowed = False
+                        trees = {(0, ''), (1, '')}
+                    changed = []
+                    for side, prefix in sorted(trees):
+                        changed.extend(self.rescan_tree(live, roots, side, prefix))
+                    for side, path in sorted(files):
+                        if self.refresh_path(live, roots, side, path, force=True):
+                            changed.append((side, path))
+                if changed:
+                    self.report_watch(live, list(dict.fromkeys(changed)), time.perf_counter() - start)
+        except KeyboardInterrupt:
+            print("\n👋 Vigilancia detenida")
+        finally:
+            if watcher is not None:
+                watcher.close()
+
+    def show_diff(self, file1_path, file2_path, out=None):
+        """Muestra las diferencias entre dos archivos al estilo git diff.
+        
+        Las líneas se comparan como IDs enteros (patience diff con Myers
+        para las regiones sin anclas) y los hunks se muestran en cuanto se
+        encuentran. Si se supera el presupuesto de tiempo o tamaño se muestra
+        un resumen de líneas cambiadas en lugar del diff completo. Con `out`
+        se escribe ahí en lugar de en la salida estándar.
+        """
+        out = out or sys.stdout
+        files = []
+        for path in (file1_path, file2_path):
             try:
-                with open(file1_path, 'r', encoding='latin-1') as f1:
-                    lines1 = f1.readlines()
-            except:
-                print("    No se puede mostrar diff - archivo binario o codificación no soportada")
+                files.append(LineFile(path))
+            except (IOError, OSError, ValueError) as e:
+                print(f"    Error leyendo {path}: {e}", file=out)
+                for line_file in files:
+                    line_file.close()
                 return
-        except Exception as e:
-            print(f"    Error leyendo {file1_path}: {e}")
-            return
+        file1, file2 = files
         
         try:
-            with open(file2_path, 'r', encoding='utf-8') as f2:
-                lines2 = f2.readlines()
-        except UnicodeDecodeError:
+            if file1.is_binary or file2.is_binary:
+                print("    No se puede mostrar diff - archivo binario o codificación no soportada", file=out)
+                return
+            
+            print(f"\n    ┌─ Diferencias encontradas ─┐", file=out)
+            print(f"    │ Directorio 1: {os.path.basename(file1_path)}", file=out)
+            print(f"    │ Directorio 2: {os.path.basename(file2_path)}", file=out)
+            print(f"    └{'─' * (max(len(os.path.basename(file1_path)), len(os.path.basename(file2_path))) + 18)}┘", file=out)
+            
+            total_size = file1.size + file2.size
+            if total_size > self.diff_max_bytes:
+                print(f"    ⚠️  Archivos demasiado grandes para un diff detallado "
+                      f"({total_size / (1024 * 1024):.1f} MB): {file1.size} vs {file2.size} bytes", file=out)
+                return
+            
+            interner = {}
+            file1.index_lines(interner)
+            file2.index_lines(interner)
+            del interner
+            
+            deadline = time.monotonic() + self.diff_time_budget
+            diff_displayed = False
             try:
-                with open(file2_path, 'r', encoding='latin-1') as f2:
-                    lines2 = f2.readlines()
-            except:
-                print("    No se puede mostrar diff - archivo binario o codificación no soportada")
+                for a_start, a_len, b_start, b_len, lines in iter_diff_hunks(file1, file2, deadline):
+                    print(f"    @@ -{a_start},{a_len} +{b_start},{b_len} @@", file=out)
+                    for tag, text in lines:
+                        if tag == '+':
+                            print(f"    \033[92m+{text}\033[0m", file=out)  # Verde para adiciones
+                        elif tag == '-':
+                            print(f"    \033[91m-{text}\033[0m", file=out)  # Rojo para eliminaciones
+                        elif tag == '\\':
+                            print(f"    \\ {text}", file=out)
+                        else:
+                            print(f"     {text}", file=out)
+                    diff_displayed = True
+            except DiffBudgetExceeded:
+                counts1, counts2 = Counter(file1.ids), Counter(file2.ids)
+                removed = sum((counts1 - counts2).values())
+                added = sum((counts2 - counts1).values())
+                print(f"    ⏱️  Diff detallado interrumpido (presupuesto agotado): "
+                      f"al menos {removed} líneas eliminadas y {added} añadidas", file=out)
                 return
-        except Exception as e:
-            print(f"    Error leyendo {file2_path}: {e}")
-            return
-        
-        print(f"\n    ┌─ Diferencias encontradas ─┐")
-        print(f"    │ Directorio 1: {os.path.basename(file1_path)}")
-        print(f"    │ Directorio 2: {os.path.basename(file2_path)}")
-        print(f"    └{'─' * (max(len(os.path.basename(file1_path)), len(os.path.basename(file2_path))) + 18)}┘")
-        
-        diff = difflib.unified_diff(
-            lines1, lines2,
-            fromfile=os.path.basename(file1_path),
-            tofile=os.path.basename(file2_path),
-            lineterm=''
-        )
-        
-        diff_displayed = False
-        for line in diff:
-            if line.startswith('---') or line.startswith('+++'):
-                continue
-            if line.startswith('@@'):
-                print(f"    {line}")
-            elif line.startswith('+'):
-                print(f"    \033[92m{line}\033[0m")  # Verde para adiciones
-            elif line.startswith('-'):
-                print(f"    \033[91m{line}\033[0m")  # Rojo para eliminaciones
-            else:
-                print(f"    {line}")
-            diff_displayed = True
-        
-        if not diff_displayed:
-            print("    (No hay diferencias visibles en texto)")
+            
+            if not diff_displayed:
+                print("    (No hay diferencias visibles en texto)", file=out)
+        finally:
+            file1.close()
+            file2.close()
 
-    def show_file_preview(self, file_path, max_lines=10):
-        """Muestra una vista previa del contenido de un archivo."""
+    def show_file_preview(self, file_path, max_lines=10, out=None):
+        """Muestra una vista previa del contenido de un archivo (en `out` si se indica)."""
+        out = out or sys.stdout
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
                 lines = f.readlines()
-                print(f"\n    Vista previa de {os.path.basename(file_path)}:")
-                print("    " + "─" * 50)
+                print(f"\n    Vista previa de {os.path.basename(file_path)}:", file=out)
+                print("    " + "─" * 50, file=out)
                 for i, line in enumerate(lines[:max_lines]):
-                    print(f"    {i+1:3}: {line.rstrip()}")
+                    print(f"    {i+1:3}: {line.rstrip()}", file=out)
                 if len(lines) > max_lines:
-                    print(f"    ... y {len(lines) - max_lines} líneas más")
+                    print(f"    ... y {len(lines) - max_lines} líneas más", file=out)
         except UnicodeDecodeError:
             try:
                 with open(file_path, 'r', encoding='latin-1') as f:
                     lines = f.readlines()
-                    print(f"\n    Vista previa de {os.path.basename(file_path)} (latin-1):")
-                    print("    " + "─" * 50)
+                    print(f"\n    Vista previa de {os.path.basename(file_path)} (latin-1):", file=out)
+                    print("    " + "─" * 50, file=out)
                     for i, line in enumerate(lines[:max_lines]):
-                        print(f"    {i+1:3}: {line.rstrip()}")
+                        print(f"    {i+1:3}: {line.rstrip()}", file=out)
                     if len(lines) > max_lines:
-                        print(f"    ... y {len(lines) - max_lines} líneas más")
+                        print(f"    ... y {len(lines) - max_lines} líneas más", file=out)
             except:
-                print(f"    No se puede mostrar vista previa - archivo binario")
+                print(f"    No se puede mostrar vista previa - archivo binario", file=out)
         except Exception as e:
-            print(f"    Error mostrando vista previa: {e}")
+            print(f"    Error mostrando vista previa: {e}", file=out)
+
+    def render(self, func, *args):
+        """Ejecuta una función de visualización y devuelve su salida como texto."""
+        out = io.StringIO()
+        func(*args, out=out)
+        return out.getvalue()
+
+    def prepare_merge_item(self, dir1, dir2, base_dir, item):
+        """Prepara lo que se muestra de un elemento del merge interactivo.
+        
+        Devuelve (fusión de tres vías o None, texto de la vista previa o del
+        diff). Se ejecuta en segundo plano, por adelantado.
+        """
+        kind, filename = item
+        if kind != 'conflict':
+            return None, self.render(self.show_file_preview, os.path.join(dir1 if kind == 'dir1' else dir2, filename))
+        
+        file1_path = os.path.join(dir1, filename)
+        file2_path = os.path.join(dir2, filename)
+        # Intentar fusión de tres vías con el ancestro común
+        merged = None
+        base_path = os.path.join(base_dir, filename) if base_dir else None
+        if base_path and os.path.isfile(base_path):
+            merged = merge_three_way(base_path, file1_path, file2_path,
+                                     time_budget=self.diff_time_budget, max_bytes=self.diff_max_bytes)
+        if merged is not None and merged[1] == 0:
+            return merged, None
+        return merged, self.render(self.show_diff, file1_path, file2_path)
 
-    def merge_directories(self, dir1, dir2, merge_dir, unique1, unique2, same_name_diff, name_to_hash1, name_to_hash2, content_map1, content_map2):
-        """Crea un directorio mergeado permitiendo elegir qué archivos conservar."""
+    def merge_directories(self, dir1, dir2, merge_dir, unique1, unique2, same_name_diff, name_to_hash1, name_to_hash2, content_map1, content_map2, base_dir=None):
+        """Crea un directorio mergeado permitiendo elegir qué archivos conservar.
+        
+        Con `base_dir` (ancestro común) los archivos conflictivos se fusionan
+        primero línea a línea y solo se pregunta por los que tienen conflictos reales.
+        Las copias elegidas se hacen en segundo plano y las vistas previas y
+        diffs de los siguientes archivos se preparan mientras se pregunta
+        (MergePipeline), así que las preguntas no esperan al disco.
+        """
         print(f"\n🔄 Iniciando proceso de merge...")
         print(f"   Directorio de merge: {merge_dir}")
         
@@ -258,142 +3137,324 @@ class ContentDirectoryComparator:
         
         os.makedirs(merge_dir)
         
-        # Procesar archivos únicos del directorio 1
-        print(f"\n📁 Procesando archivos únicos del primer directorio...")
-        files_to_process = []
-        for file_hash, files in unique1.items():
-            for file in files:
-                files_to_process.append(('dir1', file, file_hash))
-        
-        for source, filename, file_hash in files_to_process:
-            src_path = os.path.join(dir1, filename)
-            dst_path = os.path.join(merge_dir, filename)
-            
-            print(f"\n   📄 Archivo único: {filename}")
-            print(f"   📍 Solo existe en el primer directorio")
+        sections = (
+            [('dir1', file) for files in unique1.values() for file in files],
+            [('dir2', file) for files in unique2.values() for file in files],
+            [('conflict', file) for file in same_name_diff],
+        )
+        pipeline = MergePipeline(self.workers)
+        try:
+            prepared = pipeline.prepared(lambda item: self.prepare_merge_item(dir1, dir2, base_dir, item),
+                                         chain.from_iterable(sections))
             
-            self.show_file_preview(src_path)
+            for source, files in zip(('dir1', 'dir2'), sections):
+                if source == 'dir1':
+                    print(f"\n📁 Procesando archivos únicos del primer directorio...")
+                else:
+                    print(f"\n📁 Procesando archivos únicos del segundo directorio...")
+                
+                for (_, filename), (_, preview) in islice(prepared, len(files)):
+                    src_path = os.path.join(dir1 if source == 'dir1' else dir2, filename)
+                    dst_path = os.path.join(merge_dir, filename)
+                    
+                    print(f"\n   📄 Archivo único: {filename}")
+                    print(f"   📍 Solo existe en el {'primer' if source == 'dir1' else 'segundo'} directorio")
+                    
+                    print(preview, end='')
+                    
+                    while True:
+                        print(f"\n    ¿Qué deseas hacer con este archivo?")
+                        print(f"    1. Copiar al directorio mergeado")
+                        print(f"    2. Omitir (no copiar)")
+                        print(f"    3. Ver vista previa otra vez")
+                        
+                        choice = input("\n    Tu elección (1-3): ").strip()
+                        
+                        if choice == '1':
+                            pipeline.copy(src_path, dst_path)
+                            print(f"    ✅ Archivo en cola de copia")
+                            break
+                        elif choice == '2':
+                            print(f"    ⏭️  Archivo omitido")
+                            break
+                        elif choice == '3':
+                            print(preview, end='')
+                        else:
+                            print("    ❌ Opción no válida")
             
-            while True:
-                print(f"\n    ¿Qué deseas hacer con este archivo?")
-                print(f"    1. Copiar al directorio mergeado")
-                print(f"    2. Omitir (no copiar)")
-                print(f"    3. Ver vista previa otra vez")
+            # Procesar archivos con mismo nombre pero diferente contenido
+            print(f"\n🔄 Procesando archivos con mismo nombre pero contenido diferente...")
+            for (_, filename), (merged, diff) in prepared:
+                file1_path = os.path.join(dir1, filename)
+                file2_path = os.path.join(dir2, filename)
+                merge_path = os.path.join(merge_dir, filename)
                 
-                choice = input("\n    Tu elección (1-3): ").strip()
+                print(f"\n   📄 Archivo conflictivo: {filename}")
+                print(f"   ⚠️  Existe en ambos directorios con contenido diferente")
                 
-                if choice == '1':
-                    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
-                    shutil.copy2(src_path, dst_path)
-                    print(f"    ✅ Archivo copiado")
-                    break
-                elif choice == '2':
-                    print(f"    ⏭️  Archivo omitido")
-                    break
-                elif choice == '3':
-                    self.show_file_preview(src_path)
-                else:
-                    print("    ❌ Opción no válida")
-        
-        # Procesar archivos únicos del directorio 2
-        print(f"\n📁 Procesando archivos únicos del segundo directorio...")
-        files_to_process = []
-        for file_hash, files in unique2.items():
-            for file in files:
-                files_to_process.append(('dir2', file, file_hash))
-        
-        for source, filename, file_hash in files_to_process:
-            src_path = os.path.join(dir2, filename)
-            dst_path = os.path.join(merge_dir, filename)
-            
-            print(f"\n   📄 Archivo único: {filename}")
-            print(f"   📍 Solo existe en el segundo directorio")
-            
-            self.show_file_preview(src_path)
-            
-            while True:
-                print(f"\n    ¿Qué deseas hacer con este archivo?")
-                print(f"    1. Copiar al directorio mergeado")
-                print(f"    2. Omitir (no copiar)")
-                print(f"    3. Ver vista previa otra vez")
+                if merged is not None and merged[1] == 0:
+                    pipeline.write(merge_path, merged[0])
+                    print(f"    ✅ Fusionado automáticamente (los cambios no se solapan)")
+                    continue
+                if merged is not None:
+                    print(f"    ⚠️  La fusión de tres vías deja {merged[1]} conflicto(s) real(es)")
                 
-                choice = input("\n    Tu elección (1-3): ").strip()
+                # Mostrar diferencias; las vistas previas se preparan por si se piden
+                print(diff, end='')
+                previews = (pipeline.submit(self.render, self.show_file_preview, file1_path),
+                            pipeline.submit(self.render, self.show_file_preview, file2_path))
                 
-                if choice == '1':
-                    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
-                    shutil.copy2(src_path, dst_path)
-                    print(f"    ✅ Archivo copiado")
-                    break
-                elif choice == '2':
-                    print(f"    ⏭️  Archivo omitido")
-                    break
-                elif choice == '3':
-                    self.show_file_preview(src_path)
-                else:
-                    print("    ❌ Opción no válida")
-        
-        # Procesar archivos con mismo nombre pero diferente contenido
-        print(f"\n🔄 Procesando archivos con mismo nombre pero contenido diferente...")
-        for filename in same_name_diff:
-            file1_path = os.path.join(dir1, filename)
-            file2_path = os.path.join(dir2, filename)
-            merge_path = os.path.join(merge_dir, filename)
+                # Preguntar al usuario
+                while True:
+                    print(f"\n    ¿Qué versión deseas conservar?")
+                    print(f"    1. Versión del primer directorio")
+                    print(f"    2. Versión del segundo directorio")
+                    print(f"    3. Ver diferencias otra vez")
+                    print(f"    4. Ver vista previa del primer directorio")
+                    print(f"    5. Ver vista previa del segundo directorio")
+                    print(f"    6. Saltar este archivo (no copiar)")
+                    if merged is not None:
+                        print(f"    7. Guardar la fusión con marcadores de conflicto ({merged[1]})")
+                    
+                    choice = input(f"\n    Tu elección (1-{7 if merged is not None else 6}): ").strip()
+                    
+                    if choice == '1':
+                        pipeline.copy(file1_path, merge_path)
+                        print(f"    ✅ Conservada versión del primer directorio")
+                        break
+                    elif choice == '2':
+                        pipeline.copy(file2_path, merge_path)
+                        print(f"    ✅ Conservada versión del segundo directorio")
+                        break
+                    elif choice == '3':
+                        print(diff, end='')
+                    elif choice == '4':
+                        print(previews[0].result(), end='')
+                    elif choice == '5':
+                        print(previews[1].result(), end='')
+                    elif choice == '6':
+                        print(f"    ⏭️  Archivo saltado")
+                        break
+                    elif choice == '7' and merged is not None:
+                        pipeline.write(merge_path, merged[0])
+                        print(f"    ✅ Guardada la fusión con marcadores de conflicto")
+                        break
+                    else:
+                        print("    ❌ Opción no válida")
             
-            print(f"\n   📄 Archivo conflictivo: {filename}")
-            print(f"   ⚠️  Existe en ambos directorios con contenido diferente")
+            # Copiar archivos idénticos (mismo nombre y mismo contenido)
+            print(f"\n📁 Copiando archivos idénticos en ambos directorios...")
+            common_files = set(name_to_hash1.keys()) & set(name_to_hash2.keys())
+            identical_files = [f for f in common_files if name_to_hash1[f] == name_to_hash2[f]]
             
-            # Mostrar diferencias
-            self.show_diff(file1_path, file2_path)
+            for filename in identical_files:
+                # Podría ser de dir1 o dir2, son iguales
+                pipeline.copy(os.path.join(dir1, filename), os.path.join(merge_dir, filename))
+                print(f"   ✅ {filename} (idéntico en ambos directorios)")
             
-            # Preguntar al usuario
-            while True:
-                print(f"\n    ¿Qué versión deseas conservar?")
-                print(f"    1. Versión del primer directorio")
-                print(f"    2. Versión del segundo directorio")
-                print(f"    3. Ver diferencias otra vez")
-                print(f"    4. Ver vista previa del primer directorio")
-                print(f"    5. Ver vista previa del segundo directorio")
-                print(f"    6. Saltar este archivo (no copiar)")
-                
-                choice = input("\n    Tu elección (1-6): ").strip()
-                
-                if choice == '1':
-                    os.makedirs(os.path.dirname(merge_path), exist_ok=True)
-                    shutil.copy2(file1_path, merge_path)
-                    print(f"    ✅ Conservada versión del primer directorio")
-                    break
-                elif choice == '2':
-                    os.makedirs(os.path.dirname(merge_path), exist_ok=True)
-                    shutil.copy2(file2_path, merge_path)
-                    print(f"    ✅ Conservada versión del segundo directorio")
-                    break
-                elif choice == '3':
-                    self.show_diff(file1_path, file2_path)
-                elif choice == '4':
-                    self.show_file_preview(file1_path)
-                elif choice == '5':
-                    self.show_file_preview(file2_path)
-                elif choice == '6':
-                    print(f"    ⏭️  Archivo saltado")
-                    break
+            print(f"\n⏳ Esperando a que terminen las copias...")
+            done, errors = pipeline.finish()
+        finally:
+            pipeline.close()
+        
+        print(f"   ✅ Copias completadas: {done}")
+        for error in errors:
+            print(f"   ❌ {error}")
+        print(f"\n🎉 Merge completado en: {merge_dir}")
+
+    def remove_stale(self, merge_dir, targets):
+        """Borra de un merge existente los archivos que no están en `targets` y los directorios vacíos."""
+        removed = 0
+        for dirpath, dirnames, filenames in os.walk(merge_dir, topdown=False):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if path not in targets:
+                    os.unlink(path)
+                    removed += 1
+            if dirpath != merge_dir and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+        if removed:
+            print(f"   🧹 Eliminados {removed} archivo(s) que ya no forman parte del merge")
+
+    def place_three_way(self, base_dir, path, file1_path, file2_path, dst, favor):
+        """Escribe en dst la fusión de tres vías de un archivo conflictivo.
+        
+        Si el archivo no se puede fusionar (binario, demasiado grande...) se
+        usa la versión favorecida, o se informa el error si no hay ninguna.
+        Devuelve (método, error) como place_file dentro de batch_merge.
+        """
+        merged = merge_three_way(os.path.join(base_dir, path), file1_path, file2_path, favor,
+                                 self.diff_time_budget, self.diff_max_bytes)
+        if merged is None:
+            if favor is None:
+                return None, f"{path}: no se pudo fusionar y no hay política para elegir versión"
+            return place_file(file1_path if favor == 'dir1' else file2_path, dst, 'copy'), None
+        
+        content, conflicts = merged
+        with open(dst, 'wb') as f:
+            f.write(content)
+        if conflicts and favor is None:
+            return 'fusión con marcadores', None
+        return 'fusión' if not conflicts else f'fusión ({favor} en conflictos)', None
+
+    def load_merge_plan(self, plan_path):
+        """Carga un plan de merge JSON: {"ruta/relativa": "dir1" | "dir2" | "skip"}."""
+        with open(plan_path, 'r', encoding='utf-8') as f:
+            raw_plan = json.load(f)
+        if not isinstance(raw_plan, dict):
+            raise ValueError("El plan de merge debe ser un objeto JSON {ruta: decisión}")
+        
+        plan = {}
+        for path, decision in raw_plan.items():
+            if decision not in ('dir1', 'dir2', 'skip'):
+                raise ValueError(f"Decisión no válida para {path}: {decision!r} (usa 'dir1', 'dir2' o 'skip')")
+            plan[os.path.normpath(path)] = decision
+        return plan
+
+    def choose_version(self, file1_path, file2_path, policy):
+        """Decide qué versión de un archivo conflictivo conservar según la política."""
+        if policy == 'prefer-dir1':
+            return 'dir1'
+        if policy == 'prefer-dir2':
+            return 'dir2'
+        st1, st2 = os.stat(file1_path), os.stat(file2_path)
+        if policy == 'prefer-newer':
+            return 'dir2' if st2.st_mtime_ns > st1.st_mtime_ns else 'dir1'
+        if policy == 'prefer-larger':
+            return 'dir2' if st2.st_size > st1.st_size else 'dir1'
+        return None
+
+    def batch_merge(self, dir1, dir2, merge_dir, result,
+                    policy=None, plan=None, link_mode='auto', overwrite=False, base_dir=None, update=False):
+        """Crea un directorio mergeado sin preguntas, guiado por una política o un plan.
+        
+        `result` es el ComparisonResult de compare_directories. El resultado
+        contiene la unión de las rutas de ambos directorios. Los conflictos se
+        resuelven con el plan y, si la ruta no figura en él, con la política;
+        sin ninguna de las dos el conflicto se omite. Con `base_dir` (ancestro
+        común) los conflictos se fusionan línea a línea y la política solo
+        decide los bloques en conflicto real; sin política, esos bloques
+        quedan con marcadores. Las copias se reparten entre los hilos de
+        trabajo. Con `update` se reutiliza un merge_dir existente: se borra
+        lo que ya no corresponde y los archivos grandes que cambiaron se
+        reconstruyen escribiendo solo sus bloques modificados (update_file).
+        """
+        if policy is not None and policy not in MERGE_POLICIES:
+            raise ValueError(f"Política de merge no soportada: {policy}")
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"Modo de enlace no soportado: {link_mode}")
+        plan = plan or {}
+        index1, index2 = result.index1, result.index2
+        
+        print(f"\n🔄 Iniciando merge automático...")
+        print(f"   Directorio de merge: {merge_dir}")
+        print(f"   Política: {policy or 'ninguna'} | Plan: {len(plan)} entrada(s) | Enlace: {link_mode}")
+        if base_dir is not None:
+            print(f"   Base (ancestro común): {base_dir}")
+        
+        if os.path.exists(merge_dir) and not update:
+            if not overwrite:
+                print(f"   ❌ El directorio {merge_dir} ya existe (usa --yes para sobrescribirlo o --update)")
+                return None
+            shutil.rmtree(merge_dir)
+        os.makedirs(merge_dir, exist_ok=True)
+        
+        # Cada ruta de la unión como (posición en dir1 o None, posición en dir2 o None, ¿idéntico?)
+        matched1 = {i: (j, same) for i, j, same in zip(result.common1, result.common2, result.same)}
+        matched2 = set(result.common2)
+        candidates = [(i, *matched1.get(i, (None, False))) for i in range(len(index1))
+                      if index1.digest_ids[i] != DIGEST_UNREADABLE]
+        candidates += [(None, j, False) for j in range(len(index2))
+                       if j not in matched2 and index2.digest_ids[j] != DIGEST_UNREADABLE]
+        del matched1, matched2
+        
+        # Operaciones como (lado, posición) o, para fusiones de tres vías,
+        # (3, posición en dir1, posición en dir2, lado favorecido en conflictos)
+        operations = []
+        skipped = []
+        for i, j, same in candidates:
+            path = index1.path(i) if i is not None else index2.path(j)
+            decision = plan.get(os.path.normpath(path))
+            if decision is None:
+                if j is None or same:
+                    decision = 'dir1'
+                elif i is None:
+                    decision = 'dir2'
                 else:
-                    print("    ❌ Opción no válida")
+                    favor = self.choose_version(index1.full_path(i), index2.full_path(j), policy)
+                    if base_dir is not None and os.path.isfile(os.path.join(base_dir, path)):
+                        operations.append((3, i, j, favor))
+                        continue
+                    decision = favor
+            elif (decision == 'dir1' and i is None) or (decision == 'dir2' and j is None):
+                print(f"   ⚠️  El plan elige {decision} para {path}, pero no existe ahí; se omite")
+                decision = None
+            
+            if decision == 'dir1':
+                operations.append((1, i))
+            elif decision == 'dir2':
+                operations.append((2, j))
+            else:
+                skipped.append(path)
+        del candidates
         
-        # Copiar archivos idénticos (mismo nombre y mismo contenido)
-        print(f"\n📁 Copiando archivos idénticos en ambos directorios...")
-        common_files = set(name_to_hash1.keys()) & set(name_to_hash2.keys())
-        identical_files = [f for f in common_files if name_to_hash1[f] == name_to_hash2[f]]
+        def paths_for(operation):
+            side, position = operation[:2]
+            index = index1 if side != 2 else index2
+            return index.full_path(position), os.path.join(merge_dir, index.path(position))
         
-        for filename in identical_files:
-            src = os.path.join(dir1, filename)  # Podría ser de dir1 o dir2, son iguales
-            dst = os.path.join(merge_dir, filename)
-            os.makedirs(os.path.dirname(dst), exist_ok=True)
-            shutil.copy2(src, dst)
-            print(f"   ✅ {filename} (idéntico en ambos directorios)")
+        if update:
+            self.remove_stale(merge_dir, {paths_for(op)[1] for op in operations})
+        for parent in sorted({os.path.dirname(paths_for(op)[1]) for op in operations}):
+            os.makedirs(parent, exist_ok=True)
+        
+        # (bytes escritos, tamaño) de cada archivo actualizado por bloques
+        deltas = []
+        
+        def place(operation):
+            src, dst = paths_for(operation)
+            try:
+                if operation[0] == 3:
+                    if update and os.path.lexists(dst):
+                        os.unlink(dst)
+                    return self.place_three_way(base_dir, index1.path(operation[1]), src,
+                                                index2.full_path(operation[2]), dst, operation[3])
+                if not update:
+                    return place_file(src, dst, link_mode), None
+                method, written = update_file(src, dst, link_mode)
+                if method == 'delta':
+                    deltas.append((written, os.path.getsize(dst)))
+                return method, None
+            except OSError as e:
+                return None, f"{src}: {e}"
+        
+        def place_weight(operation):
+            side, position = operation[:2]
+            return (index1 if side != 2 else index2).sizes[position]
         
+        methods = defaultdict(int)
+        errors = []
+        with self.phase('copy', operations, place_weight) as phase:
+            for method, error in self.parallel_map(place, operations, place_weight, phase):
+                if error:
+                    errors.append(error)
+                else:
+                    methods[method] += 1
+        
+        summary = ', '.join(f"{count} {method}" for method, count in sorted(methods.items())) or 'ninguno'
+        print(f"   ✅ Archivos colocados: {len(operations) - len(errors)} ({summary})")
+        if deltas:
+            written, total = (sum(values) for values in zip(*deltas))
+            print(f"   🧩 Actualizados por bloques: {len(deltas)} archivo(s), "
+                  f"{written / (1024 * 1024):.1f} de {total / (1024 * 1024):.1f} MB escritos")
+        print(f"   ⏭️  Archivos omitidos: {len(skipped)}")
+        for error in errors:
+            print(f"   ❌ {error}")
         print(f"\n🎉 Merge completado en: {merge_dir}")
+        return {'placed': dict(methods), 'skipped': skipped, 'errors': errors}
 
-    def display_content_results(self, unique1, unique2, same_name_diff, dir1, dir2):
+    def display_content_results(self, unique1, unique2, same_name_diff, dir1, dir2, moves=None, renames=None,
+                                similarities=None):
         """Muestra los resultados de la comparación por contenido."""
         print("\n" + "="*60)
         print("           RESULTADOS DE COMPARACIÓN POR CONTENIDO")
@@ -406,6 +3467,10 @@ class ContentDirectoryComparator:
         print(f"   • Archivos con contenido único en directorio 1: {total_unique1}")
         print(f"   • Archivos con contenido único en directorio 2: {total_unique2}")
         print(f"   • Archivos con mismo nombre pero contenido diferente: {len(same_name_diff)}")
+        if moves is not None:
+            print(f"   • Archivos movidos (mismo contenido, otra ruta): {len(moves)}")
+        if renames is not None:
+            print(f"   • Posibles renombrados con cambios: {len(renames)}")
         
         if total_unique1 > 0:
             print(f"\n📁 CONTENIDO ÚNICO EN PRIMER DIRECTORIO ({total_unique1} archivos):")
@@ -422,7 +3487,20 @@ class ContentDirectoryComparator:
         if same_name_diff:
             print(f"\n🔄 ARCHIVOS CON MISMO NOMBRE PERO CONTENIDO DIFERENTE ({len(same_name_diff)}):")
             for file in sorted(same_name_diff):
-                print(f"   • {file}")
+                if similarities and file in similarities:
+                    print(f"   • {file} ({similarities[file]:.0%} de bloques compartidos)")
+                else:
+                    print(f"   • {file}")
+        
+        if moves:
+            print(f"\n🚚 ARCHIVOS MOVIDOS ({len(moves)}):")
+            for source, target in moves:
+                print(f"   • {source} → {target}")
+        
+        if renames:
+            print(f"\n✏️  POSIBLES RENOMBRADOS CON CAMBIOS ({len(renames)}):")
+            for source, target, similarity in renames:
+                print(f"   • {source} → {target} ({similarity:.0%} similar)")
 
     def run(self):
         """Ejecuta el programa principal."""
@@ -448,8 +3526,10 @@ class ContentDirectoryComparator:
             
             try:
                 print(f"\n🔄 Iniciando comparación por contenido...")
-                unique1, unique2, same_name_diff, name_to_hash1, name_to_hash2, content_map1, content_map2 = self.compare_by_content(dir1, dir2)
-                self.display_content_results(unique1, unique2, same_name_diff, dir1, dir2)
+                result = self.compare_directories(dir1, dir2)
+                unique1, unique2, same_name_diff, name_to_hash1, name_to_hash2, content_map1, content_map2 = result.to_legacy()
+                self.display_content_results(unique1, unique2, same_name_diff, dir1, dir2,
+                                             self.detect_moves(result), self.detect_renames(result))
                 
                 # Ofrecer opción de merge
                 print(f"\n{'='*60}")
@@ -463,7 +3543,12 @@ class ContentDirectoryComparator:
                         merge_name = "merged_result"
                     
                     merge_dir = os.path.join(self.current_dir, merge_name)
-                    self.merge_directories(dir1, dir2, merge_dir, unique1, unique2, same_name_diff, name_to_hash1, name_to_hash2, content_map1, content_map2)
+                    base_name = input("Directorio base (ancestro común) para merge de tres vías (Enter para omitir): ").strip()
+                    base_dir = os.path.join(self.current_dir, base_name) if base_name else None
+                    if base_dir and not os.path.isdir(base_dir):
+                        print(f"   ⚠️  {base_dir} no es un directorio; se hará merge de dos vías")
+                        base_dir = None
+                    self.merge_directories(dir1, dir2, merge_dir, unique1, unique2, same_name_diff, name_to_hash1, name_to_hash2, content_map1, content_map2, base_dir)
                 
             except Exception as e:
                 print(f"❌ Error durante la comparación: {e}")
@@ -475,8 +3560,187 @@ class ContentDirectoryComparator:
                 break
 
 def main():
-    comparator = ContentDirectoryComparator()
-    comparator.run()
+    parser = argparse.ArgumentParser(description="Comparador y merge de directorios por contenido.")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="No usar la caché persistente de hashes")
+    parser.add_argument('--clear-cache', action='store_true',
+                        help="Invalidar la caché de hashes antes de comenzar")
+    parser.add_argument('--cache-dir', default=None,
+                        help=f"Directorio de la caché (por defecto: {get_default_cache_dir()})")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"Hilos de hashing en paralelo (por defecto: {DEFAULT_WORKERS}; 1 = secuencial)")
+    parser.add_argument('--hash', dest='hash_algorithm', default=None, choices=sorted(HASH_ALGORITHMS),
+                        help="Algoritmo del hash completo (por defecto: md5, o el de los manifiestos)")
+    parser.add_argument('--prefilter-hash', default=DEFAULT_PREFILTER_ALGORITHM,
+                        choices=sorted(PREFILTER_ALGORITHMS),
+                        help=f"Algoritmo del hash parcial (por defecto: {DEFAULT_PREFILTER_ALGORITHM})")
+    parser.add_argument('--exclude', action='append', default=[], metavar='PATRÓN',
+                        help="Excluir rutas con un patrón de sintaxis .gitignore (repetible; '!patrón' "
+                             "reincluye, p. ej. '!build/')")
+    parser.add_argument('--no-ignore-files', action='store_true',
+                        help="No leer los archivos .gitignore e .ignore de los directorios")
+    parser.add_argument('dirs', nargs='*', metavar='DIR',
+                        help="Directorios o manifiestos a comparar sin menú interactivo "
+                             "(dos, o más para el modo N-way)")
+    parser.add_argument('--export-manifest', metavar='ARCHIVO',
+                        help="Guardar el escaneo del único DIR indicado como manifiesto binario")
+    parser.add_argument('--dedupe', action='store_true',
+                        help="Buscar archivos duplicados dentro del único DIR indicado")
+    parser.add_argument('--dedupe-link', choices=DEDUPE_MODES[1:],
+                        help="Con --dedupe, sustituir los duplicados por enlaces duros o reflinks")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Con --dedupe, mostrar qué se sustituiría sin tocar nada")
+    parser.add_argument('--merge', metavar='DIR_MERGE',
+                        help="Crear un directorio mergeado sin preguntas (requiere --policy o --plan)")
+    parser.add_argument('--policy', choices=MERGE_POLICIES,
+                        help="Política para resolver conflictos en el merge automático")
+    parser.add_argument('--plan', metavar='PLAN_JSON',
+                        help="Plan de merge explícito {ruta: 'dir1' | 'dir2' | 'skip'}")
+    parser.add_argument('--link', choices=LINK_MODES, default='auto',
+                        help="Cómo colocar los archivos en el merge (por defecto: auto = reflink o copia en kernel)")
+    parser.add_argument('--base', metavar='DIR_BASE',
+                        help="Ancestro común para fusionar línea a línea los archivos conflictivos")
+    parser.add_argument('--yes', action='store_true',
+                        help="Sobrescribir el directorio de merge si ya existe")
+    parser.add_argument('--update', action='store_true',
+                        help="Actualizar un directorio de merge existente escribiendo solo los bloques "
+                             "que cambian en los archivos grandes")
+    parser.add_argument('--chunk-similarity', action='store_true',
+                        help="Indicar el porcentaje de bloques compartidos de cada archivo con contenido diferente")
+    parser.add_argument('--rename-threshold', type=float, default=DEFAULT_RENAME_THRESHOLD,
+                        help=f"Similitud mínima para emparejar renombrados con cambios "
+                             f"(por defecto: {DEFAULT_RENAME_THRESHOLD}; 0 = desactivado)")
+    parser.add_argument('--matrix-json', metavar='ARCHIVO',
+                        help="En el modo N-way, guardar la matriz de versiones en JSON")
+    parser.add_argument('--watch', action='store_true',
+                        help="Mantener la comparación activa y actualizarla al cambiar los archivos")
+    parser.add_argument('--poll-interval', type=float, default=WATCH_POLL_INTERVAL,
+                        help=f"Segundos entre sondeos de --watch si no hay inotify "
+                             f"(por defecto: {WATCH_POLL_INTERVAL:g})")
+    parser.add_argument('--diff-timeout', type=float, default=DIFF_TIME_BUDGET,
+                        help=f"Segundos máximos para un diff detallado (por defecto: {DIFF_TIME_BUDGET:g})")
+    parser.add_argument('--diff-max-mb', type=float, default=DIFF_MAX_BYTES / (1024 * 1024),
+                        help="Tamaño máximo (MB, ambos archivos) para un diff detallado")
+    parser.add_argument('--progress', action=argparse.BooleanOptionalAction, default=None,
+                        help="Mostrar una línea de progreso con archivos, bytes y ETA "
+                             "(por defecto: solo si la salida de error es una terminal)")
+    parser.add_argument('--metrics-json', metavar='ARCHIVO',
+                        help="Guardar al terminar los contadores y tiempos por fase e hilo en JSON")
+    parser.add_argument('--profile', metavar='ARCHIVO',
+                        help="Perfilar la ejecución con cProfile y guardar las estadísticas "
+                             "(solo el hilo principal; combínalo con --workers 1)")
+    args = parser.parse_args()
+    if args.export_manifest and len(args.dirs) != 1:
+        parser.error("--export-manifest requiere indicar exactamente un directorio")
+    if args.dedupe and (len(args.dirs) != 1 or args.export_manifest):
+        parser.error("--dedupe requiere indicar exactamente un directorio")
+    if (args.dry_run or args.dedupe_link) and not args.dedupe:
+        parser.error("--dedupe-link y --dry-run requieren --dedupe")
+    if len(args.dirs) == 1 and not (args.export_manifest or args.dedupe):
+        parser.error("indica al menos dos directorios")
+    manifests = [d for d in args.dirs if not os.path.isdir(d) and Manifest.is_manifest(d)]
+    for d in args.dirs:
+        if not os.path.isdir(d) and d not in manifests:
+            parser.error(f"{d} no es un directorio ni un manifiesto")
+    if manifests and (args.merge or args.watch or args.export_manifest or args.dedupe):
+        parser.error("--merge, --watch, --export-manifest y --dedupe necesitan directorios, no manifiestos")
+    manifest_algorithms = set()
+    for d in manifests:
+        try:
+            manifest = Manifest(d)
+        except ValueError as e:
+            parser.error(str(e))
+        manifest_algorithms.add(manifest.algorithm)
+        manifest.close()
+    if len(manifest_algorithms) > 1:
+        parser.error("los manifiestos usan algoritmos de hash distintos")
+    if manifest_algorithms:
+        algorithm = manifest_algorithms.pop()
+        if args.hash_algorithm not in (None, algorithm):
+            parser.error(f"los manifiestos usan {algorithm}; no se pueden comparar con --hash {args.hash_algorithm}")
+        args.hash_algorithm = algorithm
+    args.hash_algorithm = args.hash_algorithm or 'md5'
+    if args.update and not args.merge:
+        parser.error("--update requiere --merge")
+    if args.merge and len(args.dirs) != 2:
+        parser.error("--merge requiere indicar exactamente dos directorios")
+    if args.merge and not (args.policy or args.plan or args.base):
+        parser.error("--merge requiere --policy, --plan o --base")
+    if args.watch and (len(args.dirs) != 2 or args.merge):
+        parser.error("--watch requiere exactamente dos directorios y no admite --merge")
+    
+    progress = sys.stderr.isatty() if args.progress is None else args.progress
+    instrumentation = Instrumentation(progress) if progress or args.metrics_json else None
+    comparator = ContentDirectoryComparator(use_cache=not args.no_cache, cache_dir=args.cache_dir,
+                                            workers=args.workers, hash_algorithm=args.hash_algorithm,
+                                            prefilter_algorithm=args.prefilter_hash,
+                                            diff_time_budget=args.diff_timeout,
+                                            diff_max_bytes=int(args.diff_max_mb * 1024 * 1024),
+                                            instrumentation=instrumentation, exclude=args.exclude,
+                                            use_ignore_files=not args.no_ignore_files)
+    if args.clear_cache:
+        comparator.invalidate_cache()
+    
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        run_cli(comparator, args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f"💾 Perfil guardado en: {args.profile} (ábrelo con: python -m pstats {args.profile})")
+        if instrumentation is not None and args.dirs:
+            instrumentation.report()
+        if args.metrics_json:
+            instrumentation.dump(args.metrics_json)
+
+
+def run_cli(comparator, args):
+    """Ejecuta el modo pedido en la línea de órdenes con un comparador ya configurado."""
+    if not args.dirs:
+        comparator.run()
+        return
+    
+    if args.export_manifest:
+        comparator.export_manifest(os.path.abspath(args.dirs[0]), args.export_manifest)
+        return
+    
+    if args.dedupe:
+        comparator.dedupe(os.path.abspath(args.dirs[0]), args.dedupe_link or 'report', args.dry_run)
+        return
+    
+    if len(args.dirs) > 2:
+        directories = [os.path.abspath(d) for d in args.dirs]
+        differing = comparator.compare_many(directories)
+        if args.matrix_json:
+            with open(args.matrix_json, 'w', encoding='utf-8') as f:
+                json.dump({'directories': directories, 'algorithm': comparator.hash_algorithm,
+                           'files': {path: differing[path] for path in sorted(differing)}}, f, ensure_ascii=False, indent=2)
+            print(f"\n💾 Matriz guardada en: {args.matrix_json}")
+        return
+    
+    dir1, dir2 = (os.path.abspath(d) for d in args.dirs)
+    if args.watch:
+        comparator.watch(dir1, dir2, args.poll_interval)
+        return
+    
+    result = comparator.compare_directories(dir1, dir2)
+    # Los renombrados con cambios necesitan leer ambos lados, no solo sus digests
+    renames = None
+    if args.rename_threshold > 0 and result.index1.readable and result.index2.readable:
+        renames = comparator.detect_renames(result, args.rename_threshold)
+    similarities = comparator.chunk_similarities(result) if args.chunk_similarity else None
+    comparator.display_content_results(result.unique_paths(1), result.unique_paths(2),
+                                       result.conflict_paths(), dir1, dir2,
+                                       comparator.detect_moves(result), renames, similarities)
+    if args.merge:
+        plan = comparator.load_merge_plan(args.plan) if args.plan else None
+        comparator.batch_merge(dir1, dir2, os.path.abspath(args.merge), result,
+                               policy=args.policy, plan=plan, link_mode=args.link, overwrite=args.yes,
+                               base_dir=os.path.abspath(args.base) if args.base else None,
+                               update=args.update)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file